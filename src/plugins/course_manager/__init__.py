@@ -1,3 +1,6 @@
+import asyncio
+import importlib
+
 from nonebot import get_driver
 from nonebot.plugin import PluginMetadata
 
@@ -6,6 +9,7 @@ from nonebot.plugin import PluginMetadata
 from . import handlers
 
 # 2. 导入数据管理器，用于启动时加载数据
+from .config import config
 from .data_loader import course_manager
 
 # 3. 定义插件元数据 (可选，但在 nb plugin list 中好看)
@@ -27,9 +31,36 @@ __plugin_meta__ = PluginMetadata(
 # 当 NoneBot 启动完成后，立刻加载课程数据
 driver = get_driver()
 
+# 持有后台任务引用，避免被 GC 提前回收
+_load_task: asyncio.Task | None = None
+_warm_task: asyncio.Task | None = None
+
+
+async def _warm_rag():
+    # 先等课程数据加载完，避免和 TOML 解析抢 CPU；langchain 的 import 本身也很重，放到线程里
+    if _load_task is not None:
+        await asyncio.wait([_load_task])
+    try:
+        rag = await asyncio.to_thread(importlib.import_module, ".rag_engine", __name__)
+    except Exception as e:
+        print(f"⚠️ RAG 模块导入失败，跳过预热: {e}")
+        return
+    await rag.rag_engine.warm()
+
+
 @driver.on_startup
 async def _():
-    # 加载课程 JSON/TOML
-    course_manager.load_data()
+    global _load_task, _warm_task
+    # 加载课程 JSON/TOML：放到后台线程，bot 可立即开始响应；查询指令会等待加载完成
+    _load_task = asyncio.create_task(course_manager.load_data_async())
+
+    # RAG 预热：后台加载 Embedding/向量库，首个 /问 不必再等模型加载
+    if config.RAG_WARMUP and config.AI_API_KEY:
+        _warm_task = asyncio.create_task(_warm_rag())
+
 
-    # 提示：RAG 引擎为懒加载，仅在首次使用 /问 或 /重构知识库 时初始化。
+@driver.on_shutdown
+async def _shutdown():
+    if _warm_task is not None and not _warm_task.done():
+        _warm_task.cancel()
+    await course_manager.close()
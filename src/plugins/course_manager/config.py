@@ -1,8 +1,11 @@
 import os
+from functools import lru_cache
 from pathlib import Path
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
+# 环境变量在进程生命周期内视为不变：缓存结果，重复读取只查一次字典
+@lru_cache(maxsize=None)
 def _env(key: str, default: str | None = None) -> str | None:
     value = os.getenv(key)
     if value is None:
@@ -25,66 +28,132 @@ def _fallback_dir() -> Path | None:
     return Path(raw).expanduser() if raw else None
 
 class Config(BaseModel):
+    # 所有环境变量都通过 default_factory 在实例化时读取，而不是在类定义（import）时求值。
+
     # --- 基础路径配置 ---
     # 假设运行目录在项目根目录
-    DATA_ROOT: Path = Path(_env("HITSZ_MANAGER_DATA_ROOT", "data") or "data")
-    
-    # 课程数据路径
-    COURSE_DIR: Path = DATA_ROOT / "courses"
-    REPO_DIR: Path = COURSE_DIR / (_env("HITSZ_MANAGER_COURSE_REPO_DIR", "Allrepo-temp") or "Allrepo-temp")
+    DATA_ROOT: Path = Field(default_factory=lambda: Path(_env("HITSZ_MANAGER_DATA_ROOT", "data") or "data"))
+
+    # 课程仓库目录名（旧模式单仓库，位于 COURSE_DIR 下）
+    REPO_DIR_NAME: str = Field(
+        default_factory=lambda: _env("HITSZ_MANAGER_COURSE_REPO_DIR", "Allrepo-temp") or "Allrepo-temp"
+    )
 
     # 可选：课程数据备份兜底目录（只读亦可）。当 COURSE_DIR 中找不到可用 toml 时，会从这里补充。
     # 典型用法：把宿主机的精简 readme.toml 目录挂载到容器 /seed/courses，然后设置本变量。
-    COURSE_FALLBACK_DIR: Path | None = _fallback_dir()
-    
+    COURSE_FALLBACK_DIR: Path | None = Field(default_factory=_fallback_dir)
+
+    # --- 以下路径都派生自 DATA_ROOT ---
+    # 课程数据路径
+    @property
+    def COURSE_DIR(self) -> Path:
+        return self.DATA_ROOT / "courses"
+
+    @property
+    def REPO_DIR(self) -> Path:
+        return self.COURSE_DIR / self.REPO_DIR_NAME
+
+    # 课程索引缓存：记录各 toml 的 mtime/size，文件未变化时重启可跳过解析
+    @property
+    def COURSE_INDEX_CACHE(self) -> Path:
+        return self.DATA_ROOT / ".course_index.pkl"
+
     # RAG 相关路径
-    RAG_DOCS_DIR: Path = DATA_ROOT / "rag_docs"    # 放 txt 的地方
-    VECTOR_DB_DIR: Path = DATA_ROOT / "chroma_db"  # ChromaDB 存储路径
-    
+    @property
+    def RAG_DOCS_DIR(self) -> Path:
+        return self.DATA_ROOT / "rag_docs"  # 放 txt 的地方
+
+    @property
+    def VECTOR_DB_DIR(self) -> Path:
+        return self.DATA_ROOT / "chroma_db"  # ChromaDB 存储路径
+
+    # 知识库清单：记录已入库 txt 的 mtime/size/片段数，/重构知识库 只重新 embed 变化的文件
+    @property
+    def RAG_MANIFEST_FILE(self) -> Path:
+        return self.DATA_ROOT / ".rag_manifest.json"
+
     # 昵称存储
-    NICKNAME_FILE: Path = DATA_ROOT / "nicknames.json"
+    @property
+    def NICKNAME_FILE(self) -> Path:
+        return self.DATA_ROOT / "nicknames.json"
+
+    # toml 同步模式的 ETag 缓存（未变化的仓库只需 304）
+    @property
+    def TOML_ETAG_FILE(self) -> Path:
+        return self.DATA_ROOT / "toml_etags.json"
 
     # --- Git 配置 ---
-    REPO_URL: str = _env("HITSZ_MANAGER_COURSE_REPO_URL", "https://github.com/LiPu-jpg/Allrepo-temp.git") or ""
+    REPO_URL: str = Field(default_factory=lambda: _env("HITSZ_MANAGER_COURSE_REPO_URL", "https://github.com/LiPu-jpg/Allrepo-temp.git") or "")
 
     # --- GitHub Org 同步配置（推荐） ---
     # 若设置为非空，则 /刷 会从 GitHub Org 枚举仓库并同步到 data/courses/<repo_name>/
     # 过滤规则（按你当前约定）：仓库名首字符大写，且不包含 '-'
-    GITHUB_ORG: str = _env_any(["HITSZ_MANAGER_GITHUB_ORG", "GITHUB_ORG"], "HITSZ-OpenAuto") or ""
+    GITHUB_ORG: str = Field(default_factory=lambda: _env_any(["HITSZ_MANAGER_GITHUB_ORG", "GITHUB_ORG"], "HITSZ-OpenAuto") or "")
     # 兼容：很多部署习惯把 token 命名为 GITHUB_TOKEN（prServer 也用这个）。
     # 若未提供 token，会以匿名方式调用 GitHub API，极易触发 403 rate limit。
-    GITHUB_TOKEN: str = _env_any(["HITSZ_MANAGER_GITHUB_TOKEN", "GITHUB_TOKEN"], "") or ""
-    GITHUB_API_BASE: str = _env("HITSZ_MANAGER_GITHUB_API_BASE", "https://api.github.com") or ""
+    GITHUB_TOKEN: str = Field(default_factory=lambda: _env_any(["HITSZ_MANAGER_GITHUB_TOKEN", "GITHUB_TOKEN"], "") or "")
+    GITHUB_API_BASE: str = Field(default_factory=lambda: _env("HITSZ_MANAGER_GITHUB_API_BASE", "https://api.github.com") or "")
     # 默认并发略保守，降低触发 429 的概率；需要更快可通过环境变量调高。
-    GIT_SYNC_CONCURRENCY: int = int(_env("HITSZ_MANAGER_GIT_SYNC_CONCURRENCY", "2") or 2)
+    GIT_SYNC_CONCURRENCY: int = Field(default_factory=lambda: int(_env("HITSZ_MANAGER_GIT_SYNC_CONCURRENCY", "2") or 2))
+
+    # toml 模式下的并发（纯 HTTP 请求，HTTP/2 可多路复用，默认比 git 模式高）
+    TOML_SYNC_CONCURRENCY: int = Field(default_factory=lambda: int(_env("HITSZ_MANAGER_TOML_SYNC_CONCURRENCY", "8") or 8))
+
+    # /刷 与 /重构知识库 的冷却时间（秒）：上次成功后这段时间内重复触发直接返回上次结果；0 表示不限制
+    REFRESH_COOLDOWN: float = Field(default_factory=lambda: float(_env("HITSZ_MANAGER_REFRESH_COOLDOWN", "300") or 300))
 
     # clone 提速：默认浅克隆，仅拉取最近提交；设为 0 可禁用（全量 clone）
-    GIT_CLONE_DEPTH: int = int(_env("HITSZ_MANAGER_GIT_CLONE_DEPTH", "1") or 1)
+    GIT_CLONE_DEPTH: int = Field(default_factory=lambda: int(_env("HITSZ_MANAGER_GIT_CLONE_DEPTH", "1") or 1))
+
+    # git clone/fetch 的超时（秒）：0 表示不限制（默认；慢速网络下全量 clone 可能要很久）
+    GIT_NETWORK_TIMEOUT: float = Field(default_factory=lambda: float(_env("HITSZ_MANAGER_GIT_NETWORK_TIMEOUT", "0") or 0))
+
+    # 启动时解析 readme.toml 的进程数：0=按 CPU 核数自动；1=串行（不起进程池）
+    PARSE_WORKERS: int = Field(default_factory=lambda: int(_env("HITSZ_MANAGER_PARSE_WORKERS", "0") or 0))
 
     # 同步模式：
     # - git: clone/pull 仓库（默认；兼容历史结构，但国内可能慢）
     # - toml: 只下载根目录 readme.toml（更快；依赖 GitHub API/Raw，可能受限流影响）
-    GIT_SYNC_MODE: str = (_env("HITSZ_MANAGER_GIT_SYNC_MODE", "git") or "git").strip().lower()
+    GIT_SYNC_MODE: str = Field(default_factory=lambda: (_env("HITSZ_MANAGER_GIT_SYNC_MODE", "git") or "git").strip().lower())
 
     # --- LLM 配置 (Gemini via OneAPI/NewAPI) ---
     # 注意：不要把 key 写进代码。请用环境变量配置：HITSZ_MANAGER_AI_API_KEY
-    AI_API_KEY: str = _env("HITSZ_MANAGER_AI_API_KEY", "") or ""
-    AI_BASE_URL: str = _env("HITSZ_MANAGER_AI_BASE_URL", "https://api.n1n.ai/v1") or ""
-    AI_MODEL: str = _env("HITSZ_MANAGER_AI_MODEL", "gemini-2.5-pro") or ""
+    AI_API_KEY: str = Field(default_factory=lambda: _env("HITSZ_MANAGER_AI_API_KEY", "") or "")
+    AI_BASE_URL: str = Field(default_factory=lambda: _env("HITSZ_MANAGER_AI_BASE_URL", "https://api.n1n.ai/v1") or "")
+    AI_MODEL: str = Field(default_factory=lambda: _env("HITSZ_MANAGER_AI_MODEL", "gemini-2.5-pro") or "")
     
     # Embedding 模型路径或名称 (HuggingFace)
     # 2G 内存推荐使用轻量级模型
-    EMBEDDING_MODEL: str = _env(
-        "HITSZ_MANAGER_EMBEDDING_MODEL",
-        "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-    ) or ""
+    EMBEDDING_MODEL: str = Field(
+        default_factory=lambda: _env(
+            "HITSZ_MANAGER_EMBEDDING_MODEL",
+            "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+        ) or ""
+    )
+
+    # 启动后是否在后台预热 RAG（加载 Embedding/向量库）。内存紧张时可设为 0，改回首次 /问 时加载。
+    # 未配置 AI_API_KEY 时不会预热。
+    RAG_WARMUP: bool = Field(default_factory=lambda: (_env("HITSZ_MANAGER_RAG_WARMUP", "1") or "1") not in ("0", "false", "no"))
+
+    # Embedding 推理后端：torch（默认）/ onnx / onnx-int8。
+    # onnx 系列需要 sentence-transformers[onnx]>=3.2；缺依赖时自动回退到 torch。
+    # onnx-int8 首次使用会把动态量化后的模型导出到 DATA_ROOT/hf_cache/onnx_int8/ 下，之后直接复用。
+    EMBEDDING_BACKEND: str = Field(default_factory=lambda: (_env("HITSZ_MANAGER_EMBEDDING_BACKEND", "torch") or "torch").strip().lower())
+
+    # 可选：/问 检索后的 cross-encoder 重排模型（如 BAAI/bge-reranker-v2-m3）。
+    # 为空则不重排；模型较大，内存紧张的机器不建议开启。
+    RERANK_MODEL: str = Field(default_factory=lambda: _env("HITSZ_MANAGER_RERANK_MODEL", "") or "")
 
     # 可选：HuggingFace 镜像（例如 https://hf-mirror.com）
-    HF_ENDPOINT: str = _env("HITSZ_MANAGER_HF_ENDPOINT", "") or ""
+    HF_ENDPOINT: str = Field(default_factory=lambda: _env("HITSZ_MANAGER_HF_ENDPOINT", "") or "")
+
+@lru_cache(maxsize=None)
+def get_config() -> Config:
+    """全局唯一的 Config 实例；重复调用不会重新读取环境变量。"""
+    return Config()
+
 
-config = Config()
+config = get_config()
 
-# 自动创建必要的文件夹
-config.RAG_DOCS_DIR.mkdir(parents=True, exist_ok=True)
+# 课程目录启动即会用到；RAG 目录在首次使用 RAG 时再创建（见 rag_engine）
 config.COURSE_DIR.mkdir(parents=True, exist_ok=True)
-config.VECTOR_DB_DIR.mkdir(parents=True, exist_ok=True)
@@ -1,15 +1,317 @@
 import asyncio
+import copy
+import functools
+import importlib.util
 import json
+import mmap
+import multiprocessing
+import os
+import pickle
 import re
+import subprocess
+import threading
+import time
 import tomllib
 from pathlib import Path
 from collections import defaultdict
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
 
-import git
-import httpx
 from .config import config
 
+if TYPE_CHECKING:
+    import httpx
+
+try:
+    import orjson
+except ImportError:  # 可选依赖：没装就回退标准库 json
+    orjson = None
+
+# 索引缓存格式版本：_index_course_doc 产出的结构变化时递增，使旧缓存失效
+_INDEX_CACHE_VERSION = 2
+
+
+_UTF8_BOM = b"\xef\xbb\xbf"
+_MMAP_THRESHOLD = 64 * 1024
+
+
+def _read_text_file(path: Path) -> str:
+    """读取 UTF-8 文本（toml/知识库 txt 共用）：在字节层面跳过 BOM（tomllib 不认 BOM），再一次性解码成 str。
+
+    大文件用 mmap + memoryview 直接解码，不再额外复制一份 bytes。
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _MMAP_THRESHOLD:
+            raw = f.read()
+            if raw.startswith(_UTF8_BOM):
+                raw = raw[3:]
+            return raw.decode("utf-8", errors="replace")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            skip = 3 if mm[:3] == _UTF8_BOM else 0
+            with memoryview(mm) as view:
+                return str(view[skip:], "utf-8", "replace")
+
+
+def _parse_toml_worker(path: Path) -> Tuple[Path, Optional[Dict[str, Any]], Optional[str]]:
+    """解析单个 toml（串行/线程池路径用，只做 IO + 解析，不碰 CourseManager 状态）。
+
+    返回 (path, data, error)；异常转成字符串，与进程池路径的结果格式一致。
+    """
+    try:
+        text = _read_text_file(path)
+    except Exception as e:
+        return (path, None, str(e))
+    try:
+        data = tomllib.loads(text)
+        return (path, data if isinstance(data, dict) else None, None)
+    except Exception as e:
+        # 首行提示直接用已读入的文本生成，报错时不必再读一次文件
+        return (path, None, f"{e} {_hint_first_line(text)}")
+
+
+def _parse_toml_files(paths: List[Path]) -> List[Tuple[Path, Optional[Dict[str, Any]], Optional[str]]]:
+    """批量解析 toml：文件多时分发到进程池，结果顺序与 paths 一致。"""
+    workers = int(getattr(config, "PARSE_WORKERS", 0) or 0)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paths))
+
+    # 文件很少时，起进程的开销比解析本身还大
+    if workers <= 1 or len(paths) < 32:
+        return [_parse_toml_worker(p) for p in paths]
+
+    # 读盘留在本进程，子进程只跑 tomllib.loads：它按模块名反序列化，子进程不会 import 本插件包
+    # （包的 __init__ 依赖已初始化的 NoneBot）。进程池用 forkserver/spawn 启动而不是 fork：
+    # 这里是在多线程的 bot 进程里调用，fork 出的子进程可能卡死在 fork 时被别的线程持有的锁上。
+    results: List[Tuple[Path, Optional[Dict[str, Any]], Optional[str]]] = [(p, None, None) for p in paths]
+    texts: List[Tuple[int, str]] = []
+    for i, p in enumerate(paths):
+        try:
+            texts.append((i, _read_text_file(p)))
+        except Exception as e:
+            results[i] = (p, None, str(e))
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method)) as ex:
+            futures = [(i, text, ex.submit(tomllib.loads, text)) for i, text in texts]
+            for i, text, fut in futures:
+                try:
+                    results[i] = (paths[i], fut.result(), None)
+                except tomllib.TOMLDecodeError as e:
+                    results[i] = (paths[i], None, f"{e} {_hint_first_line(text)}")
+        return results
+    except Exception as e:
+        # 有些容器不允许起进程池（如 /dev/shm 受限）：退到线程池，至少让读盘互相重叠
+        print(f"⚠️ 多进程解析失败，回退到线程池解析: {e}")
+        with ThreadPoolExecutor(max_workers=min(8, workers)) as ex:
+            return list(ex.map(_parse_toml_worker, paths))
+
+
+def _json_loads(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _json_dumps_pretty(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _norm_doc_text(v: Any) -> str:
+    return str(v).strip().replace("\r\n", "\n")
+
+
+def _dict_list(v: Any) -> List[Dict[str, Any]]:
+    return [x for x in v if isinstance(x, dict)] if isinstance(v, list) else []
+
+
+# 课程条目的 schema 标签：建索引时写入 entry["_kind"]，/查 渲染按它分派，不再逐次判断结构
+KIND_NORMAL = "normal"
+KIND_MULTI_PROJECT = "multi-project"
+KIND_MULTI_ITEM = "multi-project-item"
+
+
+def _sanitize_course_doc(data: Dict[str, Any]) -> None:
+    """把 /查 渲染要遍历的嵌套列表规整成 list[dict]：非列表置为 []，丢掉非 dict 元素。
+
+    建索引时做一次（幂等），渲染时即可直接遍历，不必层层 isinstance。
+    """
+
+    def _with_content(v: Any) -> List[Dict[str, Any]]:
+        # 评价/条目正文同样在这里规范化一次（去首尾空白、统一换行），渲染时直接用
+        entries = _dict_list(v)
+        for e in entries:
+            c = e.get("content")
+            if c is not None:
+                e["content"] = _norm_doc_text(c)
+        return entries
+
+    def _people(v: Any) -> List[Dict[str, Any]]:
+        people = _dict_list(v)
+        for p in people:
+            p["reviews"] = _with_content(p.get("reviews"))
+        return people
+
+    def _sections(v: Any) -> List[Dict[str, Any]]:
+        sections = _dict_list(v)
+        for sec in sections:
+            sec["items"] = _with_content(sec.get("items"))
+        return sections
+
+    if str(data.get("repo_type") or "").strip() == "multi-project" and isinstance(data.get("courses"), list):
+        subs = _dict_list(data.get("courses"))
+        for sub in subs:
+            sub["teachers"] = _people(sub.get("teachers"))
+            sub["sections"] = _sections(sub.get("sections"))
+        data["courses"] = subs
+        return
+
+    data["lecturers"] = _people(data.get("lecturers"))
+    data["sections"] = _sections(data.get("sections"))
+
+
+def _precompute_doc_texts(data: Dict[str, Any]) -> None:
+    """/查 展示用的长文本在建索引时规范化一次（去首尾空白、统一换行），渲染时直接取 _<key>_norm。"""
+    for key in ("description", "notices"):
+        v = data.get(key)
+        data[f"_{key}_norm"] = "" if v is None else _norm_doc_text(v)
+
+
+def _atomic_write_bytes(path: Path, data: bytes) -> None:
+    """先写临时文件再 os.replace，写到一半崩溃也不会留下半截文件。
+
+    临时文件名带进程/线程号：两个线程同时写同一目标时各用各的临时文件，不会互相覆盖。
+    """
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+# 重建索引产出的全部字段：/刷 在影子副本上重建（工作线程），回到事件循环后按此表一次性换入
+_INDEX_ATTRS = (
+    "_primary_docs",
+    "_fallback_docs",
+    "_doc_stats",
+    "courses_cache",
+    "course_map",
+    "_name_map",
+    "_sub_name_map",
+    "teacher_records",
+    "teacher_lookup",
+    "_search_hays",
+    "_search_codes",
+    "_search_names",
+    "_search_bigrams",
+    "_search_trigrams",
+)
+
+
+# 昵称变更后延迟多久落盘（秒）：窗口内的多次修改合并成一次写
+_NICK_FLUSH_DELAY = 2.0
+
+
+# h2 为可选依赖（httpx[http2]）：装了就走 HTTP/2，多个请求复用同一条 TLS 连接
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+
+def _github_client(*, timeout: float, connect: float | None = None) -> "httpx.AsyncClient":
+    # httpx 只有 /刷 才用得到：首次调用时再 import，插件加载时不必拉起它的整套依赖
+    import httpx
+
+    headers = {
+        # 默认 JSON；下载 raw 文件的请求单独覆盖 Accept
+        "Accept": "application/vnd.github+json",
+        "User-Agent": "hitsz_manager",
+    }
+    if config.GITHUB_TOKEN:
+        headers["Authorization"] = f"Bearer {config.GITHUB_TOKEN}"
+    return httpx.AsyncClient(
+        base_url=config.GITHUB_API_BASE,
+        headers=headers,
+        timeout=httpx.Timeout(timeout, connect=connect if connect is not None else timeout),
+        http2=_HTTP2,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+    )
+
+
+# GraphQL 每次请求包含的仓库数（GitHub 单次查询上限 100，留些余量避免响应过大/超时）
+_GRAPHQL_BATCH = 50
+
+# GitHub 分页 Link 头：<...&page=7>; rel="last"
+_LINK_LAST_PAGE_RE = re.compile(r'[?&]page=(\d+)[^>]*>;\s*rel="last"')
+
+def _hint_first_line(text: str) -> str:
+    s = text[:256].strip().split("\n", 1)[0].strip()
+    if not s:
+        return "（文件为空/不可读）"
+    pv = s[:120] + ("…" if len(s) > 120 else "")
+    if pv.startswith("<"):
+        return f"（首行像 HTML：{pv}）"
+    if pv.startswith("{"):
+        return f"（首行像 JSON：{pv}）"
+    return f"（首行预览：{pv}）"
+
+
+# 本地 git 命令（rev-parse/reset）的超时（秒）；clone/fetch 走网络，用 config.GIT_NETWORK_TIMEOUT
+_GIT_TIMEOUT = 120
+
+
+def _git_network_timeout() -> float | None:
+    timeout = float(getattr(config, "GIT_NETWORK_TIMEOUT", 0) or 0)
+    return timeout if timeout > 0 else None
+
+
+def _run_git(args: List[str], timeout: float | None = _GIT_TIMEOUT) -> str:
+    """直接调用 git CLI（比 GitPython 少一层对象/配置解析开销）。失败时抛 RuntimeError(stderr)。"""
+    env = dict(os.environ)
+    # 禁止交互式认证提示：私有/不存在的仓库应直接失败而不是卡住
+    env["GIT_TERMINAL_PROMPT"] = "0"
+    proc = subprocess.run(
+        ["git", *args],
+        capture_output=True,
+        timeout=timeout,
+        env=env,
+    )
+    if proc.returncode != 0:
+        err = (proc.stderr or proc.stdout or b"").decode("utf-8", errors="replace").strip()
+        raise RuntimeError(err or f"git {args[0]} exited with {proc.returncode}")
+    # 成功时只返回 stdout：fetch 等命令会往 stderr 写进度，不能混进 rev-parse 的结果
+    return (proc.stdout or b"").decode("utf-8", errors="replace").strip()
+
+
+def _git_clone(repo_url: str, repo_dir: Path, depth: int) -> None:
+    # 课程仓库只做镜像：单分支、不拉 tag
+    cmd = ["clone", "--single-branch", "--no-tags"]
+    if depth > 0:
+        cmd += ["--depth", str(depth)]
+    else:
+        # 全量 clone 时用 partial clone 跳过历史 blob；浅克隆本身只含 HEAD，加 filter 反而多一次往返
+        cmd += ["--filter=blob:none"]
+    _run_git(cmd + [repo_url, str(repo_dir)], timeout=_git_network_timeout())
+
+
+def _git_pull(repo_dir: Path, depth: int) -> bool:
+    """fetch 并对齐远端；返回 HEAD 是否发生变化。"""
+    # 同步目录只做镜像，不保留本地修改：fetch 后直接对齐远端（reset 而非 merge，不会产生合并提交或冲突）
+    fetch = ["-C", str(repo_dir), "fetch", "--no-tags", "origin"]
+    if depth > 0:
+        fetch += ["--depth", str(depth)]
+    _run_git(fetch, timeout=_git_network_timeout())
+    before = _run_git(["-C", str(repo_dir), "rev-parse", "HEAD"])
+    after = _run_git(["-C", str(repo_dir), "rev-parse", "FETCH_HEAD"])
+    if before == after:
+        return False
+    _run_git(["-C", str(repo_dir), "reset", "--hard", "FETCH_HEAD"])
+    return True
+
+
 class CourseManager:
     def __init__(self):
         # 核心数据结构
@@ -17,18 +319,114 @@ class CourseManager:
         self.courses_cache: List[Dict[str, Any]] = []
         # map: key=COURSE_CODE(大写), value=课程数据字典
         self.course_map: Dict[str, Dict[str, Any]] = {}
+        # /查 的全名、multi-project 子课程名精确匹配表（随 course_map 一起重建）
+        self._name_map: Dict[str, Dict[str, Any]] = {}
+        self._sub_name_map: Dict[str, Dict[str, Any]] = {}
+        # 已解析的原始文档：key=toml 路径（保持扫描顺序）；/刷 后只重新解析变化的仓库
+        self._primary_docs: Dict[Path, Dict[str, Any]] = {}
+        self._fallback_docs: Dict[Path, Dict[str, Any]] = {}
+        # 上面文档对应的 manifest 条目 "<tag>:<path>" -> (mtime_ns, size)；重载时据此只解析变化的文件
+        self._doc_stats: Dict[str, Tuple[int, int]] = {}
         # nicknames: key=昵称, value=COURSE_CODE
         self.nicknames: Dict[str, str] = {}
+        # 昵称搜索缓存：[(小写昵称, COURSE_CODE, 课程名)]，昵称或课程数据变更时重建
+        self._nicknames_lower: List[Tuple[str, str, str]] = []
+        # toml 同步模式的 ETag 缓存：key="<repo>/<path>"，持久化到 TOML_ETAG_FILE
+        self._toml_etags: Dict[str, str] = {}
         # 教师索引：records 保存明细，lookup 保存可检索 key -> record 下标列表
         self.teacher_records: List[Dict[str, Any]] = []
         self.teacher_lookup: Dict[str, List[int]] = {}
+        # /搜 索引（SoA）：三个平行列表，hays 已预先小写，查询时只做子串判断
+        self._search_hays: List[str] = []
+        self._search_codes: List[str] = []
+        self._search_names: List[str] = []
+        # hays 的 2/3-gram 倒排：gram -> 行号列表（升序）；2 字查询直接查 2-gram，>=3 字符查询用 3-gram 求交剪枝
+        self._search_bigrams: Dict[str, List[int]] = {}
+        self._search_trigrams: Dict[str, List[int]] = {}
+        # 课程数据版本：每次重建 course_map 递增，供 /查 渲染缓存判断是否过期
+        self.data_version = 0
+        # 首次加载完成信号：启动时在后台线程加载，查询指令需等它 set 后再读索引
+        self._ready = asyncio.Event()
+        # git 同步专用线程池（首次 /刷 时创建）：池大小即并发上限，不再额外套 semaphore
+        self._git_pool: Optional[ThreadPoolExecutor] = None
+        # GitHub API 客户端（首次 /刷 时创建）：跨多次 /刷 复用连接池，免去重复 TLS 握手
+        self._gh_client: Optional["httpx.AsyncClient"] = None
+        # 昵称延迟落盘：dirty 标记 + 定时器句柄 + 正在进行的写盘任务
+        self._nick_dirty = False
+        self._nick_flush_handle: Optional[asyncio.TimerHandle] = None
+        self._nick_flush_task: Optional[asyncio.Task] = None
+        # /刷 合并与节流：进行中的同步任务 + 上次成功同步的时间与结果
+        self._update_task: Optional["asyncio.Task[str]"] = None
+        self._last_update_ts = 0.0
+        self._last_update_result = ""
+
+    def _git_executor(self) -> ThreadPoolExecutor:
+        if self._git_pool is None:
+            workers = max(1, int(config.GIT_SYNC_CONCURRENCY))
+            self._git_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="git-sync")
+        return self._git_pool
+
+    def _gh(self) -> "httpx.AsyncClient":
+        if self._gh_client is None or self._gh_client.is_closed:
+            self._gh_client = _github_client(timeout=60.0, connect=20.0)
+        return self._gh_client
+
+    async def close(self) -> None:
+        """bot 关闭时释放同步用的资源，并把尚未落盘的昵称写掉。"""
+        if self._nick_flush_handle is not None:
+            self._nick_flush_handle.cancel()
+            self._nick_flush_handle = None
+        if self._nick_flush_task is not None:
+            # 写盘失败已由回调记录并重新置脏，下面会同步再写一次
+            await asyncio.gather(self._nick_flush_task, return_exceptions=True)
+            self._nick_flush_task = None
+        if self._nick_dirty:
+            self.save_nicknames()
+        if self._gh_client is not None:
+            await self._gh_client.aclose()
+            self._gh_client = None
+        if self._git_pool is not None:
+            self._git_pool.shutdown(wait=False, cancel_futures=True)
+            self._git_pool = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    async def load_data_async(self) -> None:
+        """在线程池中执行 load_data，不阻塞事件循环；无论成败都会标记 ready。"""
+        try:
+            await asyncio.to_thread(self.load_data)
+        except Exception as e:
+            print(f"❌ 课程数据加载失败: {e}")
+        finally:
+            self._ready.set()
+
+    async def wait_ready(self, timeout: float = 3.0) -> bool:
+        """等待首次加载完成；超时返回 False（调用方可提示用户稍后再试）。"""
+        if self._ready.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
 
     def load_data(self):
         """主加载流程"""
         print("📥 开始加载课程数据...")
-        self._load_from_toml()
+        # 主目录：可写、用于 /刷 同步；兜底目录：只在主目录缺失时补充
+        primary = self._collect_candidates(config.COURSE_DIR)
+        fb_dir = getattr(config, "COURSE_FALLBACK_DIR", None)
+        fallback = self._collect_candidates(fb_dir) if fb_dir else []
+
+        manifest = self._build_manifest(primary, fallback)
+        if not self._load_index_cache(manifest):
+            self._load_from_toml(primary, fallback, manifest)
+            self._save_index_cache(manifest)
         self._load_nicknames()
         self._build_teacher_index()
+        self._build_search_index()
         print(
             f"🚀 数据加载完成: 课程 {len(self.course_map)} 门, 昵称 {len(self.nicknames)} 个, "
             f"教师条目 {len(self.teacher_records)} 条"
@@ -174,82 +572,243 @@ class CourseManager:
         )
         return [self.teacher_records[idx] for idx, _ in ranked[:50]]
 
-    def _load_from_toml(self):
-        self.courses_cache.clear()
-        self.course_map.clear()
+    def _collect_candidates(self, base_dir: Optional[Path]) -> List[Path]:
+        try:
+            if not base_dir or not base_dir.exists():
+                return []
+        except Exception:
+            return []
 
-        def _load_toml(path: Path) -> Dict[str, Any] | None:
-            # tomllib.load 对 UTF-8 BOM 不够友好；这里用 utf-8-sig 解码可自动去 BOM。
-            raw = path.read_bytes()
-            text = raw.decode("utf-8-sig", errors="replace")
-            data = tomllib.loads(text)
-            return data if isinstance(data, dict) else None
+        # 一次 scandir 递归同时收集 readme.toml 与其它 .toml：
+        # DirEntry 自带类型信息，不必为每个目录项构造 Path/额外 stat；
+        # .git/.github 等隐藏目录直接跳过（里面不会有课程 readme，且 .git 对象目录往往很大）。
+        readme_files: List[Path] = []
+        other_tomls: List[Path] = []
 
-        def _hint_first_line(path: Path) -> str:
+        def _walk(d: str) -> None:
             try:
-                raw = path.read_bytes()[:256]
-            except Exception:
-                return ""
-            s = raw.decode("utf-8-sig", errors="replace").strip().split("\n", 1)[0].strip()
-            if not s:
-                return "（文件为空/不可读）"
-            pv = s[:120] + ("…" if len(s) > 120 else "")
-            if pv.startswith("<"):
-                return f"（首行像 HTML：{pv}）"
-            if pv.startswith("{"):
-                return f"（首行像 JSON：{pv}）"
-            return f"（首行预览：{pv}）"
-
-        def _collect_candidates(base_dir) -> List[Path]:
+                it = os.scandir(d)
+            except OSError:
+                return
+            with it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            if not e.name.startswith("."):
+                                _walk(e.path)
+                            continue
+                        if not e.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    if e.name == "readme.toml":
+                        readme_files.append(Path(e.path))
+                    elif e.name.endswith(".toml") and e.name.lower() not in {"teachers_reviews.toml"}:
+                        other_tomls.append(Path(e.path))
+
+        _walk(str(base_dir))
+
+        # 优先加载新结构：readme.toml（避免误索引 teachers_reviews.toml 等辅助文件）
+        if readme_files:
+            return readme_files
+
+        # 兼容旧结构：扫描所有 .toml，但排除常见辅助文件
+        return other_tomls
+
+    def _build_manifest(self, primary: List[Path], fallback: List[Path]) -> Dict[str, Any]:
+        """收集候选文件的 (mtime_ns, size)，只 stat 不读内容；用于判断索引缓存是否过期。"""
+        files: Dict[str, Tuple[int, int]] = {}
+        for tag, paths in (("primary", primary), ("fallback", fallback)):
+            for p in paths:
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                files[f"{tag}:{p}"] = (st.st_mtime_ns, st.st_size)
+        return {"version": _INDEX_CACHE_VERSION, "files": files}
+
+    def _load_index_cache(self, manifest: Dict[str, Any]) -> bool:
+        """manifest 与缓存一致时直接反序列化已解析文档并重建索引，跳过整轮 TOML 解析。"""
+        path = config.COURSE_INDEX_CACHE
+        if not manifest["files"]:
+            return False
+        try:
+            with open(path, "rb") as f:
+                # 文件内依次是 manifest 与 payload：不匹配且内存里已有上一轮结果时无需反序列化 payload
+                cached = pickle.load(f)
+                if cached != manifest and (self._doc_stats or cached.get("version") != _INDEX_CACHE_VERSION):
+                    return False
+                primary_docs, fallback_docs = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"⚠️ 课程索引缓存不可用，改为重新解析: {e}")
+            return False
+
+        self._primary_docs = primary_docs
+        self._fallback_docs = fallback_docs
+        self._doc_stats = dict(cached["files"])
+        if cached != manifest:
+            # 部分文件变了：旧缓存留作 _load_from_toml 的复用来源，只重新解析变化的文件
+            return False
+        self._reindex_docs()
+        print(f"⚡ 命中课程索引缓存: {len(manifest['files'])} 个文件未变化")
+        return True
+
+    def _save_index_cache(self, manifest: Dict[str, Any]) -> None:
+        path = config.COURSE_INDEX_CACHE
+        tmp = path.with_name(path.name + ".tmp")
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(manifest, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump((self._primary_docs, self._fallback_docs), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"⚠️ 写入课程索引缓存失败: {e}")
             try:
-                if not base_dir or not base_dir.exists():
-                    return []
+                tmp.unlink(missing_ok=True)
             except Exception:
-                return []
+                pass
 
-            # 优先加载新结构：readme.toml（避免误索引 teachers_reviews.toml 等辅助文件）
-            readme_files = list(base_dir.rglob("readme.toml"))
-            if readme_files:
-                return readme_files
+    def _load_from_toml(self, primary: List[Path], fallback: List[Path], manifest: Dict[str, Any]):
+        files = manifest["files"]
+        reused = 0
 
-            # 兼容旧结构：扫描所有 .toml，但排除常见辅助文件
-            return [
-                p
-                for p in base_dir.rglob("*.toml")
-                if p.name.lower() not in {"teachers_reviews.toml"}
-            ]
+        def _load(tag: str, paths: List[Path], prev: Dict[Path, Dict[str, Any]], fb: bool) -> Dict[Path, Dict[str, Any]]:
+            nonlocal reused
+            # (mtime_ns, size) 与上一轮一致的文件直接复用已解析文档，其余才重新解析
+            keep: Dict[Path, Dict[str, Any]] = {}
+            todo: List[Path] = []
+            for p in paths:
+                key = f"{tag}:{p}"
+                if p in prev and key in files and self._doc_stats.get(key) == files[key]:
+                    keep[p] = prev[p]
+                else:
+                    todo.append(p)
+            reused += len(keep)
+            parsed = self._parse_docs(todo, _fallback=fb) if todo else {}
+            # 按扫描顺序合并：同 code 先到先得的规则不受复用影响
+            return {p: keep.get(p) or parsed[p] for p in paths if p in keep or p in parsed}
 
         # 主目录：可写、用于 /刷 同步
-        primary = _collect_candidates(config.COURSE_DIR)
-        primary_errs = 0
-        for file in primary:
-            try:
-                data = _load_toml(file)
+        self._primary_docs = _load("primary", primary, self._primary_docs, False)
+        # 兜底目录：只在主目录缺失时补充（不会覆盖已存在的课程 code）
+        self._fallback_docs = _load("fallback", fallback, self._fallback_docs, True) if fallback else {}
+        self._doc_stats = dict(files)
+        self._reindex_docs()
+        if reused:
+            print(f"♻️ 复用 {reused} 个未变化文件的解析结果，重新解析 {len(files) - reused} 个")
+
+    def _parse_docs(self, paths: List[Path], _fallback: bool = False) -> Dict[Path, Dict[str, Any]]:
+        """解析一批 toml，返回 {path: doc}（保持 paths 顺序）；失败的文件只打印前 5 条。"""
+        docs: Dict[Path, Dict[str, Any]] = {}
+        errs = 0
+        # 解析可并行；索引仍在当前进程串行执行，保证 course_map/courses_cache 只有一个写者
+        for file, data, err in _parse_toml_files(paths):
+            if err is None:
                 if data:
-                    self._index_course_doc(data)
-            except Exception as e:
-                primary_errs += 1
-                if primary_errs <= 5:
-                    print(f"❌ 解析文件 {file} 失败: {e} {_hint_first_line(file)}")
-                elif primary_errs == 6:
+                    docs[file] = data
+                continue
+            errs += 1
+            if errs <= 5:
+                what = "备份文件" if _fallback else "文件"
+                print(f"❌ 解析{what} {file} 失败: {err}")
+            elif errs == 6:
+                if _fallback:
+                    print("⚠️ 备份目录里无效的 TOML 太多，后续错误将不再逐条输出。")
+                else:
                     print("⚠️ 解析失败的文件过多，后续错误将不再逐条输出。")
-
-        # 兜底目录：只在主目录缺失时补充（不会覆盖已存在的课程 code）
-        fb_dir = getattr(config, "COURSE_FALLBACK_DIR", None)
-        fallback = _collect_candidates(fb_dir) if fb_dir else []
-        if fallback:
-            fallback_errs = 0
-            for file in fallback:
+        return docs
+
+    def _reindex_docs(self) -> None:
+        """由已解析的文档重建 course_map/courses_cache（纯内存操作，不读盘）。"""
+        self.courses_cache = []
+        self.course_map = {}
+        for docs, fb in ((self._primary_docs, False), (self._fallback_docs, True)):
+            for file, data in docs.items():
                 try:
-                    data = _load_toml(file)
-                    if data:
-                        self._index_course_doc(data, _fallback=True)
+                    self._index_course_doc(data, _fallback=fb)
                 except Exception as e:
-                    fallback_errs += 1
-                    if fallback_errs <= 5:
-                        print(f"❌ 解析备份文件 {file} 失败: {e} {_hint_first_line(file)}")
-                    elif fallback_errs == 6:
-                        print("⚠️ 备份目录里无效的 TOML 太多，后续错误将不再逐条输出。")
+                    print(f"❌ 索引文件 {file} 失败: {e}")
+        self._build_name_index()
+        self.data_version += 1
+
+    def _build_name_index(self) -> None:
+        """预建 /查 用的 全名/子课程名 -> 条目 映射；同名时保留 courses_cache 中靠前的那个。"""
+        self._name_map = {}
+        self._sub_name_map = {}
+        for c in self.courses_cache:
+            name = str(c.get("course_name") or "").strip()
+            if name:
+                self._name_map.setdefault(name, c)
+
+            if str(c.get("repo_type") or "").strip() != "multi-project":
+                continue
+            courses = c.get("courses")
+            if not isinstance(courses, list):
+                continue
+            for idx, sub in enumerate(courses):
+                if not isinstance(sub, dict):
+                    continue
+                sub_name = str(sub.get("name") or "").strip()
+                if sub_name and sub_name not in self._sub_name_map:
+                    self._sub_name_map[sub_name] = {
+                        "_schema": "multi-project-item",
+                        "_kind": KIND_MULTI_ITEM,
+                        "_parent": c,
+                        "_course_index": idx,
+                        "course_code": str(c.get("course_code") or "").strip().upper(),
+                        "course_name": sub_name,
+                    }
+
+    async def reindex_repos_async(self, names: List[str]) -> None:
+        """在工作线程里执行 reindex_repos，不阻塞事件循环。
+
+        重建发生在浅拷贝出的影子对象上：各索引方法都是先赋新容器再填充，不会改动当前对象正在被查询的表；
+        完成后回到事件循环一次性换入。昵称给影子一份快照，避免线程遍历时与 /昵称 并发修改冲突。
+        """
+        shadow = copy.copy(self)
+        shadow.nicknames = dict(self.nicknames)
+        await asyncio.to_thread(shadow.reindex_repos, names)
+        for attr in _INDEX_ATTRS:
+            setattr(self, attr, getattr(shadow, attr))
+        self.data_version += 1
+        self._rebuild_nickname_index()
+
+    def reindex_repos(self, names: List[str]) -> None:
+        """增量重建：只重新解析 data/courses/<name>/ 下的 readme.toml，其余文档复用内存结果。
+
+        仅适用于「每个仓库一个 readme.toml」的新结构；若当前是旧结构或尚未加载，回退到全量 load_data。
+        """
+        if not self._primary_docs or any(p.name != "readme.toml" for p in self._primary_docs):
+            self.load_data()
+            return
+
+        dirs = [config.COURSE_DIR / n for n in names if n]
+        if not dirs:
+            return
+
+        # 去掉这些仓库的旧文档，再解析其当前的 readme.toml（仓库目录被删除时相当于移除）
+        kept = {p: d for p, d in self._primary_docs.items() if not any(p.is_relative_to(x) for x in dirs)}
+        changed: List[Path] = []
+        for d in dirs:
+            changed.extend(p for p in self._collect_candidates(d) if p.name == "readme.toml")
+        kept.update(self._parse_docs(changed))
+        # 按全量扫描顺序重排：同 code 先到先得，增量与全量 load_data 选出的条目必须一致
+        primary = self._collect_candidates(config.COURSE_DIR)
+        self._primary_docs = {p: kept[p] for p in primary if p in kept}
+
+        self._reindex_docs()
+        self._build_teacher_index()
+        self._build_search_index()
+
+        # 刷新磁盘索引缓存（只 stat，不读内容），保证下次重启仍能命中
+        fb_dir = getattr(config, "COURSE_FALLBACK_DIR", None)
+        fallback = self._collect_candidates(fb_dir) if fb_dir else []
+        manifest = self._build_manifest(primary, fallback)
+        self._doc_stats = dict(manifest["files"])
+        self._save_index_cache(manifest)
+        print(f"🔁 增量重建完成: 重新解析 {len(changed)} 个文件, 当前课程 {len(self.course_map)} 门")
 
     def _index_course_doc(self, data: Dict[str, Any], _fallback: bool = False) -> None:
         """将一个 TOML 文档索引到 course_map/courses_cache。
@@ -259,6 +818,8 @@ class CourseManager:
         - multi-project: 顶层 courses=[{code,name,...}]，一个仓库包含多门课
         """
 
+        _sanitize_course_doc(data)
+
         # 1) multi-project：为每个子课程建立可查询条目
         repo_type = str(data.get("repo_type") or "").strip()
         courses = data.get("courses")
@@ -268,6 +829,8 @@ class CourseManager:
             if parent_code:
                 if not (_fallback and parent_code in self.course_map):
                     data["course_code"] = parent_code
+                    data["_kind"] = KIND_MULTI_PROJECT
+                    _precompute_doc_texts(data)
                     self.courses_cache.append(data)
                     self.course_map[parent_code] = data
 
@@ -282,6 +845,7 @@ class CourseManager:
                         continue
                     entry = {
                         "_schema": "multi-project-item",
+                        "_kind": KIND_MULTI_ITEM,
                         "_parent": data,
                         "_course_index": idx,
                         "course_code": sub_code,
@@ -300,100 +864,179 @@ class CourseManager:
                 return
             # 保证 course_code 统一大写，避免后续搜索/展示不一致
             data["course_code"] = code
+            data["_kind"] = KIND_NORMAL
+            _precompute_doc_texts(data)
             self.courses_cache.append(data)
             self.course_map[code] = data
 
     def _load_nicknames(self):
         if config.NICKNAME_FILE.exists():
             try:
-                with open(config.NICKNAME_FILE, 'r', encoding='utf-8') as f:
-                    self.nicknames = json.load(f)
+                self.nicknames = _json_loads(config.NICKNAME_FILE.read_bytes())
             except Exception:
                 self.nicknames = {}
         else:
             self.nicknames = {}
 
+    def _rebuild_nickname_index(self) -> None:
+        # 用列表而不是 dict：大小写不同的两个昵称 lower 后会撞 key。
+        # 展示名也在这里算好，/搜 时不再逐条查 course_map；课程数据或昵称变化后都要重建。
+        rows: List[Tuple[str, str, str]] = []
+        for nick, code in self.nicknames.items():
+            if not nick:
+                continue
+            mapped = str(code or "").strip().upper()
+            course = self.course_map.get(mapped)
+            if course:
+                rows.append((str(nick).lower(), mapped, str(course.get("course_name") or mapped)))
+        self._nicknames_lower = rows
+
     def save_nicknames(self):
-        with open(config.NICKNAME_FILE, 'w', encoding='utf-8') as f:
-            json.dump(self.nicknames, f, ensure_ascii=False, indent=2)
+        self._nick_dirty = False
+        _atomic_write_bytes(config.NICKNAME_FILE, _json_dumps_pretty(self.nicknames))
+
+    def _schedule_nickname_flush(self) -> None:
+        """昵称落盘防抖：短时间内连续 /昵称 只写一次文件；不在事件循环里时直接写。"""
+        self._nick_dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save_nicknames()
+            return
+        if self._nick_flush_handle is None:
+            self._nick_flush_handle = loop.call_later(_NICK_FLUSH_DELAY, self._flush_nicknames_soon)
+
+    def _flush_nicknames_soon(self) -> None:
+        self._nick_flush_handle = None
+        if not self._nick_dirty:
+            return
+        # 上一次写盘还没结束：不并发写，推迟到下一个窗口
+        if self._nick_flush_task is not None and not self._nick_flush_task.done():
+            self._nick_flush_handle = asyncio.get_running_loop().call_later(_NICK_FLUSH_DELAY, self._flush_nicknames_soon)
+            return
+        # 在事件循环线程里序列化快照，线程里只做写盘；写盘期间的新改动会重新置脏并再次调度
+        self._nick_dirty = False
+        data = _json_dumps_pretty(self.nicknames)
+        self._nick_flush_task = asyncio.create_task(
+            asyncio.to_thread(_atomic_write_bytes, config.NICKNAME_FILE, data)
+        )
+        self._nick_flush_task.add_done_callback(self._on_nickname_flush_done)
+
+    def _on_nickname_flush_done(self, task: asyncio.Task) -> None:
+        # 写盘失败（磁盘满、权限等）不能静默丢改动：记日志并重新置脏，下次修改或关闭时再写
+        if task.cancelled():
+            self._nick_dirty = True
+            return
+        e = task.exception()
+        if e is not None:
+            print(f"⚠️ 昵称写盘失败，下次修改或关闭时重试: {e}")
+            self._nick_dirty = True
+
+    def _load_toml_etags(self) -> Dict[str, str]:
+        try:
+            data = _json_loads(config.TOML_ETAG_FILE.read_bytes())
+        except Exception:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _save_toml_etags(self) -> None:
+        try:
+            config.TOML_ETAG_FILE.write_bytes(_json_dumps_pretty(self._toml_etags))
+        except Exception as e:
+            print(f"⚠️ 写入 ETag 缓存失败: {e}")
 
     def _is_course_repo_name(self, name: str) -> bool:
-        # 规则：首字符大写，且不包含 '-'
-        if not name:
-            return False
-        if "-" in name:
-            return False
-        return bool(re.match(r"^[A-Z]", name))
+        # 规则：首字符大写（ASCII A-Z，与原 ^[A-Z] 一致），且不包含 '-'
+        return bool(name) and "A" <= name[0] <= "Z" and "-" not in name
 
     async def _list_github_org_repos(self) -> List[str]:
         org = (config.GITHUB_ORG or "").strip()
         if not org:
             return []
 
-        headers = {
-            "Accept": "application/vnd.github+json",
-            "User-Agent": "hitsz_manager",
-        }
-        if config.GITHUB_TOKEN:
-            headers["Authorization"] = f"Bearer {config.GITHUB_TOKEN}"
-
         per_page = 100
-        page = 1
         out: List[str] = []
-        async with httpx.AsyncClient(base_url=config.GITHUB_API_BASE, headers=headers, timeout=30) as client:
-            while True:
-                r = await client.get(f"/orgs/{org}/repos", params={"per_page": per_page, "page": page})
-                r.raise_for_status()
-                items = r.json()
-                if not isinstance(items, list) or not items:
-                    break
-                for it in items:
-                    if isinstance(it, dict) and isinstance(it.get("name"), str):
-                        out.append(it["name"])
-                if len(items) < per_page:
-                    break
-                page += 1
+
+        def _collect(items: Any) -> int:
+            if not isinstance(items, list):
+                return 0
+            for it in items:
+                if isinstance(it, dict) and isinstance(it.get("name"), str):
+                    out.append(it["name"])
+            return len(items)
+
+        client = self._gh()
+
+        async def _get_page(page: int) -> Any:
+            r = await client.get(f"/orgs/{org}/repos", params={"per_page": per_page, "page": page}, timeout=30.0)
+            r.raise_for_status()
+            return _json_loads(r.content)
+
+        # 先取第 1 页：若 Link 头给出 rel="last"，剩余页并发拉取
+        r = await client.get(f"/orgs/{org}/repos", params={"per_page": per_page, "page": 1}, timeout=30.0)
+        r.raise_for_status()
+        if _collect(_json_loads(r.content)) < per_page:
+            return out
+
+        m = _LINK_LAST_PAGE_RE.search(r.headers.get("link", ""))
+        if m:
+            last = int(m.group(1))
+            for items in await asyncio.gather(*(_get_page(p) for p in range(2, last + 1))):
+                _collect(items)
+            return out
+
+        # 兜底：没有 Link 头时逐页拉取，直到某页不满
+        page = 2
+        while _collect(await _get_page(page)) >= per_page:
+            page += 1
         return out
 
     def _sync_one_repo(self, *, repo_url: str, repo_dir) -> Tuple[str, str]:
         """同步单个仓库（阻塞）。返回 (status, message)。"""
+        depth = int(getattr(config, "GIT_CLONE_DEPTH", 1) or 0)
         try:
             if repo_dir.exists():
                 # 仅当是 git 仓库才 pull，否则认为不可处理
-                try:
-                    repo = git.Repo(repo_dir)
-                    repo.remotes.origin.pull()
-                    return ("pulled", "pull")
-                except Exception:
+                if not (repo_dir / ".git").exists():
                     return ("skipped", "not a git repo")
-            depth = int(getattr(config, "GIT_CLONE_DEPTH", 1) or 0)
-            if depth > 0:
-                git.Repo.clone_from(repo_url, repo_dir, depth=depth, single_branch=True)
-            else:
-                git.Repo.clone_from(repo_url, repo_dir)
+                if not _git_pull(repo_dir, depth):
+                    return ("skipped", "up to date")
+                return ("pulled", "pull")
+            _git_clone(repo_url, repo_dir, depth)
             return ("cloned", "clone")
         except Exception as e:
             return ("failed", str(e))
 
-    async def _fetch_one_repo_toml(self, *, client: httpx.AsyncClient, org: str, name: str) -> Tuple[str, str]:
+    async def _fetch_one_repo_toml(self, *, client: "httpx.AsyncClient", org: str, name: str) -> Tuple[str, str]:
         """只下载根目录 readme.toml 到 data/courses/<repo>/readme.toml。返回 (status, message)。"""
 
         # contents API：/repos/{org}/{repo}/contents/{path}
         # 直接用 raw accept 让 GitHub 返回文件内容。
-        paths = ["readme.toml", "README.toml"]
+        # URL 在重试循环外只拼一次。
+        urls = [(p, f"/repos/{org}/{name}/contents/{p}") for p in ("readme.toml", "README.toml")]
+
+        # 本地已有文件时带上 ETag 做条件请求：未变化的仓库只回 304，不传正文也不计入限流
+        have_local = (config.COURSE_DIR / name / "readme.toml").exists()
 
         last_err: str = ""
         content: str | None = None
         picked: str | None = None
+        etag: str | None = None
 
         # Retry policy: 3 attempts with exponential backoff (0.5s, 1s, 2s)
         for attempt in range(3):
             if attempt:
                 await asyncio.sleep(0.5 * (2 ** (attempt - 1)))
 
-            for p in paths:
+            for p, url in urls:
                 try:
-                    r = await client.get(f"/repos/{org}/{name}/contents/{p}")
+                    cached = self._toml_etags.get(f"{name}/{p}") if have_local else None
+                    headers = {"Accept": "application/vnd.github.raw"}
+                    if cached:
+                        headers["If-None-Match"] = cached
+                    r = await client.get(url, headers=headers)
+                    if r.status_code == 304:
+                        return ("skipped", f"unchanged ({p})")
                     if r.status_code == 404:
                         last_err = f"{p}: 404"
                         continue
@@ -401,6 +1044,7 @@ class CourseManager:
                     # raw accept should return plain text
                     content = r.text
                     picked = p
+                    etag = r.headers.get("etag")
                     break
                 except Exception as e:
                     last_err = str(e)
@@ -412,18 +1056,123 @@ class CourseManager:
         if not content or not content.strip():
             return ("failed", f"toml not found ({last_err})")
 
-        repo_dir = config.COURSE_DIR / name
-        repo_dir.mkdir(parents=True, exist_ok=True)
-        out_path = repo_dir / "readme.toml"
         try:
-            out_path.write_text(content.rstrip() + "\n", encoding="utf-8")
+            await self._write_repo_toml(name, content)
         except Exception as e:
             return ("failed", f"write failed: {e}")
 
+        if etag:
+            self._toml_etags[f"{name}/{picked}"] = etag
+
         return ("pulled", f"download {picked}")
 
+    async def _write_repo_toml(self, name: str, content: str) -> None:
+        repo_dir = config.COURSE_DIR / name
+        out_path = repo_dir / "readme.toml"
+        data = (content.rstrip() + "\n").encode("utf-8")
+
+        def _write() -> None:
+            repo_dir.mkdir(parents=True, exist_ok=True)
+            out_path.write_bytes(data)
+
+        # 落盘放到线程里：并发同步时不让磁盘 IO 卡住事件循环
+        await asyncio.to_thread(_write)
+
+    async def _fetch_repo_tomls_graphql(
+        self, *, client: "httpx.AsyncClient", org: str, names: List[str]
+    ) -> Dict[str, Tuple[str, str]]:
+        """用 GraphQL 一次请求取一批仓库 HEAD 上的 readme.toml，代替逐仓库 REST。
+
+        返回 {repo: (status, message)}；请求失败/内容被截断的仓库不在结果里，由调用方回退 REST。
+        GraphQL 没有 ETag，用 blob oid 判断文件是否变化。需要 token（匿名不能调 GraphQL）。
+        """
+        out: Dict[str, Tuple[str, str]] = {}
+
+        async def run_batch(batch: List[str]) -> None:
+            # 仓库名用 json.dumps 转义，JSON 字符串字面量与 GraphQL 字符串兼容
+            fields = " ".join(
+                f"r{i}: repository(owner: $org, name: {json.dumps(n)}) {{ "
+                f'a: object(expression: "HEAD:readme.toml") {{ ...T }} '
+                f'b: object(expression: "HEAD:README.toml") {{ ...T }} }}'
+                for i, n in enumerate(batch)
+            )
+            query = f"query($org: String!) {{ {fields} }} fragment T on Blob {{ oid text isTruncated }}"
+            try:
+                r = await client.post(
+                    "/graphql",
+                    json={"query": query, "variables": {"org": org}},
+                    headers={"Accept": "application/json"},
+                )
+                r.raise_for_status()
+                data = (_json_loads(r.content) or {}).get("data") or {}
+            except Exception as e:
+                print(f"⚠️ GraphQL 批量拉取失败，{len(batch)} 个仓库回退 REST: {e}")
+                return
+
+            writes = []
+            for i, name in enumerate(batch):
+                repo = data.get(f"r{i}")
+                if not isinstance(repo, dict):
+                    continue
+                if repo.get("a") is None and repo.get("b") is None:
+                    out[name] = ("failed", "toml not found (graphql)")
+                    continue
+                for p, key in (("readme.toml", "a"), ("README.toml", "b")):
+                    blob = repo.get(key)
+                    if not isinstance(blob, dict) or blob.get("isTruncated"):
+                        continue
+                    text = blob.get("text")
+                    if not isinstance(text, str) or not text.strip():
+                        continue
+                    oid_key = f"{name}/{p}@oid"
+                    oid = str(blob.get("oid") or "")
+                    if oid and self._toml_etags.get(oid_key) == oid and (config.COURSE_DIR / name / "readme.toml").exists():
+                        out[name] = ("skipped", f"unchanged ({p})")
+                    else:
+                        writes.append((name, p, oid_key, oid, text))
+                    break
+
+            async def write_one(name: str, p: str, oid_key: str, oid: str, text: str) -> None:
+                try:
+                    await self._write_repo_toml(name, text)
+                except Exception as e:
+                    out[name] = ("failed", f"write failed: {e}")
+                    return
+                if oid:
+                    self._toml_etags[oid_key] = oid
+                out[name] = ("pulled", f"download {p} (graphql)")
+
+            await asyncio.gather(*(write_one(*w) for w in writes))
+
+        batches = [names[i : i + _GRAPHQL_BATCH] for i in range(0, len(names), _GRAPHQL_BATCH)]
+        await asyncio.gather(*(run_batch(b) for b in batches))
+        return out
+
     async def update_repo(self) -> str:
-        """更新课程数据来源。
+        """/刷 入口：并发触发合并为同一次同步；上次成功后 REFRESH_COOLDOWN 秒内不重复同步。"""
+        task = self._update_task
+        if task is None or task.done():
+            cooldown = float(config.REFRESH_COOLDOWN)
+            elapsed = time.monotonic() - self._last_update_ts
+            if self._last_update_ts and elapsed < cooldown:
+                return (
+                    f"⏱️ {int(elapsed)} 秒前刚刷新过，{int(cooldown - elapsed) + 1} 秒后可再次刷新。\n"
+                    f"上次结果：{self._last_update_result}"
+                )
+            task = self._update_task = asyncio.create_task(self._run_update())
+        # shield：某个调用方被取消时不影响其他等待者和同步本身
+        return await asyncio.shield(task)
+
+    async def _run_update(self) -> str:
+        ok, result = await self._update_repo_impl()
+        # 只有真正成功的同步才进入冷却；有仓库失败时允许立刻重试
+        if ok:
+            self._last_update_ts = time.monotonic()
+            self._last_update_result = result
+        return result
+
+    async def _update_repo_impl(self) -> Tuple[bool, str]:
+        """更新课程数据来源，返回 (是否成功, 提示文本)。
 
         - 默认：从 GitHub Org 枚举并同步各课程仓库到 data/courses/<repo_name>/
         - 兼容：若 org 同步失败，可回退到单仓库 REPO_URL + REPO_DIR
@@ -434,50 +1183,63 @@ class CourseManager:
             repo_names = await self._list_github_org_repos()
             filtered = [n for n in repo_names if self._is_course_repo_name(n)]
             if filtered:
-                sem = asyncio.Semaphore(max(1, int(config.GIT_SYNC_CONCURRENCY)))
                 org = config.GITHUB_ORG.strip()
 
                 mode = (getattr(config, "GIT_SYNC_MODE", "git") or "git").strip().lower()
+                # toml 模式只是 HTTP 请求，HTTP/2 下多路复用很便宜，可以开更高并发；
+                # git 模式的并发由专用线程池大小（GIT_SYNC_CONCURRENCY）决定
+                sem = asyncio.Semaphore(max(1, int(config.TOML_SYNC_CONCURRENCY)))
+                loop = asyncio.get_running_loop()
 
                 results: List[Tuple[str, str]] = []
+                # 内容确实变化的仓库名：只对它们做增量重建
+                changed: List[str] = []
 
                 async def run_one(name: str) -> None:
-                    async with sem:
-                        if mode == "toml":
+                    if mode == "toml":
+                        async with sem:
                             # client is created outside and shared
-                            status, msg = await self._fetch_one_repo_toml(client=toml_client, org=org, name=name)
-                            results.append((status, f"{name}: {msg}"))
-                            return
-
+                            if name in prefetched:
+                                status, msg = prefetched[name]
+                            else:
+                                status, msg = await self._fetch_one_repo_toml(client=toml_client, org=org, name=name)
+                    else:
                         url = f"https://github.com/{org}/{name}.git"
                         repo_dir = config.COURSE_DIR / name
-                        status, msg = await asyncio.to_thread(self._sync_one_repo, repo_url=url, repo_dir=repo_dir)
-                        results.append((status, f"{name}: {msg}"))
+                        status, msg = await loop.run_in_executor(
+                            self._git_executor(),
+                            functools.partial(self._sync_one_repo, repo_url=url, repo_dir=repo_dir),
+                        )
+                    results.append((status, f"{name}: {msg}"))
+                    if status in {"pulled", "cloned"}:
+                        changed.append(name)
 
-                headers = {
-                    "Accept": "application/vnd.github.raw",
-                    "User-Agent": "hitsz_manager",
-                }
-                if config.GITHUB_TOKEN:
-                    headers["Authorization"] = f"Bearer {config.GITHUB_TOKEN}"
+                if mode == "toml":
+                    self._toml_etags = await asyncio.to_thread(self._load_toml_etags)
 
-                timeout = httpx.Timeout(60.0, connect=20.0)
-                async with httpx.AsyncClient(base_url=config.GITHUB_API_BASE, headers=headers, timeout=timeout) as toml_client:
-                    await asyncio.gather(*(run_one(n) for n in filtered))
+                prefetched: Dict[str, Tuple[str, str]] = {}
+                toml_client = self._gh()
+                if mode == "toml" and config.GITHUB_TOKEN:
+                    # 有 token 时先用 GraphQL 批量拉取；没拿到的仓库再逐个走 REST
+                    prefetched = await self._fetch_repo_tomls_graphql(client=toml_client, org=org, names=filtered)
+                await asyncio.gather(*(run_one(n) for n in filtered))
+
+                if mode == "toml":
+                    await asyncio.to_thread(self._save_toml_etags)
 
                 pulled = sum(1 for s, _ in results if s == "pulled")
                 cloned = sum(1 for s, _ in results if s == "cloned")
                 skipped = sum(1 for s, _ in results if s == "skipped")
                 failed = [(s, m) for s, m in results if s == "failed"]
 
-                self.load_data()
+                await self.reindex_repos_async(changed)
 
                 tail = ""
                 if failed:
                     sample = "\n".join([m for _, m in failed[:5]])
                     tail = f"\n⚠️ 失败 {len(failed)} 个（示例前 5）：\n{sample}"
 
-                return (
+                return not failed, (
                     f"✅ 已从 GitHub Org 同步课程仓库（mode={mode}）：pull {pulled} / clone {cloned} / skip {skipped}。"
                     f"\n📚 当前共索引 {len(self.course_map)} 门课程。"
                     f"{tail}"
@@ -490,79 +1252,151 @@ class CourseManager:
 
         # 2) 回退：单仓库同步（旧模式）
         try:
+            depth = int(getattr(config, "GIT_CLONE_DEPTH", 1) or 0)
+            loop = asyncio.get_running_loop()
             if config.REPO_DIR.exists():
-                repo = git.Repo(config.REPO_DIR)
-                repo.remotes.origin.pull()
-                msg = "Git Pull 成功（旧模式）"
+                changed = await loop.run_in_executor(self._git_executor(), _git_pull, config.REPO_DIR, depth)
+                msg = "Git Pull 成功（旧模式）" if changed else "已是最新（旧模式）"
             else:
-                depth = int(getattr(config, "GIT_CLONE_DEPTH", 1) or 0)
-                if depth > 0:
-                    git.Repo.clone_from(config.REPO_URL, config.REPO_DIR, depth=depth, single_branch=True)
-                else:
-                    git.Repo.clone_from(config.REPO_URL, config.REPO_DIR)
+                await loop.run_in_executor(self._git_executor(), _git_clone, config.REPO_URL, config.REPO_DIR, depth)
+                changed = True
                 msg = "Git Clone 成功（旧模式）"
 
-            self.load_data()
+            if changed:
+                await self.reindex_repos_async([config.REPO_DIR.name])
             prefix = f"⚠️ Org 同步失败，已回退到旧模式：{org_err}\n" if org_err else ""
-            return f"{prefix}✅ {msg}，当前共索引 {len(self.course_map)} 门课程。"
+            return True, f"{prefix}✅ {msg}，当前共索引 {len(self.course_map)} 门课程。"
         except Exception as e:
             prefix = f"⚠️ Org 同步失败：{org_err}\n" if org_err else ""
-            return f"{prefix}❌ 更新仓库失败: {e}"
+            return False, f"{prefix}❌ 更新仓库失败: {e}"
 
     def add_nickname(self, nick: str, code: str) -> bool:
         code = code.upper()
         if code in self.course_map:
             self.nicknames[nick] = code
-            self.save_nicknames()
+            self._rebuild_nickname_index()
+            self._schedule_nickname_flush()
             return True
         return False
 
+    def get_by_code_fast(self, code_upper: str) -> Optional[Dict[str, Any]]:
+        """已大写的课程代码直查：一次 dict 查找，不走昵称/全名/子课程回退。"""
+        return self.course_map.get(code_upper)
+
     def get_course_detail(self, query: str) -> Optional[Dict[str, Any]]:
         """精确查找：支持 代码、全名、昵称"""
         query = query.strip()
+        course_map = self.course_map
+
+        qu = query.upper()
         # 兼容：用户从 /搜 结果复制 "CODE name" 过来
-        if " " in query:
-            first = query.split(" ", 1)[0].strip().upper()
-            if first in self.course_map:
-                return self.course_map[first]
-        
+        if " " in qu:
+            entry = course_map.get(qu.split(" ", 1)[0])
+            if entry is not None:
+                return entry
+
         # 1. 尝试直接匹配 Code
-        if query.upper() in self.course_map:
-            return self.course_map[query.upper()]
-        
+        entry = course_map.get(qu)
+        if entry is not None:
+            return entry
+
         # 2. 尝试匹配昵称 -> Code
-        if query in self.nicknames:
-            code = self.nicknames[query]
-            if code in self.course_map:
-                return self.course_map[code]
-        
+        code = self.nicknames.get(query)
+        if code:
+            entry = course_map.get(code)
+            if entry is not None:
+                return entry
+
         # 3. 尝试匹配全名
-        for c in self.courses_cache:
-            if str(c.get("course_name") or "").strip() == query:
-                return c
+        if query in self._name_map:
+            return self._name_map[query]
 
         # 4. multi-project 子课程：允许直接用子课程名字精确查询
-        for c in self.courses_cache:
-            if not isinstance(c, dict):
+        sub = self._sub_name_map.get(query)
+        if sub is not None:
+            # 返回副本，调用方改动不会污染索引
+            return dict(sub)
+        return None
+
+    def _build_search_index(self) -> None:
+        """把 courses_cache 展平成 /搜 用的 (hay, code, name) 行，顺序与原先逐课程遍历一致。"""
+        hays: List[str] = []
+        codes: List[str] = []
+        names: List[str] = []
+
+        for course in self.courses_cache:
+            if not isinstance(course, dict):
                 continue
-            if str(c.get("repo_type") or "").strip() != "multi-project":
+            # 普通课程/父仓库：按 code/name 匹配
+            code = str(course.get("course_code") or "").strip().upper()
+            name = str(course.get("course_name") or "").strip()
+            if code:
+                hays.append(f"{code} {name}".lower())
+                codes.append(code)
+                names.append(name or code)
+
+            # multi-project 子课程：按子课程 name/教师名匹配
+            if str(course.get("repo_type") or "").strip() != "multi-project":
                 continue
-            courses = c.get("courses")
+            courses = course.get("courses")
             if not isinstance(courses, list):
                 continue
-            for idx, sub in enumerate(courses):
+            parent_code = code
+            for sub in courses:
                 if not isinstance(sub, dict):
                     continue
-                name = str(sub.get("name") or "").strip()
-                if name and name == query:
-                    return {
-                        "_schema": "multi-project-item",
-                        "_parent": c,
-                        "_course_index": idx,
-                        "course_code": str(c.get("course_code") or "").strip().upper(),
-                        "course_name": name,
-                    }
-        return None
+                sub_name = str(sub.get("name") or "").strip()
+                if not sub_name:
+                    continue
+                teachers = sub.get("teachers")
+                teacher_names = ""
+                if isinstance(teachers, list):
+                    teacher_names = " ".join(
+                        [str(t.get("name") or "").strip() for t in teachers if isinstance(t, dict)]
+                    )
+                hays.append(f"{sub_name} {teacher_names} {parent_code}".lower())
+                # code 字段用于后续 /查，这里用子课程名作为查询词
+                codes.append(sub_name)
+                names.append(f"{sub_name}（{parent_code}）" if parent_code else sub_name)
+
+        bigrams: Dict[str, List[int]] = defaultdict(list)
+        trigrams: Dict[str, List[int]] = defaultdict(list)
+        for i, hay in enumerate(hays):
+            for g in {hay[j : j + 2] for j in range(len(hay) - 1)}:
+                bigrams[g].append(i)
+            for g in {hay[j : j + 3] for j in range(len(hay) - 2)}:
+                trigrams[g].append(i)
+
+        self._search_hays = hays
+        self._search_codes = codes
+        self._search_names = names
+        self._search_bigrams = dict(bigrams)
+        self._search_trigrams = dict(trigrams)
+        # 昵称行里缓存了课程名，课程数据变了也要跟着重建
+        self._rebuild_nickname_index()
+
+    def _search_rows(self, keyword_l: str) -> Sequence[int]:
+        """返回 hay 中可能包含 keyword_l 的行号（升序）；单字符查询退化为全部行。"""
+        if len(keyword_l) < 2:
+            # range 不物化列表：命中 20 条就提前结束时，无需为整个语料分配行号
+            return range(len(self._search_hays))
+        if len(keyword_l) == 2:
+            # 两字中文词（如“物理”）很常见：2-gram 倒排表本身就是精确结果
+            return self._search_bigrams.get(keyword_l, [])
+        grams = {keyword_l[j : j + 3] for j in range(len(keyword_l) - 2)}
+        postings = []
+        for g in grams:
+            rows = self._search_trigrams.get(g)
+            if not rows:
+                return []
+            postings.append(rows)
+        postings.sort(key=len)
+        cands = set(postings[0])
+        for rows in postings[1:]:
+            cands.intersection_update(rows)
+            if not cands:
+                return []
+        return sorted(cands)
 
     def search_fuzzy(self, keyword: str) -> List[Dict[str, str]]:
         """搜索：仅硬匹配 + 昵称匹配（不做 fuzzy）。
@@ -588,47 +1422,17 @@ class CourseManager:
             seen.add(code)
 
         # 1) 昵称匹配：支持“完全命中”与“包含命中”
-        for nick, code in self.nicknames.items():
-            if not nick:
-                continue
-            if keyword_l in str(nick).lower():
-                mapped = str(code or "").strip().upper()
-                course = self.course_map.get(mapped)
-                if course:
-                    _push(mapped, str(course.get("course_name") or mapped))
-
-        # 2) 普通课程/父仓库：按 code/name 子串硬匹配
-        for course in self.courses_cache:
-            if not isinstance(course, dict):
-                continue
-            code = str(course.get("course_code") or "").strip().upper()
-            name = str(course.get("course_name") or "").strip()
-            hay = f"{code} {name}".lower()
-            if code and keyword_l in hay:
-                _push(code, name or code)
-
-            # 3) multi-project 子课程：按子课程 name/教师名子串硬匹配
-            if str(course.get("repo_type") or "").strip() == "multi-project":
-                courses = course.get("courses")
-                if not isinstance(courses, list):
-                    continue
-                parent_code = code
-                for sub in courses:
-                    if not isinstance(sub, dict):
-                        continue
-                    sub_name = str(sub.get("name") or "").strip()
-                    if not sub_name:
-                        continue
-                    teachers = sub.get("teachers")
-                    teacher_names = ""
-                    if isinstance(teachers, list):
-                        teacher_names = " ".join(
-                            [str(t.get("name") or "").strip() for t in teachers if isinstance(t, dict)]
-                        )
-                    sub_hay = f"{sub_name} {teacher_names} {parent_code}".lower()
-                    if keyword_l in sub_hay:
-                        # code 字段用于后续 /查，这里用子课程名作为查询词
-                        _push(sub_name, f"{sub_name}（{parent_code}）" if parent_code else sub_name)
+        for nick_l, mapped, name in self._nicknames_lower:
+            if keyword_l in nick_l:
+                _push(mapped, name)
+
+        # 2) 课程/父仓库/multi-project 子课程：先用 3-gram 倒排剪枝，再做子串硬匹配确认
+        hays = self._search_hays
+        for i in self._search_rows(keyword_l):
+            if keyword_l in hays[i]:
+                _push(self._search_codes[i], self._search_names[i])
+                if len(out) >= 20:
+                    break
 
         return out[:20]
 
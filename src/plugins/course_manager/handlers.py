@@ -1,9 +1,18 @@
+import re
+import time
+from collections import deque
+
 from nonebot import on_message
 from nonebot.adapters.onebot.v11 import MessageEvent, Bot, Message
 from nonebot_plugin_alconna import Alconna, Args, on_alconna
 from nonebot.rule import to_me
 
-from .data_loader import course_manager
+from .data_loader import KIND_MULTI_ITEM, KIND_MULTI_PROJECT, KIND_NORMAL, course_manager
+
+_LOADING_MSG = "⏳ 课程数据仍在加载中，请稍后再试。"
+
+# 形如课程代码的输入（字母开头、3~10 位字母数字）：/查 先走 dict 直查
+_CODE_RE = re.compile(r"[A-Za-z][A-Za-z0-9]{2,9}")
 
 # --- 工具函数：构造合并转发节点 ---
 def make_node(bot: Bot, content: str, name: str = "Hoa_Anon酱"):
@@ -16,6 +25,31 @@ def make_node(bot: Bot, content: str, name: str = "Hoa_Anon酱"):
         }
     }
 
+def _norm_text(s: str) -> str:
+    return (s or "").strip().replace("\r\n", "\n")
+
+
+def _safe_str(v) -> str:
+    return "" if v is None else str(v)
+
+
+def _doc_text(d: dict, key: str) -> str:
+    """课程文档里的长文本字段：优先用建索引时预先规范化好的 _<key>_norm，旧缓存里没有时现算。"""
+    v = d.get(f"_{key}_norm")
+    return v if isinstance(v, str) else _norm_text(_safe_str(d.get(key)))
+
+
+def _fmt_author(d) -> str:
+    if not isinstance(d, dict):
+        return ""
+    name = _safe_str(d.get("name")).strip()
+    link = _safe_str(d.get("link")).strip()
+    date = _safe_str(d.get("date")).strip()
+    tail = " ".join([x for x in [name, date] if x])
+    if link:
+        tail = (tail + " " + link).strip()
+    return f"\n👤 {tail}" if tail else ""
+
 # =======================
 # 功能 1: 课程搜索 (模糊)
 # =======================
@@ -24,6 +58,8 @@ matcher_search = on_alconna(Alconna("搜", Args["keyword", str]), aliases={"sear
 
 @matcher_search.handle()
 async def handle_search(keyword: str):
+    if not await course_manager.wait_ready():
+        await matcher_search.finish(_LOADING_MSG)
     matches = course_manager.search_fuzzy(keyword)
     
     if not matches:
@@ -37,6 +73,148 @@ async def handle_search(keyword: str):
     await matcher_search.finish(msg)
 
 
+_RESOURCE_PAGE = "🔗 相关资源\n👉 完整内容：https://hoa.moe"
+
+
+def _course_header(course: dict, desc_doc: dict) -> str:
+    return (
+        f"📚 【{_safe_str(course.get('course_name'))}】\n"
+        f"代码：{_safe_str(course.get('course_code'))}\n"
+        f"══════════════════\n{_doc_text(desc_doc, 'description')}"
+    ).strip()
+
+
+def _teacher_block(name: str, reviews: list) -> str:
+    lines = [f"👨‍🏫 授课教师：{name}"]
+    lines.extend(f"「{rev['content']}」{_fmt_author(rev.get('author'))}" for rev in reviews if rev.get("content"))
+    return "\n\n".join(lines).strip()
+
+
+def _section_body(sec: dict) -> str:
+    return "\n\n".join(it["content"] + _fmt_author(it.get("author")) for it in sec["items"] if it.get("content"))
+
+
+def _push_section_pages(pages: list[str], sections: list) -> None:
+    for sec in sections:
+        body = _norm_text(_section_body(sec))
+        if body:
+            title = _safe_str(sec.get("title") or "(未命名章节)")
+            pages.append(f"📌 {title}\n{body}".strip())
+
+
+# 以下渲染器只处理 data_loader 建索引时已规整过的条目：
+# courses/teachers/lecturers/sections/items/reviews 均为 list[dict]，按 course["_kind"] 分派。
+def _render_multi_project(course: dict) -> list[str]:
+    """multi-project 父仓库：输出该仓库下所有子课程的全量内容。"""
+    pages = [_course_header(course, course)]
+    for idx, sub in enumerate(course["courses"]):
+        sub_name = _safe_str(sub.get("name") or f"(未命名子课程 {idx + 1})")
+        sub_code = _safe_str(sub.get("code") or "").strip()
+        title = f"🧩 {sub_name}" + (f"（{sub_code}）" if sub_code else "")
+
+        parts = [_teacher_block(_safe_str(t.get("name") or "(未命名教师)"), t["reviews"]) for t in sub["teachers"]]
+        for sec in sub["sections"]:
+            body = _section_body(sec)
+            if body:
+                parts.append(f"📌 {_safe_str(sec.get('title') or '(未命名章节)')}\n{body}")
+
+        if parts:
+            pages.append(f"{title}\n\n" + "\n\n".join(parts))
+        else:
+            pages.append(f"{title}\n（暂无更多内容）")
+    return pages
+
+
+def _render_multi_item(course: dict) -> list[str]:
+    """multi-project 子课程 wrapper：内容取自父仓库 courses[_course_index]。"""
+    parent = course.get("_parent") or {}
+    idx = int(course.get("_course_index") or 0)
+    courses = parent.get("courses") or []
+    sub = courses[idx] if 0 <= idx < len(courses) else {}
+
+    pages = [_course_header(course, parent)]
+    pages.extend(_teacher_block(_safe_str(t.get("name") or "(未命名教师)"), t["reviews"]) for t in sub.get("teachers") or [])
+    _push_section_pages(pages, sub.get("sections") or [])
+    return pages
+
+
+def _render_normal(course: dict) -> list[str]:
+    """普通课程：sections/lecturers。"""
+    header = _course_header(course, course)
+    if course.get("notices"):
+        header += f"\n\n📢 注意事项：\n{_doc_text(course, 'notices')}"
+    pages = [header]
+    pages.extend(
+        _teacher_block(_safe_str(lec.get("name") or "(未命名教师)"), lec["reviews"]) for lec in course.get("lecturers") or []
+    )
+    _push_section_pages(pages, course.get("sections") or [])
+    return pages
+
+
+_RENDERERS = {
+    KIND_MULTI_PROJECT: _render_multi_project,
+    KIND_MULTI_ITEM: _render_multi_item,
+    KIND_NORMAL: _render_normal,
+}
+
+
+def _render_course_pages(course: dict) -> list[str]:
+    """把课程渲染成合并转发的各节点文本（兼容新旧两套 schema）。"""
+    pages = _RENDERERS.get(course.get("_kind"), _render_normal)(course)
+    pages.append(_RESOURCE_PAGE)
+    return pages
+
+
+# /查 发送耗时统计：保留最近 _API_SAMPLES 次 call_api 的耗时，每 _API_REPORT_EVERY 次打印一次 P50/P99。
+# OneBot 走反向 WebSocket，连接本身由协议端维持长连，这里只做观测。
+_API_SAMPLES = 200
+_API_REPORT_EVERY = 100
+_api_latency: deque[float] = deque(maxlen=_API_SAMPLES)
+_api_calls = 0
+
+
+async def _timed_call_api(bot: Bot, api: str, **data):
+    global _api_calls
+    start = time.perf_counter()
+    try:
+        return await bot.call_api(api, **data)
+    finally:
+        _api_latency.append(time.perf_counter() - start)
+        _api_calls += 1
+        if _api_calls % _API_REPORT_EVERY == 0:
+            xs = sorted(_api_latency)
+            p50 = xs[len(xs) // 2] * 1000
+            p99 = xs[min(len(xs) - 1, int(len(xs) * 0.99))] * 1000
+            print(f"📈 /查 call_api 耗时（最近 {len(xs)} 次）: P50 {p50:.0f}ms, P99 {p99:.0f}ms")
+
+
+# /查 合并转发节点缓存：课程数据只在加载/刷新后变化，data_version 一变整表作废。
+# 节点里的 uin 随 bot 不同，所以 key 带上 bot.self_id；缓存的节点只读，发送时不会被修改。
+_NODES_CACHE_MAX = 512
+_nodes_cache: dict[tuple, list[dict]] = {}
+_nodes_cache_version = -1
+
+
+def _course_nodes(bot: Bot, course: dict) -> list[dict]:
+    global _nodes_cache_version
+    if _nodes_cache_version != course_manager.data_version:
+        _nodes_cache.clear()
+        _nodes_cache_version = course_manager.data_version
+    key = (
+        bot.self_id,
+        course.get("_kind"),
+        course.get("course_code"),
+        course.get("course_name"),
+        course.get("_course_index"),
+    )
+    nodes = _nodes_cache.get(key)
+    if nodes is None:
+        if len(_nodes_cache) >= _NODES_CACHE_MAX:
+            _nodes_cache.clear()
+        nodes = _nodes_cache[key] = [make_node(bot, c) for c in _render_course_pages(course)]
+    return nodes
+
+
 # =======================
 # 功能 2: 课程详情查询
 # =======================
@@ -45,7 +223,13 @@ matcher_query = on_alconna(Alconna("查", Args["target", str]), aliases={"info"}
 
 @matcher_query.handle()
 async def handle_query(bot: Bot, event: MessageEvent, target: str):
-    course = course_manager.get_course_detail(target)
+    if not await course_manager.wait_ready():
+        await matcher_query.finish(_LOADING_MSG)
+    course = None
+    if _CODE_RE.fullmatch(target):
+        course = course_manager.get_by_code_fast(target.upper())
+    if course is None:
+        course = course_manager.get_course_detail(target)
 
     # 若精确匹配失败：复用 /搜 的逻辑。
     # - 唯一候选：直接展示完整信息
@@ -65,32 +249,6 @@ async def handle_query(bot: Bot, event: MessageEvent, target: str):
                 await matcher_query.finish(msg)
             await matcher_query.finish(f"❌ 未找到 '{target}'，请先尝试使用 /搜 确认名称。")
 
-    def _norm_text(s: str) -> str:
-        return (s or "").strip().replace("\r\n", "\n")
-
-    def _safe_str(v) -> str:
-        return "" if v is None else str(v)
-
-    def _fmt_author(d) -> str:
-        if not isinstance(d, dict):
-            return ""
-        name = _safe_str(d.get("name")).strip()
-        link = _safe_str(d.get("link")).strip()
-        date = _safe_str(d.get("date")).strip()
-        tail = " ".join([x for x in [name, date] if x])
-        if link:
-            tail = (tail + " " + link).strip()
-        return f"\n👤 {tail}" if tail else ""
-
-    def _push_block(title: str, body: str):
-        body = _norm_text(body)
-        if not body:
-            return
-        nodes.append(make_node(bot, f"{title}\n{body}".strip()))
-
-    # 构建合并转发消息（兼容新旧两套 schema）
-    nodes = []
-
     async def _send_forward_or_fallback(nodes_to_send):
         def _as_text(nodes_subset) -> str:
             parts = []
@@ -107,21 +265,22 @@ async def handle_query(bot: Bot, event: MessageEvent, target: str):
                 await matcher_query.finish("⚠️ 无可发送内容。")
             # OneBot 单条消息过长容易失败；这里分段。
             chunk_size = 1500
-            chunks = [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+            msgs = [Message(text[i : i + chunk_size]) for i in range(0, len(text), chunk_size)]
             group_id = getattr(event, "group_id", None)
             if group_id:
-                for c in chunks:
-                    await bot.call_api("send_group_msg", group_id=group_id, message=Message(c))
+                api, dest = "send_group_msg", {"group_id": group_id}
             else:
-                for c in chunks:
-                    await bot.call_api("send_private_msg", user_id=event.user_id, message=Message(c))
+                api, dest = "send_private_msg", {"user_id": event.user_id}
+            # 同一段文本的分片必须按顺序到达，所以逐条 await，不并发发送
+            for m in msgs:
+                await _timed_call_api(bot, api, message=m, **dest)
 
         async def _send_forward(nodes_batch):
             group_id = getattr(event, "group_id", None)
             if group_id:
-                await bot.call_api("send_group_forward_msg", group_id=group_id, messages=nodes_batch)
+                await _timed_call_api(bot, "send_group_forward_msg", group_id=group_id, messages=nodes_batch)
             else:
-                await bot.call_api("send_private_forward_msg", user_id=event.user_id, messages=nodes_batch)
+                await _timed_call_api(bot, "send_private_forward_msg", user_id=event.user_id, messages=nodes_batch)
 
         async def _send_in_batches(nodes_all, batch_size: int) -> bool:
             batches = [nodes_all[i : i + batch_size] for i in range(0, len(nodes_all), batch_size)]
@@ -146,151 +305,7 @@ async def handle_query(bot: Bot, event: MessageEvent, target: str):
         # 优先分批合并转发：避免单条 forward 因节点过多/内容过长触发失败。
         await _send_in_batches(nodes_to_send, batch_size=25)
 
-    # multi-project 父仓库：输出该仓库下所有子课程的全量内容
-    if isinstance(course, dict) and str(course.get("repo_type") or "").strip() == "multi-project" and isinstance(course.get("courses"), list):
-        header = (
-            f"📚 【{_safe_str(course.get('course_name'))}】\n"
-            f"代码：{_safe_str(course.get('course_code'))}\n"
-            f"══════════════════\n{_norm_text(_safe_str(course.get('description')))}"
-        ).strip()
-        nodes.append(make_node(bot, header))
-
-        courses_list = course.get("courses")
-        if not isinstance(courses_list, list):
-            courses_list = []
-        for idx, sub in enumerate(courses_list):
-            if not isinstance(sub, dict):
-                continue
-            sub_name = _safe_str(sub.get("name") or f"(未命名子课程 {idx + 1})")
-            sub_code = _safe_str(sub.get("code") or "").strip()
-            title = f"🧩 {sub_name}" + (f"（{sub_code}）" if sub_code else "")
-
-            parts: list[str] = []
-            teachers = sub.get("teachers")
-            if isinstance(teachers, list) and teachers:
-                for t in teachers:
-                    if not isinstance(t, dict):
-                        continue
-                    name = _safe_str(t.get("name") or "(未命名教师)")
-                    txt = f"👨‍🏫 授课教师：{name}"
-                    reviews = t.get("reviews")
-                    if isinstance(reviews, list):
-                        for rev in reviews:
-                            if isinstance(rev, dict) and rev.get("content"):
-                                txt += f"\n\n「{_norm_text(_safe_str(rev.get('content')))}」{_fmt_author(rev.get('author'))}"
-                    parts.append(txt.strip())
-
-            sections = sub.get("sections")
-            if isinstance(sections, list) and sections:
-                for sec in sections:
-                    if not isinstance(sec, dict):
-                        continue
-                    st = _safe_str(sec.get("title") or "(未命名章节)")
-                    items = sec.get("items")
-                    blocks = []
-                    if isinstance(items, list):
-                        for it in items:
-                            if isinstance(it, dict) and it.get("content"):
-                                blocks.append(_norm_text(_safe_str(it.get("content"))) + _fmt_author(it.get("author")))
-                    body = "\n\n".join([b for b in blocks if b])
-                    if body:
-                        parts.append(f"📌 {st}\n{body}")
-
-            if parts:
-                nodes.append(make_node(bot, f"{title}\n\n" + "\n\n".join(parts)))
-            else:
-                nodes.append(make_node(bot, f"{title}\n（暂无更多内容）"))
-
-        nodes.append(make_node(bot, "🔗 相关资源\n👉 完整内容：https://hoa.moe"))
-        await _send_forward_or_fallback(nodes)
-        return
-
-    # multi-project 子课程 wrapper
-    if isinstance(course, dict) and course.get("_schema") == "multi-project-item":
-        parent = course.get("_parent") or {}
-        idx = int(course.get("_course_index") or 0)
-        courses = parent.get("courses") if isinstance(parent, dict) else None
-        sub = courses[idx] if isinstance(courses, list) and 0 <= idx < len(courses) else {}
-
-        header = (
-            f"📚 【{_safe_str(course.get('course_name'))}】\n"
-            f"代码：{_safe_str(course.get('course_code'))}\n"
-            f"══════════════════\n{_norm_text(_safe_str(parent.get('description')))}"
-        ).strip()
-        nodes.append(make_node(bot, header))
-
-        # teachers + reviews
-        teachers = sub.get("teachers") if isinstance(sub, dict) else None
-        if isinstance(teachers, list):
-            for t in teachers:
-                if not isinstance(t, dict):
-                    continue
-                name = _safe_str(t.get("name") or "(未命名教师)")
-                reviews = t.get("reviews")
-                txt = f"👨‍🏫 授课教师：{name}\n"
-                if isinstance(reviews, list):
-                    for rev in reviews:
-                        if isinstance(rev, dict) and rev.get("content"):
-                            txt += f"\n「{_norm_text(_safe_str(rev.get('content')))}」{_fmt_author(rev.get('author'))}\n"
-                nodes.append(make_node(bot, txt.strip()))
-
-        # sections/items
-        sections = sub.get("sections") if isinstance(sub, dict) else None
-        if isinstance(sections, list):
-            for sec in sections:
-                if not isinstance(sec, dict):
-                    continue
-                title = _safe_str(sec.get("title") or "(未命名章节)")
-                items = sec.get("items")
-                blocks = []
-                if isinstance(items, list):
-                    for it in items:
-                        if isinstance(it, dict) and it.get("content"):
-                            blocks.append(_norm_text(_safe_str(it.get("content"))) + _fmt_author(it.get("author")))
-                _push_block(f"📌 {title}", "\n\n".join([b for b in blocks if b]))
-
-    # sections/lecturers
-    elif isinstance(course, dict):
-        header = (
-            f"📚 【{_safe_str(course.get('course_name'))}】\n"
-            f"代码：{_safe_str(course.get('course_code'))}\n"
-            f"══════════════════\n{_norm_text(_safe_str(course.get('description')))}"
-        ).strip()
-        if course.get("notices"):
-            header += f"\n\n📢 注意事项：\n{_norm_text(_safe_str(course.get('notices')))}"
-        nodes.append(make_node(bot, header))
-
-        lecturers = course.get("lecturers")
-        if isinstance(lecturers, list):
-            for lec in lecturers:
-                if not isinstance(lec, dict):
-                    continue
-                txt = f"👨‍🏫 授课教师：{_safe_str(lec.get('name') or '(未命名教师)')}\n"
-                reviews = lec.get("reviews")
-                if isinstance(reviews, list):
-                    for rev in reviews:
-                        if isinstance(rev, dict) and rev.get("content"):
-                            txt += f"\n「{_norm_text(_safe_str(rev.get('content')))}」{_fmt_author(rev.get('author'))}\n"
-                nodes.append(make_node(bot, txt.strip()))
-
-        sections2 = course.get("sections")
-        if not isinstance(sections2, list):
-            sections2 = []
-
-        for sec in sections2:
-            if not isinstance(sec, dict):
-                continue
-            title = _safe_str(sec.get("title") or "(未命名章节)")
-            items = sec.get("items")
-            blocks = []
-            if isinstance(items, list):
-                for it in items:
-                    if isinstance(it, dict) and it.get("content"):
-                            blocks.append(_norm_text(_safe_str(it.get("content"))) + _fmt_author(it.get("author")))
-            _push_block(f"📌 {title}", "\n\n".join([b for b in blocks if b]))
-
-    nodes.append(make_node(bot, "🔗 相关资源\n👉 完整内容：https://hoa.moe"))
-    await _send_forward_or_fallback(nodes)
+    await _send_forward_or_fallback(_course_nodes(bot, course))
 
 
 # =======================
@@ -312,27 +327,12 @@ async def handle_teacher_query(target: str):
     if not q:
         await matcher_teacher_query.finish("用法：/查老师 <教师姓名或拼音首字母>\n示例：/查老师 裴文杰  或  /查老师 pwj")
 
+    if not await course_manager.wait_ready():
+        await matcher_teacher_query.finish(_LOADING_MSG)
     matches = course_manager.search_teacher_reviews(q)
     if not matches:
         await matcher_teacher_query.finish(f"🧐 未找到教师“{q}”的评价。")
 
-    def _norm_text(s: str) -> str:
-        return (s or "").strip().replace("\r\n", "\n")
-
-    def _safe_str(v) -> str:
-        return "" if v is None else str(v)
-
-    def _fmt_author(d) -> str:
-        if not isinstance(d, dict):
-            return ""
-        name = _safe_str(d.get("name")).strip()
-        link = _safe_str(d.get("link")).strip()
-        date = _safe_str(d.get("date")).strip()
-        tail = " ".join([x for x in [name, date] if x])
-        if link:
-            tail = (tail + " " + link).strip()
-        return f"\n👤 {tail}" if tail else ""
-
     lines: list[str] = []
     total_reviews = sum(len(m.get("reviews") or []) for m in matches)
     lines.append(f"👨‍🏫 教师评价检索：{q}")
@@ -357,7 +357,7 @@ async def handle_teacher_query(target: str):
         for j, rv in enumerate(reviews[:5], start=1):
             if not isinstance(rv, dict):
                 continue
-            content = _norm_text(_safe_str(rv.get("content")))
+            content = _safe_str(rv.get("content"))  # 已在建索引时规范化
             if len(content) > 220:
                 content = content[:219] + "…"
             lines.append(f"   {j}) {content}{_fmt_author(rv.get('author'))}")
@@ -386,6 +386,8 @@ matcher_nick = on_alconna(Alconna("设置昵称", Args["nick", str], Args["code"
 
 @matcher_nick.handle()
 async def handle_nick(nick: str, code: str):
+    if not await course_manager.wait_ready():
+        await matcher_nick.finish(_LOADING_MSG)
     # 允许用户直接填课程名：如 “/设置昵称 大物 大学物理”
     raw = (code or "").strip()
     resolved = ""
@@ -395,6 +397,7 @@ async def handle_nick(nick: str, code: str):
     if not resolved:
         resolved = raw.strip().upper()
 
+    # add_nickname 只改内存，nicknames.json 由 course_manager 延迟合并写入
     success = course_manager.add_nickname(nick, resolved)
     if success:
         await matcher_nick.finish(f"✅ 成功将「{nick}」指向 {resolved}")
@@ -410,6 +413,8 @@ matcher_reload = on_alconna(Alconna("刷"), aliases={"update"}, use_cmd_start=Tr
 
 @matcher_reload.handle()
 async def handle_reload():
+    if not await course_manager.wait_ready():
+        await matcher_reload.finish(_LOADING_MSG)
     await matcher_reload.send("⏳ 正在拉取最新数据...")
     res = await course_manager.update_repo()
     await matcher_reload.finish(res)
@@ -421,10 +426,26 @@ async def handle_reload():
 matcher_build_kb = on_alconna(Alconna("重构知识库"), use_cmd_start=True, rule=to_me(), priority=1)
 
 @matcher_build_kb.handle()
-async def handle_build_kb():
+async def handle_build_kb(bot: Bot, event: MessageEvent):
     from .rag_engine import rag_engine
     await matcher_build_kb.send("⏳ 正在重构知识库（CPU 占用较高，请稍候）...")
-    res = await rag_engine.rebuild_index()
+
+    # 进度回调在工作线程调度回事件循环执行，拿不到 matcher 上下文，直接用 bot.send
+    # 每批都会回调一次；只在跨过 25%/50%/75% 时发消息，避免大语料刷屏
+    reported = 0
+
+    async def _progress(done: int, total: int):
+        nonlocal reported
+        quarter = done * 4 // total
+        if quarter <= reported:
+            return
+        reported = quarter
+        try:
+            await bot.send(event, f"⏳ 已写入 {done}/{total} 个文本片段...")
+        except Exception:
+            pass
+
+    res = await rag_engine.rebuild_index(_progress)
     await matcher_build_kb.finish(res)
 
 
@@ -1,15 +1,200 @@
+import asyncio
+import importlib.util
 import os
-from typing import Any, Optional, cast
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, cast
+
+import numpy as np
 
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_openai import ChatOpenAI
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from .config import config
+from .data_loader import _atomic_write_bytes, _json_dumps_pretty, _json_loads, _read_text_file
+
+
+# /问 答案缓存：先按规范化后的问题精确命中，再按问题向量的余弦相似度近似命中
+_ANSWER_CACHE_MAX = 1024
+_ANSWER_CACHE_TTL = 3600.0
+_SEMANTIC_HIT_THRESHOLD = 0.95
+
+_QUERY_STRIP_RE = re.compile(r"[\s，。！？、；：,.!?;:~～…\"'“”‘’（）()]+")
+
+
+def _normalize_question(q: str) -> str:
+    return _QUERY_STRIP_RE.sub("", q).lower()
+
+
+# 寒暄类问题不需要检索知识库，也不值得调 LLM：直接固定回复（key 为 _normalize_question 之后的文本）
+_INTRO_REPLY = "👋 我是 HITSZ 校园助手，可以回答校园生活相关问题，例如：/问 图书馆几点开门"
+_SMALL_TALK: Dict[str, str] = {
+    **dict.fromkeys(("你好", "您好", "hi", "hello", "在吗", "在不在", "哈喽", "嗨"), _INTRO_REPLY),
+    **dict.fromkeys(("你是谁", "你是什么", "你能做什么", "你会什么", "介绍一下你自己", "帮助", "help"), _INTRO_REPLY),
+    **dict.fromkeys(("谢谢", "谢谢你", "多谢", "感谢", "thanks", "thankyou", "thx"), "😊 不客气！"),
+    **dict.fromkeys(("再见", "拜拜", "bye"), "👋 再见！"),
+}
+
+
+class _AnswerCache:
+    """LRU + TTL 的答案缓存。向量已归一化，点积即余弦相似度；条目上限 1024，暴力矩阵乘足够快。"""
+
+    def __init__(self, maxsize: int = _ANSWER_CACHE_MAX, ttl: float = _ANSWER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (写入时间, 答案, 问题向量)
+        self._items: "OrderedDict[str, Tuple[float, str, Optional[np.ndarray]]]" = OrderedDict()
+        self._keys: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def clear(self) -> None:
+        self._items.clear()
+        self._keys = []
+        self._matrix = None
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if time.monotonic() - item[0] > self.ttl:
+            self._drop(key)
+            return None
+        self._items.move_to_end(key)
+        return item[1]
+
+    def get_similar(self, vec: np.ndarray) -> Optional[str]:
+        if self._matrix is None:
+            self._rebuild_matrix()
+        if self._matrix is None or not len(self._keys):
+            return None
+        scores = self._matrix @ vec
+        best = int(np.argmax(scores))
+        if scores[best] < _SEMANTIC_HIT_THRESHOLD:
+            return None
+        return self.get(self._keys[best])
+
+    def put(self, key: str, answer: str, vec: Optional[np.ndarray]) -> None:
+        self._items[key] = (time.monotonic(), answer, vec)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        self._matrix = None
+
+    def _drop(self, key: str) -> None:
+        self._items.pop(key, None)
+        self._matrix = None
+
+    def _rebuild_matrix(self) -> None:
+        rows = [(k, v[2]) for k, v in self._items.items() if v[2] is not None]
+        self._keys = [k for k, _ in rows]
+        self._matrix = np.vstack([v for _, v in rows]) if rows else None
+
+
+_EMBED_QUERY_CACHE_MAX = 4096
+
+# 检索：最终送进 prompt 的片段数；开启重排时先取 _RERANK_CANDIDATES 个候选
+_FINAL_K = 3
+_RERANK_CANDIDATES = 30
+_RERANK_CACHE_MAX = 4096
+_RERANK_CACHE_TTL = 900.0
+# 带引号的短语或文件名：按字面检索即可，不值得再跑重排
+_RERANK_SKIP_RE = re.compile(r"[\"“”「」『』]|\.[A-Za-z][A-Za-z0-9]{0,4}(?![A-Za-z0-9])")
+
+# Chroma 集合的 HNSW 参数：向量已归一化，用 cosine；k 很小，search_ef 不必开太大
+_HNSW_METADATA = {"hnsw:space": "cosine", "hnsw:M": 32, "hnsw:construction_ef": 200, "hnsw:search_ef": 64}
+
+# 重建知识库时每批写入 Chroma 的片段数；模型内部再按 _ENCODE_BATCH 切 batch 前向
+_ADD_BATCH = 256
+_ENCODE_BATCH = 64
+_REBUILDING_MSG = "⏳ 知识库正在重建，请稍后再问。"
+
+# onnx-int8：sentence-transformers 动态量化导出的文件名（按 avx512_vnni 配置量化，其他 x86 CPU 也能跑）
+_ONNX_INT8_CONFIG = "avx512_vnni"
+_ONNX_INT8_FILE = f"onnx/model_qint8_{_ONNX_INT8_CONFIG}.onnx"
+
+
+def _embedding_model_args(cache_root: str) -> Tuple[str, Dict[str, Any]]:
+    """按 EMBEDDING_BACKEND 返回 (model_name, model_kwargs)，供 HuggingFaceEmbeddings 使用。"""
+    model_name = config.EMBEDDING_MODEL
+    model_kwargs: Dict[str, Any] = {"device": "cpu"}
+    backend = config.EMBEDDING_BACKEND
+    if backend not in ("onnx", "onnx-int8"):
+        return model_name, model_kwargs
+
+    if importlib.util.find_spec("optimum") is None or importlib.util.find_spec("onnxruntime") is None:
+        print("⚠️ 未安装 sentence-transformers[onnx]，Embedding 回退到 torch 后端")
+        return model_name, model_kwargs
+
+    model_kwargs["backend"] = "onnx"
+    if backend == "onnx":
+        return model_name, model_kwargs
+
+    # 量化模型导出一次后落盘复用；目录名由模型名转换而来
+    out_dir = Path(cache_root) / "onnx_int8" / model_name.replace("/", "__")
+    if not (out_dir / _ONNX_INT8_FILE).exists():
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+        print(f"🛠️ 正在导出 int8 量化 ONNX 模型到 {out_dir} ...")
+        st = SentenceTransformer(model_name, backend="onnx", device="cpu", cache_folder=cache_root)
+        st.save(str(out_dir))
+        export_dynamic_quantized_onnx_model(st, _ONNX_INT8_CONFIG, str(out_dir))
+    model_kwargs["model_kwargs"] = {"file_name": _ONNX_INT8_FILE}
+    return str(out_dir), model_kwargs
+
+
+class _CachedEmbeddings(Embeddings):
+    """给 embed_query 加 LRU：/问 的语义缓存和检索器对同一问题只跑一次编码。
+
+    向量只取决于模型和文本，与知识库内容无关，所以重建知识库时不需要清空。
+    """
+
+    def __init__(self, inner: Embeddings, maxsize: int = _EMBED_QUERY_CACHE_MAX):
+        self.inner = inner
+        self._embed_query = lru_cache(maxsize=maxsize)(lambda text: tuple(inner.embed_query(text)))
+
+    def embed_query(self, text: str) -> List[float]:
+        return list(self._embed_query(text))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+
+def _scan_txt_tree(root: Path) -> Dict[str, Tuple[int, int]]:
+    """递归扫描 root 下的 .txt：返回 {路径: (mtime_ns, size)}，os.scandir 自带 stat 缓存。"""
+    found: Dict[str, Tuple[int, int]] = {}
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=True):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".txt") and entry.is_file(follow_symlinks=True):
+                    st = entry.stat()
+                    found[entry.path] = (st.st_mtime_ns, st.st_size)
+    return found
+
+
+def _load_rag_manifest() -> Dict[str, Tuple[int, int, int]]:
+    """知识库清单：{路径: (mtime_ns, size, 片段数)}；读不到就当空，触发整库重建。"""
+    try:
+        raw = _json_loads(config.RAG_MANIFEST_FILE.read_bytes())
+        return {p: (int(m[0]), int(m[1]), int(m[2])) for p, m in raw.items()}
+    except Exception:
+        return {}
+
+
+def _save_rag_manifest(manifest: Dict[str, Tuple[int, int, int]]) -> None:
+    _atomic_write_bytes(config.RAG_MANIFEST_FILE, _json_dumps_pretty(manifest))
 
 
 class RagEngine:
@@ -17,12 +202,34 @@ class RagEngine:
         self.vector_db: Optional[Chroma] = None
         self.retriever = None
         self.llm: Optional[ChatOpenAI] = None
-        self.embeddings: Optional[HuggingFaceEmbeddings] = None
+        self.embeddings: Optional[Embeddings] = None
+        # 启动预热与首个 /问 可能同时触发初始化，加锁避免重复加载模型
+        self._init_lock = threading.Lock()
+        # 可选 cross-encoder 重排（config.RERANK_MODEL 为空时不加载）
+        self.reranker: Any = None
+        self._reranker_tried = False
+        self._rerank_cache: "OrderedDict[Tuple[str, str], Tuple[float, float]]" = OrderedDict()
+        # 重排在工作线程里跑，并发 /问 会同时读写缓存；锁只包住缓存读写，不包模型推理
+        self._rerank_lock = threading.Lock()
+        # 同一时间只跑一个重建任务；成功后 REFRESH_COOLDOWN 秒内不重复重建
+        self._rebuild_task: "Optional[asyncio.Task[str]]" = None
+        self._last_rebuild_ts = 0.0
+        # 整库重建期间（旧集合已删、新检索器未发布）为 True：/问 直接回复繁忙，也不去打开正在写入的库
+        self._rebuilding = False
+        self._answer_cache = _AnswerCache()
 
-        # 延迟初始化：避免 bot 启动时就加载 embedding/LLM
-        # 只有在 /问 或 /重构知识库 时才初始化。
+        # 初始化不在构造时进行：由启动预热（warm）或首次 /问、/重构知识库 触发，
+        # 且都放在后台线程执行，不阻塞事件循环。
 
     def _ensure_initialized(self) -> None:
+        with self._init_lock:
+            self._initialize_locked()
+
+    def _initialize_locked(self) -> None:
+        # RAG 目录只在真正用到 RAG 时创建，不在 import 阶段创建
+        config.RAG_DOCS_DIR.mkdir(parents=True, exist_ok=True)
+        config.VECTOR_DB_DIR.mkdir(parents=True, exist_ok=True)
+
         if config.HF_ENDPOINT:
             os.environ["HF_ENDPOINT"] = config.HF_ENDPOINT
 
@@ -63,13 +270,16 @@ class RagEngine:
             os.environ.setdefault("HUGGINGFACE_HUB_CACHE", os.path.join(cache_root, "hub"))
             os.environ.setdefault("TRANSFORMERS_CACHE", os.path.join(cache_root, "transformers"))
 
-            print("🧠 正在加载 Embedding 模型 (CPU)...")
+            print(f"🧠 正在加载 Embedding 模型 (CPU, {config.EMBEDDING_BACKEND})...")
             try:
-                self.embeddings = HuggingFaceEmbeddings(
-                    model_name=config.EMBEDDING_MODEL,
-                    cache_folder=cache_root,
-                    model_kwargs={"device": "cpu"},
-                    encode_kwargs={"normalize_embeddings": True},
+                model_name, model_kwargs = _embedding_model_args(cache_root)
+                self.embeddings = _CachedEmbeddings(
+                    HuggingFaceEmbeddings(
+                        model_name=model_name,
+                        cache_folder=cache_root,
+                        model_kwargs=model_kwargs,
+                        encode_kwargs={"batch_size": _ENCODE_BATCH, "normalize_embeddings": True, "show_progress_bar": False},
+                    )
                 )
             except Exception as e:
                 hint = (
@@ -82,74 +292,245 @@ class RagEngine:
                 )
                 raise RuntimeError(hint) from e
 
-        self._load_existing_db()
+        if config.RERANK_MODEL and not self._reranker_tried:
+            self._reranker_tried = True
+            try:
+                from sentence_transformers import CrossEncoder
+
+                print(f"🧠 正在加载重排模型 {config.RERANK_MODEL} (CPU)...")
+                self.reranker = CrossEncoder(config.RERANK_MODEL, device="cpu")
+            except Exception as e:
+                print(f"⚠️ 重排模型加载失败，退回纯向量检索: {e}")
+
+        if self.vector_db is None and not self._rebuilding:
+            self._load_existing_db()
+
+    def _make_retriever(self, db: Chroma):
+        # 开启重排时多取候选，重排后再截到 _FINAL_K
+        k = _RERANK_CANDIDATES if self.reranker is not None else _FINAL_K
+        return db.as_retriever(search_kwargs={"k": k})
+
+    async def _retrieve(self, question: str) -> List[Document]:
+        retriever = self.retriever
+        if retriever is None:
+            return []
+        docs = await retriever.ainvoke(question)
+        reranker = self.reranker
+        if reranker is None or len(docs) <= _FINAL_K or _RERANK_SKIP_RE.search(question):
+            return docs[:_FINAL_K]
+        scores = await asyncio.to_thread(self._rerank_scores, reranker, question, docs)
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        return [docs[i] for i in order[:_FINAL_K]]
+
+    def _rerank_scores(self, reranker: Any, question: str, docs: List[Document]) -> List[float]:
+        """cross-encoder 打分；(问题, 片段) 的分数缓存 15 分钟，只对未命中的片段跑模型。"""
+        cache = self._rerank_cache
+        now = time.monotonic()
+        scores: List[Optional[float]] = []
+        missing: List[int] = []
+        with self._rerank_lock:
+            for i, d in enumerate(docs):
+                hit = cache.get((question, d.page_content))
+                if hit is not None and now - hit[0] <= _RERANK_CACHE_TTL:
+                    scores.append(hit[1])
+                else:
+                    scores.append(None)
+                    missing.append(i)
+        if missing:
+            fresh = reranker.predict([(question, docs[i].page_content) for i in missing], batch_size=_ENCODE_BATCH, show_progress_bar=False)
+            with self._rerank_lock:
+                for i, score in zip(missing, fresh):
+                    scores[i] = float(score)
+                    cache[(question, docs[i].page_content)] = (now, float(score))
+                    cache.move_to_end((question, docs[i].page_content))
+                while len(cache) > _RERANK_CACHE_MAX:
+                    cache.popitem(last=False)
+        return cast(List[float], scores)
+
+    async def warm(self) -> None:
+        """启动预热：后台加载 LLM/Embedding/向量库，并跑一次检索把索引读进内存。"""
+        try:
+            await asyncio.to_thread(self._ensure_initialized)
+            if self.retriever is not None:
+                await self.retriever.ainvoke("测试")
+            print("🔥 RAG 引擎预热完成")
+        except Exception as e:
+            print(f"⚠️ RAG 引擎预热失败（首次 /问 时会重试）: {e}")
+
+    def _open_db(self) -> Chroma:
+        # collection_metadata 只在集合首次创建时生效；已有集合沿用建库时的 HNSW 参数
+        return Chroma(
+            persist_directory=str(config.VECTOR_DB_DIR),
+            embedding_function=self.embeddings,
+            collection_metadata=dict(_HNSW_METADATA),
+        )
 
     def _load_existing_db(self) -> None:
         if self.embeddings is None:
             return
         if config.VECTOR_DB_DIR.exists() and any(config.VECTOR_DB_DIR.iterdir()):
             try:
-                self.vector_db = Chroma(
-                    persist_directory=str(config.VECTOR_DB_DIR), 
-                    embedding_function=self.embeddings
-                )
-                self.retriever = self.vector_db.as_retriever(search_kwargs={"k": 3})
+                self.vector_db = self._open_db()
+                self.retriever = self._make_retriever(self.vector_db)
                 print("📚 本地向量知识库加载成功")
             except Exception as e:
                 print(f"⚠️ 向量库加载失败 (可能是首次运行): {e}")
 
-    async def rebuild_index(self) -> str:
-        """重建知识库索引 (耗时操作)"""
+    async def rebuild_index(self, progress: Optional[Callable[[int, int], Awaitable[Any]]] = None) -> str:
+        """重建知识库索引 (耗时操作)。整个过程在工作线程里跑，不阻塞事件循环。
+
+        progress(done, total) 为可选协程回调，每写完一批（最后一批除外）在事件循环上调度一次。
+        """
+        loop = asyncio.get_running_loop()
+
+        def _report(done: int, total: int) -> None:
+            if progress is not None:
+                asyncio.run_coroutine_threadsafe(progress(done, total), loop)
+
+        task = self._rebuild_task
+        if task is None or task.done():
+            cooldown = float(config.REFRESH_COOLDOWN)
+            elapsed = time.monotonic() - self._last_rebuild_ts
+            if self._last_rebuild_ts and elapsed < cooldown:
+                return f"⏱️ {int(elapsed)} 秒前刚重建过知识库，{int(cooldown - elapsed) + 1} 秒后可再次重建。"
+            task = self._rebuild_task = asyncio.create_task(self._run_rebuild(_report))
+        # 重建进行中再次触发：等同一个任务的结果（进度只推送给发起者）
+        return await asyncio.shield(task)
+
+    async def _run_rebuild(self, report: Callable[[int, int], None]) -> str:
+        ok, result = await asyncio.to_thread(self._rebuild_index_sync, report)
+        if ok:
+            self._last_rebuild_ts = time.monotonic()
+        return result
+
+    def _rebuild_index_sync(self, report: Callable[[int, int], None]) -> Tuple[bool, str]:
+        """返回 (是否成功, 提示文本)；只有成功才进入重建冷却。"""
         try:
             self._ensure_initialized()
         except Exception as e:
-            return f"❌ 初始化失败: {e}"
+            return False, f"❌ 初始化失败: {e}"
 
         if not config.RAG_DOCS_DIR.exists():
-            return "❌ 目录 data/rag_docs 不存在"
+            return False, "❌ 目录 data/rag_docs 不存在"
         
-        # 1. 读取文件
-        loader = DirectoryLoader(str(config.RAG_DOCS_DIR), glob="**/*.txt", loader_cls=TextLoader)
-        docs = loader.load()
-        if not docs:
-            return "⚠️ data/rag_docs 目录下没有 .txt 文件"
-
-        # 2. 切分文本
-        splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-        splits = splitter.split_documents(docs)
-
-        # 3. 写入 Chroma
-        # 注意：这里会重新生成整个库
+        # 1. 扫描文件：只 stat，不读内容
+        files = _scan_txt_tree(config.RAG_DOCS_DIR)
+        if not files:
+            return False, "⚠️ data/rag_docs 目录下没有 .txt 文件"
+
         try:
-            if self.vector_db:
-                # 尝试清理旧数据，或者直接覆盖目录
-                self.vector_db = None
-            
-            # 创建新的 DB
-            self.vector_db = Chroma.from_documents(
-                documents=splits,
-                embedding=self.embeddings,
-                persist_directory=str(config.VECTOR_DB_DIR)
+            vector_db = self.vector_db or self._open_db()
+            # 清单与向量库对不上（首次构建、库被删、上次中途失败）时整库重建，否则只处理变化的文件
+            manifest = _load_rag_manifest()
+            if manifest and len(vector_db.get(include=[])["ids"]) != sum(m[2] for m in manifest.values()):
+                manifest = {}
+            if not manifest:
+                # 先摘下检索器并置繁忙，再删集合；与 _ensure_initialized 共用锁，避免 /问 同时打开第二个库句柄
+                with self._init_lock:
+                    self._rebuilding = True
+                    self.vector_db = None
+                    self.retriever = None
+                vector_db.delete_collection()
+                vector_db = self._open_db()
+
+            changed = [p for p, st in files.items() if tuple(manifest.get(p, ())[:2]) != st]
+            removed = [p for p in manifest if p not in files]
+            if not changed and not removed and self.vector_db is not None:
+                total = sum(m[2] for m in manifest.values())
+                return True, f"✅ 知识库已是最新，无需重建（共 {total} 个文本片段）。"
+
+            # 2. 删掉变化/移除文件的旧片段（id 为 "<path>#<序号>"，由清单里的片段数还原）
+            stale = [f"{p}#{i}" for p in changed + removed for i in range(manifest.get(p, (0, 0, 0))[2])]
+            if stale:
+                vector_db.delete(ids=stale)
+            # 先把清单落盘成"已删除"状态，写入中途失败时下次能检测到不一致并整库重建
+            for p in changed + removed:
+                manifest.pop(p, None)
+            _save_rag_manifest(manifest)
+
+            # 3. 读取并切分变化的文件
+            splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
+            splits: List[Tuple[str, Document]] = []
+            counts: Dict[str, int] = {}
+            for p in changed:
+                chunks = splitter.split_documents([Document(page_content=_read_text_file(Path(p)), metadata={"source": p})])
+                counts[p] = len(chunks)
+                splits.extend((f"{p}#{i}", d) for i, d in enumerate(chunks))
+
+            # 4. 按批写入 Chroma：每批一次 embed_documents + 一次 sqlite 写入
+            total = len(splits)
+            for i in range(0, total, _ADD_BATCH):
+                batch = splits[i : i + _ADD_BATCH]
+                vector_db.add_texts(
+                    [d.page_content for _, d in batch],
+                    metadatas=[d.metadata for _, d in batch],
+                    ids=[doc_id for doc_id, _ in batch],
+                )
+                done = i + len(batch)
+                if done < total:
+                    report(done, total)
+
+            for p in changed:
+                manifest[p] = (*files[p], counts[p])
+            _save_rag_manifest(manifest)
+
+            with self._init_lock:
+                self.vector_db = vector_db
+                self.retriever = self._make_retriever(vector_db)
+                self._rebuilding = False
+            # 知识库变了，旧答案作废
+            self._answer_cache.clear()
+            kept = sum(m[2] for m in manifest.values())
+            return True, (
+                f"✅ 知识库构建完成！本次处理 {len(changed)} 个文件、{total} 个文本片段"
+                f"（移除 {len(removed)} 个文件），当前共 {kept} 个文本片段。"
             )
-            self.retriever = self.vector_db.as_retriever(search_kwargs={"k": 3})
-            return f"✅ 知识库构建完成！共索引 {len(splits)} 个文本片段。"
         except Exception as e:
-            return f"❌ 构建失败: {e}"
+            return False, f"❌ 构建失败: {e}"
+        finally:
+            # 失败时也要解除繁忙；库已被删则保持 vector_db 为空，下次 /问 重新加载已有部分
+            self._rebuilding = False
 
     async def query(self, question: str) -> str:
         """RAG 问答流程"""
+        key = _normalize_question(question)
+        # 寒暄直接回复：不加载模型、不检索、不调 LLM
+        canned = _SMALL_TALK.get(key)
+        if canned is not None:
+            return canned
+
         try:
-            self._ensure_initialized()
+            await asyncio.to_thread(self._ensure_initialized)
         except Exception as e:
             return f"❌ 初始化失败: {e}"
 
-        if not self.retriever:
+        if self._rebuilding:
+            return _REBUILDING_MSG
+
+        retriever = self.retriever
+        if not retriever:
             return "⚠️ 知识库尚未初始化，请先使用指令构建知识库。"
 
         llm = self.llm
         if llm is None:
             return "❌ LLM 未初始化"
 
+        cached = self._answer_cache.get(key)
+        if cached is not None:
+            return cached
+
+        vec: Optional[np.ndarray] = None
+        embeddings = self.embeddings
+        if embeddings is not None:
+            try:
+                vec = np.asarray(await asyncio.to_thread(embeddings.embed_query, question), dtype=np.float32)
+                cached = self._answer_cache.get_similar(vec)
+                if cached is not None:
+                    return cached
+            except Exception as e:
+                print(f"⚠️ 问题向量计算失败，跳过语义缓存: {e}")
+                vec = None
+
         template = """你是一个哈工大深圳(HITSZ)的校园助手。请根据以下已知信息回答用户的问题。
         
         严格遵守以下规则：
@@ -165,16 +546,22 @@ class RagEngine:
         prompt = ChatPromptTemplate.from_template(template)
 
         chain = (
-            {"context": self.retriever, "question": RunnablePassthrough()}
+            {"context": RunnableLambda(self._retrieve), "question": RunnablePassthrough()}
             | prompt
             | llm
             | StrOutputParser()
         )
 
         try:
-            return await chain.ainvoke(question)
+            answer = await chain.ainvoke(question)
         except Exception as e:
+            # 检索途中开始了整库重建：旧集合已被删，报繁忙而不是把底层错误抛给用户
+            if self._rebuilding or self.retriever is not retriever:
+                return _REBUILDING_MSG
             return f"❌ AI 发生错误: {e}"
+        # 只缓存正常回答；出错的结果下次重新请求
+        self._answer_cache.put(key, answer, vec)
+        return answer
 
 # 全局单例
 rag_engine = RagEngine()
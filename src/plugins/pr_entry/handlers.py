@@ -1,9 +1,14 @@
 from __future__ import annotations
 
+import asyncio
+import copy
 from dataclasses import dataclass
+from bisect import bisect_right
 from datetime import date
-from typing import Optional
+from functools import lru_cache
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
 import re
+import tomllib
 
 from nonebot import on_message
 from nonebot.adapters.onebot.v11 import Bot, MessageEvent, Message, MessageSegment
@@ -14,13 +19,13 @@ from .prserver_client import ensure_pr, get_course_structure, get_course_toml, s
 from .settings import settings
 from ..course_manager.data_loader import course_manager
 
-import tomlkit
-from tomlkit.container import Container
-from tomlkit.items import AoT, Array, InlineTable, Table, Trivia
-from tomlkit.toml_document import TOMLDocument
+# tomlkit 只在生成补丁时才用到（只读路径走 tomllib）：各函数内按需导入，插件加载时不付导入开销
+if TYPE_CHECKING:
+    from tomlkit.items import AoT, Table
+    from tomlkit.toml_document import TOMLDocument
 
 
-@dataclass
+@dataclass(slots=True)
 class Pending:
     repo_name: Optional[str] = None
     course_code: Optional[str] = None
@@ -55,9 +60,8 @@ _PENDING: dict[tuple[int | None, int], Pending] = {}
 
 
 def _key(event: MessageEvent) -> tuple[int | None, int]:
-    group_id = getattr(event, "group_id", None)
-    user_id = int(getattr(event, "user_id", 0))
-    return (group_id, user_id)
+    # 私聊事件没有 group_id 字段，取到 None；user_id 所有 MessageEvent 都有
+    return (getattr(event, "group_id", None), int(event.user_id))
 
 
 def _allowed(event: MessageEvent) -> bool:
@@ -109,65 +113,53 @@ def _year_month() -> str:
     return f"{d.year:04d}-{d.month:02d}"
 
 
+def _node_message(content: str) -> Message:
+    # 纯文本直接包成 text 段，跳过适配器对 CQ 码的正则解析；含 CQ 码时保持原解析行为
+    if "[CQ:" not in content:
+        return Message(MessageSegment.text(content))
+    return Message(content)
+
+
 def make_node(bot: Bot, content: str, name: str = "hoa-pr bot") -> dict:
     return {
         "type": "node",
         "data": {
             "name": name,
             "uin": bot.self_id,
-            "content": Message(content),
+            "content": _node_message(content),
         },
     }
 
 
+_LEADING_WS_RE = re.compile(r"\s*")
+
+
 def _split_long_text(text: str, *, limit: int = 1800) -> list[str]:
+    """按 limit 切分长文本：优先在空行处断开，其次换行，都没有就硬切。
+
+    单趟扫描：用 rfind 在 [cursor, cursor+limit] 内找最后一个分隔符，直接切片原串，不拼接缓冲、不递归。
+    """
     s = (text or "").strip()
     if not s:
         return [""]
-    if len(s) <= limit:
-        return [s]
-
-    # Try split by blank line first
-    parts = s.split("\n\n")
-    if len(parts) > 1:
-        out: list[str] = []
-        buf = ""
-        for p in parts:
-            cand = (buf + "\n\n" + p).strip() if buf else p
-            if len(cand) <= limit:
-                buf = cand
-            else:
-                if buf:
-                    out.extend(_split_long_text(buf, limit=limit))
-                    buf = ""
-                out.extend(_split_long_text(p, limit=limit))
-        if buf:
-            out.extend(_split_long_text(buf, limit=limit))
-        return out
-
-    # Fallback split by newline
-    lines = s.split("\n")
-    out2: list[str] = []
-    buf2 = ""
-    for ln in lines:
-        cand = (buf2 + "\n" + ln).strip() if buf2 else ln
-        if len(cand) <= limit:
-            buf2 = cand
+
+    out: list[str] = []
+    n = len(s)
+    cur = 0
+    while n - cur > limit:
+        end = cur + limit
+        for sep in ("\n\n", "\n"):
+            cut = s.rfind(sep, cur, end + len(sep))
+            if cut > cur:
+                nxt = cut + len(sep)
+                break
         else:
-            if buf2:
-                out2.append(buf2)
-                buf2 = ""
-            if len(ln) > limit:
-                # hard cut
-                out2.append(ln[:limit])
-                rest = ln[limit:]
-                if rest.strip():
-                    out2.extend(_split_long_text(rest, limit=limit))
-            else:
-                buf2 = ln
-    if buf2:
-        out2.append(buf2)
-    return out2
+            cut = nxt = end
+        out.append(s[cur:cut].rstrip())
+        cur = _LEADING_WS_RE.match(s, nxt).end()
+    if cur < n:
+        out.append(s[cur:])
+    return out
 
 
 async def _send_forward(bot: Bot, event: MessageEvent, nodes: list[dict]) -> bool:
@@ -182,6 +174,9 @@ async def _send_forward(bot: Bot, event: MessageEvent, nodes: list[dict]) -> boo
 
 
 def _doc_table(doc: object) -> Table:
+    from tomlkit.container import Container
+    from tomlkit.items import Table, Trivia
+    from tomlkit.toml_document import TOMLDocument
     if isinstance(doc, TOMLDocument):
         table = Table(Container(), Trivia(), is_aot_element=False)
         for key, value in doc.items():
@@ -193,6 +188,7 @@ def _doc_table(doc: object) -> Table:
 
 
 def _aot(v: object) -> AoT | None:
+    from tomlkit.items import AoT
     return v if isinstance(v, AoT) else None
 
 
@@ -202,11 +198,29 @@ def _safe_str(v: object) -> str:
     return str(v)
 
 
+# show 和 modify 会对同一批段落各规范化一次；结果按原串缓存，第二次直接命中
+@lru_cache(maxsize=4096)
 def _norm_text(s: str) -> str:
     return (s or "").strip().replace("\r\n", "\n")
 
 
+# /pr modify 定位段落时拿到的 base_toml 会一直用到生成补丁：tomlkit（保留格式的解析）结果按文本缓存，
+# 改写前深拷贝一份，比重新 parse 快，缓存里的原件始终不被修改。
+@lru_cache(maxsize=8)
+def _parse_rw_cached(toml_text: str) -> TOMLDocument:
+    import tomlkit
+    return tomlkit.parse(toml_text)
+
+
+def _drop_warm_error(fut: asyncio.Future) -> None:
+    # 预解析只为填缓存：失败（tomllib 能读、tomlkit 不认的写法）时取走异常即可，
+    # 生成补丁时 _patch_toml_by_target 会再解析一次，把错误按"生成失败"回给用户
+    if not fut.cancelled():
+        fut.exception()
+
+
 def _toml_multiline(s: str):
+    import tomlkit
     s2 = _norm_text(s)
     return tomlkit.string(s2, multiline=True)
 
@@ -219,6 +233,8 @@ def _append_toml_by_target(
     author: dict | None = None,
 ) -> str:
     """对 multi-project TOML 做追加类修改（本地 patch，不依赖 prServer submit_ops）。"""
+    import tomlkit
+    from tomlkit.items import AoT, Table
 
     doc = _doc_table(tomlkit.parse(base_toml))
 
@@ -330,6 +346,8 @@ def _append_normal_lecturer_review(
     content: str,
     author: dict | None,
 ) -> str:
+    import tomlkit
+    from tomlkit.items import AoT, Table
     doc = _doc_table(tomlkit.parse(base_toml))
 
     name = (lecturer or "").strip()
@@ -373,6 +391,8 @@ def _append_author_field(target: Table, author: dict) -> None:
     - inline table -> array of inline tables
     - array -> append
     """
+    import tomlkit
+    from tomlkit.items import Array, InlineTable
 
     name = str(author.get("name") or "").strip()
     link = str(author.get("link") or "").strip()
@@ -387,10 +407,12 @@ def _append_author_field(target: Table, author: dict) -> None:
     if existing is None:
         target["author"] = t
         return
-    if isinstance(existing, Array):
+    # tomlkit 取出的值就是这两个具体类型：先做类型恒等判断，dict（含 Table）兜底再走 isinstance
+    kind = type(existing)
+    if kind is Array:
         existing.append(t)
         return
-    if isinstance(existing, (InlineTable, dict)):
+    if kind is InlineTable or isinstance(existing, dict):
         arr = tomlkit.array()
         arr.multiline(True)
         arr.append(existing)
@@ -400,124 +422,64 @@ def _append_author_field(target: Table, author: dict) -> None:
     target["author"] = t
 
 
-def _extract_segments(doc):
-    repo_type = getattr(doc, "repo_type", "")  # 从doc中获取repo_type
-    if isinstance(doc, Table):
-        return _extract_multi_segments(doc) if repo_type == "multi-project" else _extract_normal_segments(doc)
-    elif isinstance(doc, TOMLDocument):
-        table = _doc_table(doc)  # 使用_doc_table将TOMLDocument转换为Table
-        return _extract_multi_segments(table) if repo_type == "multi-project" else _extract_normal_segments(table)
-    else:
-        raise TypeError("doc must be of type Table or TOMLDocument")
+# 同一会话里 /pr show、/pr target、/pr modify 会反复拿到同一份 readme.toml：按文本缓存解析结果。
+# 文本变了 key 就变，不需要手动失效。缓存的 dict 只读，调用方不得修改。
+@lru_cache(maxsize=32)
+def _parse_ro(toml_text: str) -> dict:
+    """只读解析：用 C 实现的 tomllib，得到普通 dict/list。需要改写并回写 TOML 的地方仍用 tomlkit。"""
+    return tomllib.loads((toml_text or "").lstrip("\ufeff"))
 
 
-def _extract_normal_segments(doc: Table) -> list[tuple[str, str]]:
-    course_name = _safe_str(doc.get("course_name")).strip()
-    course_code = _safe_str(doc.get("course_code")).strip()
-    description = _safe_str(doc.get("description"))
+def _segments_ro(toml_text: str, repo_type: str) -> tuple[tuple[str, str], ...]:
+    """/pr show 的分段（标题, 正文）；repo_type 决定按 normal 还是 multi-project 结构分段。"""
+    return _walk_doc(toml_text, repo_type == "multi-project")[0]
 
-    header = f"【{course_name or course_code}】\n代码：{course_code}\n\n{_norm_text(description)}".strip()
-    segs: list[tuple[str, str]] = [("header", header)]
 
-    sections = _aot(doc.get("sections"))
-    if sections:
-        for sec in sections:
-            if not isinstance(sec, Table):
-                continue
-            title = _safe_str(sec.get("title")).strip() or "(未命名章节)"
-            items = _aot(sec.get("items"))
-            blocks: list[str] = []
-            if items:
-                for it in items:
-                    if not isinstance(it, Table):
-                        continue
-                    c = _norm_text(_safe_str(it.get("content")))
-                    if c:
-                        blocks.append(c)
-            body = "\n\n".join(blocks).strip()
-            segs.append((title, f"【{title}】\n\n{body}".strip() if body else f"【{title}】\n\n（空）"))
-    return segs
+def _ro_list(v: object) -> list:
+    return v if isinstance(v, list) else []
 
 
-def _extract_multi_segments(doc: Table) -> list[tuple[str, str]]:
-    course_name = _safe_str(doc.get("course_name")).strip()
-    course_code = _safe_str(doc.get("course_code")).strip()
-    description = _safe_str(doc.get("description"))
+def _iter_node_bodies(segs):
+    """按段落逐个产出转发节点正文；超长段落切块并加“标题（i/n）”前缀。"""
+    for title, body in segs:
+        parts = _split_long_text(body, limit=1800)
+        n = len(parts)
+        if n == 1:
+            yield parts[0]
+        else:
+            for i, p in enumerate(parts, start=1):
+                yield f"{title}（{i}/{n}）\n\n{p}".strip()
 
-    header = f"【{course_name or course_code}】\n代码：{course_code}\n\n{_norm_text(description)}".strip()
-    segs: list[tuple[str, str]] = [("header", header)]
 
-    courses = _aot(doc.get("courses"))
-    if not courses:
-        return segs
+def _nodes_from_segments(bot: Bot, segs) -> list[dict]:
+    # 与 make_node 结构一致；name/uin 只取一次，节点 dict 直接内联构造
+    name, uin = "hoa-pr bot", bot.self_id
+    return [
+        {"type": "node", "data": {"name": name, "uin": uin, "content": _node_message(c)}}
+        for c in _iter_node_bodies(segs)
+    ]
 
-    for c in courses:
-        if not isinstance(c, Table):
-            continue
-        name = _safe_str(c.get("name")).strip() or "(未命名子课程)"
-        code = _safe_str(c.get("code")).strip()
-        lines: list[str] = [f"【子课程：{name}】", f"代码：{code}"]
 
-        teachers = _aot(c.get("teachers"))
-        if teachers:
-            teacher_names = []
-            teacher_reviews: list[str] = []
-            for t in teachers:
-                if not isinstance(t, Table):
-                    continue
-                tn = _safe_str(t.get("name")).strip()
-                if tn:
-                    teacher_names.append(tn)
-                reviews = _aot(t.get("reviews"))
-                if reviews:
-                    for rv in reviews:
-                        if not isinstance(rv, Table):
-                            continue
-                        rc = _norm_text(_safe_str(rv.get("content")))
-                        if rc:
-                            teacher_reviews.append(rc)
-            if teacher_names:
-                lines.append(f"教师：{', '.join(teacher_names)}")
-            if teacher_reviews:
-                lines.append("\n教师评价：\n" + "\n\n".join(teacher_reviews))
+def build_forward_nodes_from_toml(bot: Bot, toml_text: str) -> list[dict]:
+    repo_type = _safe_str(_parse_ro(toml_text).get("repo_type")).strip()
+    return _nodes_from_segments(bot, _segments_ro(toml_text, repo_type))
 
-        sections = _aot(c.get("sections"))
-        if sections:
-            for sec in sections:
-                if not isinstance(sec, Table):
-                    continue
-                title = _safe_str(sec.get("title")).strip() or "(未命名章节)"
-                items = _aot(sec.get("items"))
-                blocks: list[str] = []
-                if items:
-                    for it in items:
-                        if not isinstance(it, Table):
-                            continue
-                        cc = _norm_text(_safe_str(it.get("content")))
-                        if cc:
-                            blocks.append(cc)
-                if blocks:
-                    lines.append(f"\n[{title}]\n" + "\n\n".join(blocks))
 
-        segs.append((name, "\n".join(lines).strip()))
+def _truncate(s: str, n: int = 200) -> str:
+    """去掉首尾空白，超过 n 个字符时截到 n 个（含末尾省略号）。"""
+    s = (s or "").strip()
+    return s if len(s) <= n else s[: n - 1] + "…"
 
-    return segs
 
-
-def build_forward_nodes_from_toml(bot: Bot, toml_text: str) -> list[dict]:
-    doc = _doc_table(tomlkit.parse(toml_text))
-    repo_type = getattr(doc, "repo_type", "")
-
-    segs = _extract_multi_segments(doc) if repo_type == "multi-project" else _extract_normal_segments(doc)
-    nodes: list[dict] = []
-    for title, body in segs:
-        parts = _split_long_text(body, limit=1800)
-        if len(parts) == 1:
-            nodes.append(make_node(bot, parts[0]))
-        else:
-            for i, p in enumerate(parts, start=1):
-                nodes.append(make_node(bot, f"{title}（{i}/{len(parts)}）\n\n{p}".strip()))
-    return nodes
+def _render_confirm(info: str, old_para: str, new_para: str) -> str:
+    """build_patch 生成补丁后的确认提示：原段落为空时省略。"""
+    parts = [f"即将提交：{info}".strip()]
+    old_preview = _truncate(old_para)
+    if old_preview:
+        parts.append(f"\n原段落（截断）：\n{old_preview}")
+    parts.append(f"\n新段落（截断）：\n{_truncate(new_para)}")
+    parts.append("\n回复：确认 / 取消")
+    return "\n".join(parts)
 
 
 def _preview_line(content: str, *, limit: int = 60) -> str:
@@ -542,123 +504,260 @@ def _find_paragraph_candidates(toml_text: str, snippet: str) -> list[dict]:
     if not s:
         return []
 
-    doc = _doc_table(tomlkit.parse(toml_text))
-    repo_type = getattr(doc, "repo_type", "")
+    idx = _paragraph_index(toml_text)
+    entries = idx.entries
+    q = _gram_fingerprint(s)
+    if q:
+        # 长片段：先用 n-gram 指纹做位与预筛，指纹不包含片段的段落不可能命中，直接跳过子串查找
+        hits = [k for k, fp in enumerate(idx.fingerprints) if fp & q == q and s in entries[k][1]]
+    elif _PARA_SEP in s:
+        hits = [k for k, (_, content) in enumerate(entries) if s in content]
+    else:
+        # 所有段落拼成一个大串，用 C 层的 str.find 扫一遍；命中后跳到下一段开头继续，每段至多命中一次
+        hits = []
+        starts = idx.starts
+        pos = idx.joined.find(s)
+        while pos != -1:
+            k = bisect_right(starts, pos) - 1
+            hits.append(k)
+            if k + 1 >= len(starts):
+                break
+            pos = idx.joined.find(s, starts[k + 1])
+    return [dict(entries[k][0], preview=_preview_line(entries[k][1])) for k in hits]
 
-    out: list[dict] = []
 
-    # description
-    desc = _norm_text(_safe_str(doc.get("description")))
-    if desc and s in desc:
-        out.append({"type": "description", "preview": _preview_line(desc)})
+# 段落拼接分隔符：查询里不含它时，命中不可能跨段
+_PARA_SEP = "\x00"
 
-    # lecturers.reviews (normal schema)
-    lecturers = _aot(doc.get("lecturers"))
-    if lecturers:
-        for lec in lecturers:
-            if not isinstance(lec, Table):
-                continue
-            ln = _safe_str(lec.get("name")).strip() or "(未命名教师)"
-            reviews = _aot(lec.get("reviews"))
-            if not reviews:
-                continue
-            for ridx0, rv in enumerate(reviews):
-                if not isinstance(rv, Table):
-                    continue
+
+# 预筛用的 n-gram 长度：短于它的片段直接走大串查找
+_GRAM = 8
+
+try:  # 可选依赖：装了 numba 时指纹循环编译成机器码，否则走纯 Python
+    import numpy as np
+    from numba import njit
+except ImportError:
+    _fp64 = None
+else:
+
+    @njit(cache=True)
+    def _fp64(buf):
+        # 每个 _GRAM 字节窗口做一次 FNV-1a，低 6 位决定置位
+        fp = np.uint64(0)
+        for i in range(buf.shape[0] - _GRAM + 1):
+            h = np.uint64(0xCBF29CE484222325)
+            for j in range(_GRAM):
+                h = (h ^ np.uint64(buf[i + j])) * np.uint64(0x100000001B3)
+            fp |= np.uint64(1) << (h & np.uint64(63))
+        return fp
+
+
+def _gram_fingerprint(text: str) -> int:
+    """64 位指纹：UTF-8 编码后每个 _GRAM 字节子串的 hash 落到一位上（类似只有一个哈希函数的 Bloom filter）。
+
+    片段是段落的子串时，其字节窗口必然都出现在段落里，所以片段指纹的位一定被段落指纹覆盖。
+    不足 _GRAM 字节的文本指纹为 0。
+    """
+    buf = text.encode("utf-8")
+    if _fp64 is not None:
+        return int(_fp64(np.frombuffer(buf, dtype=np.uint8)))
+    fp = 0
+    for i in range(len(buf) - _GRAM + 1):
+        fp |= 1 << (hash(buf[i : i + _GRAM]) & 63)
+    return fp
+
+
+@dataclass(frozen=True)
+class _ParagraphIndex:
+    entries: tuple[tuple[dict, str], ...]
+    # entries 的内容用 _PARA_SEP 拼接后的大串，以及每段在大串中的起始偏移
+    joined: str
+    starts: tuple[int, ...]
+    # 每段内容的 n-gram 指纹，与 entries 一一对应
+    fingerprints: tuple[int, ...]
+
+
+def _paragraph_index(toml_text: str) -> _ParagraphIndex:
+    """把可定位的段落展平成 (候选模板, 规范化内容)；模板只读，取用时复制。
+
+    顺序与下标规则保持不变：下标按原始数组位置计，与 _patch_toml_by_target 的定位方式一致。
+    """
+    repo_type = _safe_str(_parse_ro(toml_text).get("repo_type")).strip()
+    return _walk_doc(toml_text, repo_type == "multi-project")[1]
+
+
+@lru_cache(maxsize=32)
+def _walk_doc(toml_text: str, seg_multi: bool) -> tuple[tuple[tuple[str, str], ...], _ParagraphIndex]:
+    """一次遍历同时产出 /pr show 的分段和 /pr modify 的段落索引，按 (文本, 分段结构) 缓存。
+
+    分段按 seg_multi 选择 normal / multi-project 结构；索引始终按文档自身的 repo_type。
+    同一段内容只做一次 _norm_text，两边共用。
+    """
+    doc = _parse_ro(toml_text)
+    idx_multi = _safe_str(doc.get("repo_type")).strip() == "multi-project"
+    out: list[tuple[dict, str]] = []
+
+    course_name = _safe_str(doc.get("course_name")).strip()
+    course_code = _safe_str(doc.get("course_code")).strip()
+    description = _norm_text(_safe_str(doc.get("description")))
+    if description:
+        out.append(({"type": "description"}, description))
+    header = f"【{course_name or course_code}】\n代码：{course_code}\n\n{description}".strip()
+    segs: list[tuple[str, str]] = [("header", header)]
+
+    # lecturers.reviews (normal schema)：只进索引
+    for lec in _ro_list(doc.get("lecturers")):
+        if not isinstance(lec, dict):
+            continue
+        ln = _safe_str(lec.get("name")).strip() or "(未命名教师)"
+        for ridx0, rv in enumerate(_ro_list(lec.get("reviews"))):
+            if isinstance(rv, dict):
                 rc = _norm_text(_safe_str(rv.get("content")))
-                if rc and s in rc:
-                    out.append(
-                        {
-                            "type": "lecturer_review",
-                            "lecturer": ln,
-                            "review_index": ridx0,
-                            "preview": _preview_line(rc),
-                        }
-                    )
+                if rc:
+                    out.append(({"type": "lecturer_review", "lecturer": ln, "review_index": ridx0}, rc))
 
-    # sections/items (normal)
-    sections = _aot(doc.get("sections"))
-    if sections:
-        for sec in sections:
-            if not isinstance(sec, Table):
+    # sections/items (normal)：总进索引；normal 分段时每个章节一段
+    for sec in _ro_list(doc.get("sections")):
+        if not isinstance(sec, dict):
+            continue
+        title = _safe_str(sec.get("title")).strip() or "(未命名章节)"
+        blocks: list[str] = []
+        for idx0, it in enumerate(_ro_list(sec.get("items"))):
+            if not isinstance(it, dict):
                 continue
-            title = _safe_str(sec.get("title")).strip() or "(未命名章节)"
-            items = _aot(sec.get("items"))
-            if not items:
+            c = _norm_text(_safe_str(it.get("content")))
+            if c:
+                out.append(({"type": "section_item", "section": title, "index": idx0}, c))
+                blocks.append(c)
+        if not seg_multi:
+            body = "\n\n".join(blocks).strip()
+            segs.append((title, f"【{title}】\n\n{body}".strip() if body else f"【{title}】\n\n（空）"))
+
+    # multi-project: courses[].teachers[].reviews + courses[].sections[].items
+    if idx_multi or seg_multi:
+        for cidx0, c in enumerate(_ro_list(doc.get("courses"))):
+            if not isinstance(c, dict):
                 continue
-            for idx0, it in enumerate(items):
-                if not isinstance(it, Table):
+            raw_name = _safe_str(c.get("name")).strip()
+            cname = raw_name or f"course#{cidx0+1}"
+            code = _safe_str(c.get("code")).strip()
+            lines: list[str] = [f"【子课程：{raw_name or '(未命名子课程)'}】", f"代码：{code}"]
+
+            teacher_names: list[str] = []
+            teacher_reviews: list[str] = []
+            for t in _ro_list(c.get("teachers")):
+                if not isinstance(t, dict):
                     continue
-                content = _norm_text(_safe_str(it.get("content")))
-                if content and s in content:
-                    out.append(
-                        {
-                            "type": "section_item",
-                            "section": title,
-                            "index": idx0,
-                            "preview": _preview_line(content),
-                        }
-                    )
+                tn = _safe_str(t.get("name")).strip()
+                if tn:
+                    teacher_names.append(tn)
+                for ridx0, rv in enumerate(_ro_list(t.get("reviews"))):
+                    if not isinstance(rv, dict):
+                        continue
+                    rc = _norm_text(_safe_str(rv.get("content")))
+                    if not rc:
+                        continue
+                    teacher_reviews.append(rc)
+                    if idx_multi:
+                        out.append(
+                            (
+                                {
+                                    "type": "course_teacher_review",
+                                    "course_index": cidx0,
+                                    "course_name": cname,
+                                    "teacher": tn or "(未命名教师)",
+                                    "review_index": ridx0,
+                                },
+                                rc,
+                            )
+                        )
+            if teacher_names:
+                lines.append(f"教师：{', '.join(teacher_names)}")
+            if teacher_reviews:
+                lines.append("\n教师评价：\n" + "\n\n".join(teacher_reviews))
 
-    # multi-project: courses[].teachers[].reviews + courses[].sections[].items
-    if repo_type == "multi-project":
-        courses = _aot(doc.get("courses"))
-        if courses:
-            for cidx0, c in enumerate(courses):
-                if not isinstance(c, Table):
+            for sec in _ro_list(c.get("sections")):
+                if not isinstance(sec, dict):
                     continue
-                cname = _safe_str(c.get("name")).strip() or f"course#{cidx0+1}"
-
-                teachers = _aot(c.get("teachers"))
-                if teachers:
-                    for t in teachers:
-                        if not isinstance(t, Table):
-                            continue
-                        tn = _safe_str(t.get("name")).strip() or "(未命名教师)"
-                        reviews = _aot(t.get("reviews"))
-                        if reviews:
-                            for ridx0, rv in enumerate(reviews):
-                                if not isinstance(rv, Table):
-                                    continue
-                                rc = _norm_text(_safe_str(rv.get("content")))
-                                if rc and s in rc:
-                                    out.append(
-                                        {
-                                            "type": "course_teacher_review",
-                                            "course_index": cidx0,
-                                            "course_name": cname,
-                                            "teacher": tn,
-                                            "review_index": ridx0,
-                                            "preview": _preview_line(rc),
-                                        }
-                                    )
-
-                csecs = _aot(c.get("sections"))
-                if csecs:
-                    for sec in csecs:
-                        if not isinstance(sec, Table):
-                            continue
-                        st = _safe_str(sec.get("title")).strip() or "(未命名章节)"
-                        items = _aot(sec.get("items"))
-                        if not items:
-                            continue
-                        for idx0, it in enumerate(items):
-                            if not isinstance(it, Table):
-                                continue
-                            cc = _norm_text(_safe_str(it.get("content")))
-                            if cc and s in cc:
-                                out.append(
-                                    {
-                                        "type": "course_section_item",
-                                        "course_index": cidx0,
-                                        "course_name": cname,
-                                        "section": st,
-                                        "index": idx0,
-                                        "preview": _preview_line(cc),
-                                    }
-                                )
+                st = _safe_str(sec.get("title")).strip() or "(未命名章节)"
+                blocks = []
+                for idx0, it in enumerate(_ro_list(sec.get("items"))):
+                    if not isinstance(it, dict):
+                        continue
+                    cc = _norm_text(_safe_str(it.get("content")))
+                    if not cc:
+                        continue
+                    blocks.append(cc)
+                    if idx_multi:
+                        out.append(
+                            (
+                                {
+                                    "type": "course_section_item",
+                                    "course_index": cidx0,
+                                    "course_name": cname,
+                                    "section": st,
+                                    "index": idx0,
+                                },
+                                cc,
+                            )
+                        )
+                if blocks:
+                    lines.append(f"\n[{st}]\n" + "\n\n".join(blocks))
 
-    return out
+            if seg_multi:
+                segs.append((raw_name or "(未命名子课程)", "\n".join(lines).strip()))
+
+    starts: list[int] = []
+    pos = 0
+    for _, content in out:
+        starts.append(pos)
+        pos += len(content) + len(_PARA_SEP)
+    index = _ParagraphIndex(
+        tuple(out),
+        _PARA_SEP.join(c for _, c in out),
+        tuple(starts),
+        tuple(_gram_fingerprint(c) for _, c in out),
+    )
+    return tuple(segs), index
+
+
+def _splice_or_dump(base_toml: str, doc: Table, old_src: str, new_src: str) -> str:
+    """只替换改动的那一段源码：old_src 在原文中恰好出现一次时原地拼接，否则退回整篇 tomlkit.dumps。
+
+    tomlkit 保留格式，未改动的部分与原文逐字一致，拼接结果就是改动后的完整 TOML。
+    """
+    import tomlkit
+    i = base_toml.find(old_src) if old_src else -1
+    if i != -1 and base_toml.find(old_src, i + 1) == -1:
+        out = base_toml[:i] + new_src + base_toml[i + len(old_src) :]
+    else:
+        out = tomlkit.dumps(doc)
+    return out.rstrip() + "\n"
+
+
+@lru_cache(maxsize=8)
+def _name_index(toml_text: str) -> tuple[dict[str, int], dict[tuple[int, str], int], dict[tuple[int, str], int]]:
+    """按名字定位数组下标：(lecturers 名 -> 下标, (课程下标, 教师名) -> 下标, (课程下标, 章节标题) -> 下标)。
+
+    与线性扫描语义一致：名字相同时取第一个，非 table 元素跳过。按文本缓存，同一 base_toml 反复 patch 只建一次。
+    """
+    doc = _parse_ro(toml_text)
+    lecturers: dict[str, int] = {}
+    for i, lec in enumerate(_ro_list(doc.get("lecturers"))):
+        if isinstance(lec, dict):
+            lecturers.setdefault(_safe_str(lec.get("name")).strip(), i)
+    teachers: dict[tuple[int, str], int] = {}
+    sections: dict[tuple[int, str], int] = {}
+    for cidx0, c in enumerate(_ro_list(doc.get("courses"))):
+        if not isinstance(c, dict):
+            continue
+        for i, tt in enumerate(_ro_list(c.get("teachers"))):
+            if isinstance(tt, dict):
+                teachers.setdefault((cidx0, _safe_str(tt.get("name")).strip()), i)
+        for i, sec in enumerate(_ro_list(c.get("sections"))):
+            if isinstance(sec, dict):
+                sections.setdefault((cidx0, _safe_str(sec.get("title")).strip()), i)
+    return lecturers, teachers, sections
 
 
 def _patch_toml_by_target(
@@ -670,8 +769,10 @@ def _patch_toml_by_target(
     author: dict | None,
 ) -> str:
     """Patch TOML locally when submit_ops doesn't cover the target."""
+    import tomlkit
+    from tomlkit.items import Table
 
-    doc = _doc_table(tomlkit.parse(base_toml))
+    doc = _doc_table(copy.deepcopy(_parse_rw_cached(base_toml)))
     s_old = _norm_text(old_paragraph)
     s_new = _norm_text(new_paragraph)
     if not s_old:
@@ -682,8 +783,9 @@ def _patch_toml_by_target(
         desc = _norm_text(_safe_str(doc.get("description")))
         if s_old not in desc:
             raise ValueError("原段落未在 description 中找到（内容已变化？）")
+        old_src = doc.value.item("description").as_string()
         doc["description"] = tomlkit.string(desc.replace(s_old, s_new, 1), multiline=True)
-        return tomlkit.dumps(doc).rstrip() + "\n"
+        return _splice_or_dump(base_toml, doc, old_src, doc.value.item("description").as_string())
 
     if t == "lecturer_review":
         lecturers = _aot(doc.get("lecturers"))
@@ -691,25 +793,24 @@ def _patch_toml_by_target(
             raise ValueError("lecturers 不存在")
         lecturer_name = str(target.get("lecturer") or "").strip()
         ridx0 = int(target.get("review_index") or 0)
-        for lec in lecturers:
-            if not isinstance(lec, Table):
-                continue
-            if _safe_str(lec.get("name")).strip() != lecturer_name:
-                continue
-            reviews = _aot(lec.get("reviews"))
-            if not reviews or ridx0 < 0 or ridx0 >= len(reviews):
-                raise ValueError("reviews 索引越界")
-            rv = reviews[ridx0]
-            if not isinstance(rv, Table):
-                raise ValueError("review 必须是 table")
-            rc = _norm_text(_safe_str(rv.get("content")))
-            if s_old not in rc:
-                raise ValueError("原段落未在该教师评价中找到（内容已变化？）")
-            rv["content"] = tomlkit.string(rc.replace(s_old, s_new, 1), multiline=True)
-            if author:
-                _append_author_field(rv, author)
-            return tomlkit.dumps(doc).rstrip() + "\n"
-        raise ValueError("未找到指定 lecturer")
+        li = _name_index(base_toml)[0].get(lecturer_name)
+        if li is None:
+            raise ValueError("未找到指定 lecturer")
+        lec = lecturers[li]
+        reviews = _aot(lec.get("reviews"))
+        if not reviews or ridx0 < 0 or ridx0 >= len(reviews):
+            raise ValueError("reviews 索引越界")
+        rv = reviews[ridx0]
+        if not isinstance(rv, Table):
+            raise ValueError("review 必须是 table")
+        rc = _norm_text(_safe_str(rv.get("content")))
+        if s_old not in rc:
+            raise ValueError("原段落未在该教师评价中找到（内容已变化？）")
+        old_src = rv.as_string()
+        rv["content"] = tomlkit.string(rc.replace(s_old, s_new, 1), multiline=True)
+        if author:
+            _append_author_field(rv, author)
+        return _splice_or_dump(base_toml, doc, old_src, rv.as_string())
 
     if t in {"course_teacher_review", "course_section_item"}:
         courses = _aot(doc.get("courses"))
@@ -728,25 +829,23 @@ def _patch_toml_by_target(
             teachers = _aot(c.get("teachers"))
             if not teachers:
                 raise ValueError("teachers 不存在")
-            for tt in teachers:
-                if not isinstance(tt, Table):
-                    continue
-                if _safe_str(tt.get("name")).strip() != teacher_name:
-                    continue
-                reviews = _aot(tt.get("reviews"))
-                if not reviews or ridx0 < 0 or ridx0 >= len(reviews):
-                    raise ValueError("reviews 索引越界")
-                rv = reviews[ridx0]
-                if not isinstance(rv, Table):
-                    raise ValueError("review 必须是 table")
-                rc = _norm_text(_safe_str(rv.get("content")))
-                if s_old not in rc:
-                    raise ValueError("原段落未在该教师评价中找到（内容已变化？）")
-                rv["content"] = tomlkit.string(rc.replace(s_old, s_new, 1), multiline=True)
-                if author:
-                    _append_author_field(rv, author)
-                return tomlkit.dumps(doc).rstrip() + "\n"
-            raise ValueError("未找到指定 teacher")
+            ti = _name_index(base_toml)[1].get((cidx0, teacher_name))
+            if ti is None:
+                raise ValueError("未找到指定 teacher")
+            reviews = _aot(teachers[ti].get("reviews"))
+            if not reviews or ridx0 < 0 or ridx0 >= len(reviews):
+                raise ValueError("reviews 索引越界")
+            rv = reviews[ridx0]
+            if not isinstance(rv, Table):
+                raise ValueError("review 必须是 table")
+            rc = _norm_text(_safe_str(rv.get("content")))
+            if s_old not in rc:
+                raise ValueError("原段落未在该教师评价中找到（内容已变化？）")
+            old_src = rv.as_string()
+            rv["content"] = tomlkit.string(rc.replace(s_old, s_new, 1), multiline=True)
+            if author:
+                _append_author_field(rv, author)
+            return _splice_or_dump(base_toml, doc, old_src, rv.as_string())
 
         # course_section_item
         section_title = str(target.get("section") or "").strip()
@@ -754,25 +853,23 @@ def _patch_toml_by_target(
         csecs = _aot(c.get("sections"))
         if not csecs:
             raise ValueError("sections 不存在")
-        for sec in csecs:
-            if not isinstance(sec, Table):
-                continue
-            if _safe_str(sec.get("title")).strip() != section_title:
-                continue
-            items = _aot(sec.get("items"))
-            if not items or idx0 < 0 or idx0 >= len(items):
-                raise ValueError("items 索引越界")
-            it = items[idx0]
-            if not isinstance(it, Table):
-                raise ValueError("item 必须是 table")
-            cc = _norm_text(_safe_str(it.get("content")))
-            if s_old not in cc:
-                raise ValueError("原段落未在该条目中找到（内容已变化？）")
-            it["content"] = tomlkit.string(cc.replace(s_old, s_new, 1), multiline=True)
-            if author:
-                _append_author_field(it, author)
-            return tomlkit.dumps(doc).rstrip() + "\n"
-        raise ValueError("未找到指定 section")
+        si = _name_index(base_toml)[2].get((cidx0, section_title))
+        if si is None:
+            raise ValueError("未找到指定 section")
+        items = _aot(csecs[si].get("items"))
+        if not items or idx0 < 0 or idx0 >= len(items):
+            raise ValueError("items 索引越界")
+        it = items[idx0]
+        if not isinstance(it, Table):
+            raise ValueError("item 必须是 table")
+        cc = _norm_text(_safe_str(it.get("content")))
+        if s_old not in cc:
+            raise ValueError("原段落未在该条目中找到（内容已变化？）")
+        old_src = it.as_string()
+        it["content"] = tomlkit.string(cc.replace(s_old, s_new, 1), multiline=True)
+        if author:
+            _append_author_field(it, author)
+        return _splice_or_dump(base_toml, doc, old_src, it.as_string())
 
     raise ValueError(f"unsupported target type: {t}")
 
@@ -814,16 +911,13 @@ def _format_structure(summary: dict) -> str:
 
 def _list_multi_courses_from_toml(toml_text: str) -> list[dict]:
     """Return list of {index,name,code} for multi-project courses."""
-    doc = _doc_table(tomlkit.parse(toml_text))
-    repo_type = str(getattr(doc, "repo_type", "") or "").strip()
+    doc = _parse_ro(toml_text)
+    repo_type = _safe_str(doc.get("repo_type")).strip()
     if repo_type != "multi-project":
         return []
-    courses = _aot(doc.get("courses"))
     out: list[dict] = []
-    if not courses:
-        return out
-    for i, c in enumerate(courses):
-        if not isinstance(c, Table):
+    for i, c in enumerate(_ro_list(doc.get("courses"))):
+        if not isinstance(c, dict):
             continue
         name = _safe_str(c.get("name")).strip()
         code = _safe_str(c.get("code")).strip()
@@ -855,46 +949,35 @@ def _pick_course_name(*, toml_text: str, pick: str) -> str | None:
 
 
 def _format_multi_course_structure(*, toml_text: str, course_name: str) -> str:
-    doc = _doc_table(tomlkit.parse(toml_text))
+    doc = _parse_ro(toml_text)
     lines: list[str] = []
     lines.append(f"当前子课程：{course_name}")
 
-    courses = _aot(doc.get("courses"))
-    picked: Table | None = None
-    if courses:
-        for c in courses:
-            if not isinstance(c, Table):
-                continue
-            if _safe_str(c.get("name")).strip() == course_name:
-                picked = c
-                break
+    picked: dict | None = None
+    for c in _ro_list(doc.get("courses")):
+        if isinstance(c, dict) and _safe_str(c.get("name")).strip() == course_name:
+            picked = c
+            break
     if not picked:
         return "\n".join(lines + ["（未在 courses 中找到该子课程；请用 /pr target 重新选择）"])
 
-    teachers = _aot(picked.get("teachers"))
-    if teachers:
-        names: list[str] = []
-        for t in teachers:
-            if not isinstance(t, Table):
-                continue
-            n = _safe_str(t.get("name")).strip()
-            if n:
-                names.append(n)
-        if names:
-            lines.append(f"教师：{', '.join(names)}")
+    names = [
+        n for n in (_safe_str(t.get("name")).strip() for t in _ro_list(picked.get("teachers")) if isinstance(t, dict)) if n
+    ]
+    if names:
+        lines.append(f"教师：{', '.join(names)}")
 
-    secs = _aot(picked.get("sections"))
+    secs = _ro_list(picked.get("sections"))
     if not secs:
         lines.append("（该子课程暂无 sections；你可以用 /pr add <章节标题> 新增）")
         return "\n".join(lines)
 
     lines.append("sections：")
     for sec in secs:
-        if not isinstance(sec, Table):
+        if not isinstance(sec, dict):
             continue
         title = _safe_str(sec.get("title")).strip() or "(未命名章节)"
-        items = _aot(sec.get("items"))
-        n_items = len(items) if items else 0
+        n_items = len(_ro_list(sec.get("items")))
         lines.append(f"- {title}（{n_items} 条）")
 
     lines.append("\n指令：/pr add <章节标题>  或  /pr modify（按原段落定位修改）")
@@ -902,8 +985,7 @@ def _format_multi_course_structure(*, toml_text: str, course_name: str) -> str:
 
 
 def _build_forward_nodes_for_multi_course(bot: Bot, toml_text: str, course_name: str) -> list[dict]:
-    doc = _doc_table(tomlkit.parse(toml_text))
-    segs = _extract_multi_segments(doc)
+    segs = _segments_ro(toml_text, "multi-project")
     picked = None
     for title, body in segs:
         if title == course_name:
@@ -912,15 +994,7 @@ def _build_forward_nodes_for_multi_course(bot: Bot, toml_text: str, course_name:
     if not picked:
         return [make_node(bot, f"未找到子课程《{course_name}》；请用 /pr target 重新选择。")]
 
-    title, body = picked
-    nodes: list[dict] = []
-    parts = _split_long_text(body, limit=1800)
-    if len(parts) == 1:
-        nodes.append(make_node(bot, parts[0]))
-    else:
-        for i, p in enumerate(parts, start=1):
-            nodes.append(make_node(bot, f"{title}（{i}/{len(parts)}）\n\n{p}".strip()))
-    return nodes
+    return _nodes_from_segments(bot, (picked,))
 
 
 def _chunk_lines(lines: list[str], *, limit: int = 1800) -> list[str]:
@@ -1011,6 +1085,469 @@ def _reply_msg(event: MessageEvent, text: str) -> Message | str:
     return Message([MessageSegment.at(user_id), MessageSegment.text(" "), MessageSegment.text(text)])
 
 
+# /pr [子命令 [参数]]：text 已把空白规整为单个空格
+_CMD_RE = re.compile(r"/?pr(?: (\S+)(?: (.+))?)?")
+
+# 留名 / 确认 两步的回复词表（已 strip().lower()）
+_YES_ANS = frozenset({"y", "yes", "是", "要", "留", "留名"})
+_NO_ANS = frozenset({"n", "no", "否", "不要", "不留"})
+_CONFIRM_ANS = frozenset({"确认", "confirm", "y", "yes", "是"})
+_CANCEL_ANS = frozenset({"取消", "cancel", "c", "n", "no"})
+
+
+# 候选 dict 由 _find_paragraph_candidates 产出：type 是模板里的字面量字符串，下标/名字已是 int/str，
+# 这里直接取用，不再逐处 str()/int() 转换
+_COURSE_CTYPES = frozenset({"course_section_item", "course_teacher_review"})
+
+
+# 定位/选择结果的提示文案，按候选 type 查表；两处提示与候选列表共用同一套格式
+def _nth(c: dict, key: str) -> int:
+    return c.get(key, 0) + 1
+
+
+_TARGET_LABELS: dict[str, Callable[[dict], str]] = {
+    "section_item": lambda c: f"章节《{c.get('section')}》第 {_nth(c, 'index')} 条：{c.get('preview')}",
+    "description": lambda c: "description",
+    "lecturer_review": lambda c: f"lecturers《{c.get('lecturer')}》评价#{_nth(c, 'review_index')}",
+    "course_section_item": lambda c: f"子课程《{c.get('course_name')}》章节《{c.get('section')}》第 {_nth(c, 'index')} 条",
+    "course_teacher_review": lambda c: f"子课程《{c.get('course_name')}》教师《{c.get('teacher')}》评价#{_nth(c, 'review_index')}",
+}
+
+
+def _locate_label(c: dict, label: Callable[[dict], str]) -> str:
+    # section_item 的标签已带预览，其余类型单独补一行预览
+    if c.get("type") == "section_item":
+        return label(c)
+    return f"{label(c)}\n预览：{c.get('preview')}"
+
+
+_CHOICE_LINES: dict[str, Callable[[dict], str]] = {
+    "section_item": lambda c: f"[sections] 《{c.get('section')}》#{_nth(c, 'index')} {c.get('preview')}",
+    "description": lambda c: f"[description] {c.get('preview')}",
+    "lecturer_review": lambda c: f"[lecturers] 《{c.get('lecturer')}》评价#{_nth(c, 'review_index')} {c.get('preview')}",
+    "course_section_item": lambda c: (
+        f"[courses.sections] 《{c.get('course_name')}》/《{c.get('section')}》#{_nth(c, 'index')} {c.get('preview')}"
+    ),
+    "course_teacher_review": lambda c: (
+        f"[courses.teachers] 《{c.get('course_name')}》/《{c.get('teacher')}》评价#{_nth(c, 'review_index')} {c.get('preview')}"
+    ),
+}
+
+
+def _choice_default(c: dict) -> str:
+    return f"{c.get('preview')}"
+
+
+# full TOML flow
+async def _handle_full_toml(event: MessageEvent, pending: Pending, text: str, k: tuple[int | None, int]) -> Pending | None:
+    toml_text = text
+    if not toml_text or len(toml_text) < 20:
+        await matcher.finish("TOML 内容太短，请重新粘贴完整 readme.toml")
+
+    await matcher.send(_reply_msg(event, "正在进行内容合规审核..."))
+    mod = await moderate_toml(toml_text)
+    if not mod.approved:
+        _PENDING.pop(k, None)
+        await matcher.finish(f"审核未通过：{mod.reason}")
+
+    await matcher.send(_reply_msg(event, "审核通过，正在提交并确保 PR..."))
+    repo_name: str | None = (pending.repo_name or "").strip() or (pending.course_code or "").strip() or None
+    course_code = (pending.course_code or "").strip()
+    course_name = (pending.course_name or "").strip()
+    repo_type = (pending.repo_type or "").strip()
+
+    if not course_code or not course_name or not repo_type:
+        await matcher.finish("缺少必要的仓库或课程信息，无法继续。")
+
+    r = await ensure_pr(
+        repo_name=repo_name,
+        course_code=course_code,
+        course_name=course_name,
+        repo_type=repo_type,
+        toml_text=toml_text,
+    )
+    _PENDING.pop(k, None)
+    if not r.ok:
+        await matcher.finish(f"提交失败：{r.message}")
+    if r.pr_url:
+        await matcher.finish(f"已创建/更新 PR：{r.pr_url}")
+    if r.request_id:
+        await matcher.finish(f"仓库不存在，已进入 pending：request_id={r.request_id}")
+    await matcher.finish(f"提交完成：{r.message}")
+
+
+# collect section title for add
+async def _handle_add_section(event: MessageEvent, pending: Pending, text: str, k: tuple[int | None, int]) -> Pending | None:
+    section_title = text.strip()
+    if not section_title:
+        await matcher.finish("章节标题不能为空，请重新发送")
+    # multi-project：把“章节标题”转成 append_course_section_item target
+    if (pending.repo_type or "").strip() == "multi-project":
+        t = pending.target or {}
+        if not (isinstance(t, dict) and str(t.get("type") or "") == "multi-project-course"):
+            await matcher.finish("multi-project 请先 /pr target 选中子课程")
+        cname = str(t.get("course_name") or "").strip()
+        if not cname:
+            await matcher.finish("multi-project 请先 /pr target 选中子课程")
+        pending.mode = "add_content"
+        pending.target = {"type": "append_course_section_item", "course_name": cname, "section": section_title}
+        pending.base_toml = None
+        pending.item_index = -1
+        pending.old_paragraph = ""
+        pending.section_title = ""
+        await matcher.finish(
+            _reply_msg(
+                event,
+                f"将向子课程《{cname}》章节《{section_title}》追加一条内容。\n"
+                "请下一条消息发送正文（不要带多余解释）。",
+            )
+        )
+
+    pending.mode = "add_content"
+    pending.section_title = section_title
+    pending.base_toml = None
+    pending.item_index = -1
+    pending.old_paragraph = ""
+    pending.target = None
+    await matcher.finish(_reply_msg(event, f"将向章节《{section_title}》追加一条内容。请下一条消息发送正文。"))
+
+
+# modify: receive old paragraph
+async def _handle_modify_old(event: MessageEvent, pending: Pending, text: str, k: tuple[int | None, int]) -> Pending | None:
+    old = text.strip()
+    if len(old) < 10:
+        await matcher.finish("原段落太短，建议复制更长一点的原文再试")
+
+    await matcher.send("正在从仓库 TOML 中定位该段落...")
+    repo_key2 = (pending.repo_name or pending.course_code or "").strip()
+    if not repo_key2:
+        _PENDING.pop(k, None)
+        await matcher.finish("缺少仓库标识（repo_name/course_code），请重新 /pr start")
+
+    r = await get_course_toml(repo_name=repo_key2)
+    if not r.ok or not r.toml:
+        _PENDING.pop(k, None)
+        await matcher.finish(f"拉取 TOML 失败：{r.message}")
+
+    candidates = _find_paragraph_candidates(r.toml, old)
+    # multi-project：只允许修改“当前选中子课程”的条目
+    if (pending.repo_type or "").strip() == "multi-project":
+        t = pending.target or {}
+        cname = ""
+        if isinstance(t, dict) and str(t.get("type") or "") == "multi-project-course":
+            cname = str(t.get("course_name") or "").strip()
+        if not cname:
+            await _prompt_pick_multi_course(matcher=matcher, event=event, repo_name=repo_key2)
+        candidates = [
+            c
+            for c in candidates
+            if c["type"] in _COURSE_CTYPES and c["course_name"] == cname
+        ]
+    if not candidates:
+        await matcher.finish(
+            "未定位到匹配条目（multi-project 只会在当前选中子课程内查找）。\n"
+            "- 请确认复制的是该子课程的原文\n"
+            "- 或用 /pr target 切换子课程后重试"
+        )
+    if any(c["type"] != "section_item" for c in candidates):
+        # 这类目标要在本地 patch：趁用户输入新正文时在线程里先做 tomlkit 解析
+        warm = asyncio.get_running_loop().run_in_executor(None, _parse_rw_cached, r.toml)
+        warm.add_done_callback(_drop_warm_error)
+
+    if len(candidates) == 1:
+        c = candidates[0]
+        pending.mode = "modify_new"
+        pending.section_title = str(c.get("section") or "")
+        pending.item_index = c.get("index", -1)
+        pending.old_paragraph = old
+        pending.target = c
+        pending.base_toml = r.toml
+        label = _TARGET_LABELS.get(c["type"])
+        if label:
+            await matcher.finish(f"已定位到：{_locate_label(c, label)}\n请下一条消息发送修改后的完整正文。")
+        await matcher.finish(_reply_msg(event, "已定位到目标。请下一条消息发送修改后的完整正文。"))
+
+    # multiple: ask choose
+    lines = ["找到多个匹配，请回复序号选择："]
+    for i, c in enumerate(candidates[:8], start=1):
+        lines.append(f"{i}) {_CHOICE_LINES.get(c['type'], _choice_default)(c)}")
+    if len(candidates) > 8:
+        lines.append(f"（仅展示前 8 个，共 {len(candidates)} 个匹配；建议提供更长原文缩小范围）")
+
+    pending.mode = "modify_choose"
+    pending.candidates = candidates[:8]
+    pending.old_paragraph = old
+    pending.base_toml = r.toml
+    await matcher.finish("\n".join(lines))
+
+
+async def _handle_modify_choose(event: MessageEvent, pending: Pending, text: str, k: tuple[int | None, int]) -> Pending | None:
+    if not pending.candidates:
+        _PENDING.pop(k, None)
+        await matcher.finish("状态异常：请重新 /pr modify")
+    try:
+        pick = int(text.strip())
+    except Exception:
+        await matcher.finish("请回复数字序号（例如 1）")
+    if pick <= 0 or pick > len(pending.candidates):
+        await matcher.finish("序号超出范围")
+    c = pending.candidates[pick - 1]
+    pending.mode = "modify_new"
+    pending.section_title = str(c.get("section") or "")
+    pending.item_index = c.get("index", -1)
+    pending.target = c
+    label = _TARGET_LABELS.get(c["type"])
+    if label:
+        await matcher.finish(f"已选择：{label(c)}\n请下一条消息发送修改后的完整正文。")
+    await matcher.finish(_reply_msg(event, "已选择目标。请下一条消息发送修改后的完整正文。"))
+
+
+async def _handle_modify_new(event: MessageEvent, pending: Pending, text: str, k: tuple[int | None, int]) -> Pending | None:
+    new = text.strip()
+    if not new:
+        await matcher.finish("修改后的正文不能为空")
+
+    pending.mode = "attrib_ask"
+    pending.new_paragraph = new
+    await matcher.finish("是否在该条目 author 中留名？回复 y/n")
+
+
+# add/edit flow (by title/index): ask attribution after receiving content
+async def _handle_content(event: MessageEvent, pending: Pending, text: str, k: tuple[int | None, int]) -> Pending | None:
+    content = text.strip()
+    if not content:
+        await matcher.finish("内容不能为空，请重新发送")
+    pending.mode = "attrib_ask"
+    pending.new_paragraph = content
+    await matcher.finish("是否在该条目 author 中留名？回复 y/n")
+
+
+async def _handle_attrib_ask(event: MessageEvent, pending: Pending, text: str, k: tuple[int | None, int]) -> Pending | None:
+    default_author_name = _author_name(event)
+    ans = text.strip().lower()
+    if ans in _YES_ANS:
+        pending.mode = "attrib_name"
+        pending.want_attribution = True
+        await matcher.finish(_reply_msg(event, f"请输入显示名字（直接回车或只 @我 不带文字则用：{default_author_name}）"))
+    elif ans in _NO_ANS:
+        pending.mode = "build_patch"
+        pending.want_attribution = False
+        await matcher.send("好的，不留名。")
+        # 不再等下一条消息：交给 build_patch 接着处理
+        return pending
+    else:
+        await matcher.finish(_reply_msg(event, "请回复 y 或 n"))
+
+
+async def _handle_attrib_name(event: MessageEvent, pending: Pending, text: str, k: tuple[int | None, int]) -> Pending | None:
+    default_author_name = _author_name(event)
+    name = text.strip() or default_author_name
+    pending.mode = "attrib_link"
+    pending.want_attribution = True
+    pending.author_name = name
+    await matcher.finish(_reply_msg(event, "可选：请输入你的主页链接（GitHub/博客等），留空（或只 @我 不带文字）则不填"))
+
+
+async def _handle_attrib_link(event: MessageEvent, pending: Pending, text: str, k: tuple[int | None, int]) -> Pending | None:
+    link = text.strip()
+    pending.mode = "build_patch"
+    pending.want_attribution = True
+    pending.author_link = link
+    await matcher.send("收到。")
+    # 不再等下一条消息：交给 build_patch 接着处理
+    return pending
+
+
+async def _handle_build_patch(event: MessageEvent, pending: Pending, text: str, k: tuple[int | None, int]) -> Pending | None:
+    default_author_name = _author_name(event)
+    author = None
+    if getattr(pending, "want_attribution", False):
+        author = {
+            "name": getattr(pending, "author_name", default_author_name),
+            "link": getattr(pending, "author_link", ""),
+            "date": _year_month(),
+        }
+
+    # append operations are patched locally (prServer submit_ops 不支持这些追加类操作)
+    ttype0 = str(((pending.target or {}) if isinstance(pending.target, dict) else {}).get("type") or "")
+    if ttype0 in {"append_course", "append_course_section_item", "append_course_teacher_review", "append_lecturer_review"}:
+        repo_key = (getattr(pending, "repo_name", "") or getattr(pending, "course_code", "") or "").strip()
+        if not repo_key:
+            _PENDING.pop(k, None)
+            await matcher.finish("缺少仓库标识（repo_name/course_code），请重新 /pr start")
+
+        r0 = await get_course_toml(repo_name=repo_key)
+        if not r0.ok or not r0.toml:
+            _PENDING.pop(k, None)
+            await matcher.finish(f"拉取失败：{r0.message}")
+
+        try:
+            if ttype0 == "append_lecturer_review":
+                patched_toml = _append_normal_lecturer_review(
+                    r0.toml,
+                    lecturer=str((getattr(pending, "target", {}) or {}).get("lecturer") or "").strip(),
+                    content=getattr(pending, "new_paragraph", "") or "",
+                    author=author,
+                )
+            else:
+                patched_toml = _append_toml_by_target(
+                    r0.toml,
+                    target=getattr(pending, "target", {}) or {},
+                    content=getattr(pending, "new_paragraph", "") or "",
+                    author=author,
+                )
+        except Exception as e:
+            _PENDING.pop(k, None)
+            await matcher.finish(f"生成失败：{e}")
+
+        new_preview = _truncate(pending.new_paragraph)
+
+        pending.mode = "confirm"
+        pending.patched_toml = patched_toml
+
+        msg = ["即将提交：multi-project 追加".strip()]
+        if new_preview:
+            msg.append(f"\n新增内容（截断）：\n{new_preview}")
+        msg.append("\n回复：确认 / 取消")
+        await matcher.finish(_reply_msg(event, "\n".join(msg)))
+
+    if getattr(pending, "old_paragraph", None) and getattr(pending, "target", None):
+        ttype = str((pending.target or {}).get("type") or "")
+        if ttype == "section_item":
+            fields = {"content": getattr(pending, "new_paragraph", "")}
+            if author:
+                fields["author"] = author
+            ops = [
+                {
+                    "op": "update_section_item",
+                    "section": getattr(pending, "section_title", ""),
+                    "index": getattr(pending, "item_index", -1),
+                    "fields": fields,
+                }
+            ]
+        else:
+            # local patch for targets not supported by submit_ops
+            if not getattr(pending, "base_toml", None):
+                _PENDING.pop(k, None)
+                await matcher.finish("状态异常：缺少 base TOML，请重新 /pr modify")
+            await matcher.send("正在生成修改后的 TOML...")
+            try:
+                patched_toml = _patch_toml_by_target(
+                    getattr(pending, "base_toml", ""),
+                    target=getattr(pending, "target", {}),
+                    old_paragraph=getattr(pending, "old_paragraph", ""),
+                    new_paragraph=getattr(pending, "new_paragraph", ""),
+                    author=author,
+                )
+            except Exception as e:
+                await matcher.finish(f"生成失败：{e}")
+
+            pending.mode = "confirm"
+            pending.patched_toml = patched_toml
+            await matcher.finish(
+                _reply_msg(event, _render_confirm("定位修改", pending.old_paragraph, pending.new_paragraph))
+            )
+    elif getattr(pending, "item_index", -1) >= 0:
+        fields2 = {"content": getattr(pending, "new_paragraph", "")}
+        if author:
+            fields2["author"] = author
+        ops = [
+            {
+                "op": "update_section_item",
+                "section": getattr(pending, "section_title", ""),
+                "index": getattr(pending, "item_index", -1),
+                "fields": fields2,
+            }
+        ]
+    else:
+        item = {"content": getattr(pending, "new_paragraph", "")}
+        if author:
+            item["author"] = author
+        ops = [
+            {
+                "op": "append_section_item",
+                "section": getattr(pending, "section_title", ""),
+                "item": item,
+            }
+        ]
+
+    await matcher.send("正在生成修改后的 TOML...")
+    patched = await submit_ops_dry_run(
+        repo_name=getattr(pending, "repo_name", ""),
+        course_code=getattr(pending, "course_code", ""),
+        course_name=getattr(pending, "course_name", ""),
+        repo_type=getattr(pending, "repo_type", ""),
+        ops=ops,
+    )
+    if not patched.ok or not patched.toml:
+        _PENDING.pop(k, None)
+        await matcher.finish(f"生成失败：{patched.message}")
+
+    info = ""
+    if pending.section_title:
+        info = f"章节《{pending.section_title}》"
+    if pending.item_index >= 0:
+        info += f" 第 {pending.item_index + 1} 条"
+
+    pending.mode = "confirm"
+    pending.patched_toml = patched.toml
+    await matcher.finish(_reply_msg(event, _render_confirm(info, pending.old_paragraph, pending.new_paragraph)))
+
+
+async def _handle_confirm(event: MessageEvent, pending: Pending, text: str, k: tuple[int | None, int]) -> Pending | None:
+    ans = text.strip().lower()
+    if ans in _CANCEL_ANS:
+        _PENDING.pop(k, None)
+        await matcher.finish("已取消本次修改")
+    if ans not in _CONFIRM_ANS:
+        await matcher.finish(_reply_msg(event, "请回复：确认 或 取消"))
+
+    if not getattr(pending, "patched_toml", None):
+        _PENDING.pop(k, None)
+        await matcher.finish("状态异常：缺少 patched TOML，请重新开始")
+
+    await matcher.send(_reply_msg(event, "正在进行内容合规审核..."))
+    mod = await moderate_toml(getattr(pending, "patched_toml", ""))
+    if not mod.approved:
+        _PENDING.pop(k, None)
+        await matcher.finish(f"审核未通过：{mod.reason}")
+
+    await matcher.send(_reply_msg(event, "审核通过，正在提交并确保 PR..."))
+    result = await ensure_pr(
+        repo_name=getattr(pending, "repo_name", ""),
+        course_code=getattr(pending, "course_code", ""),
+        course_name=getattr(pending, "course_name", ""),
+        repo_type=getattr(pending, "repo_type", ""),
+        toml_text=getattr(pending, "patched_toml", ""),
+    )
+    _PENDING.pop(k, None)
+    if not result.ok:
+        await matcher.finish(f"提交失败：{result.message}")
+    if result.pr_url:
+        await matcher.finish(f"已创建/更新 PR：{result.pr_url}")
+    if result.request_id:
+        await matcher.finish(f"仓库不存在，已进入 pending：request_id={result.request_id}")
+    await matcher.finish(f"提交完成：{result.message}")
+
+
+# 会话模式 -> 处理协程。处理协程要么 finish 结束本条消息，要么返回新的 Pending，
+# 由其模式对应的处理协程在同一条消息里接着处理（attrib_ask/attrib_link -> build_patch）
+_MODE_HANDLERS: dict[str, Callable[[MessageEvent, Pending, str, tuple[int | None, int]], Awaitable[Pending | None]]] = {
+    "full_toml": _handle_full_toml,
+    "add_section": _handle_add_section,
+    "modify_old": _handle_modify_old,
+    "modify_choose": _handle_modify_choose,
+    "modify_new": _handle_modify_new,
+    "add_content": _handle_content,
+    "edit_content": _handle_content,
+    "attrib_ask": _handle_attrib_ask,
+    "attrib_name": _handle_attrib_name,
+    "attrib_link": _handle_attrib_link,
+    "build_patch": _handle_build_patch,
+    "confirm": _handle_confirm,
+}
+
+
 @matcher.handle()
 async def _(bot: Bot, event: MessageEvent):
     text = _text(event)
@@ -1018,10 +1555,16 @@ async def _(bot: Bot, event: MessageEvent):
     # 容错：有些客户端会输入“/ pr show”（/ 后多空格）或多空格。
     text = re.sub(r"\s+", " ", (text or "").strip())
     text = re.sub(r"^/\s+", "/", text)
+    # 一次正则匹配拆出 /pr 子命令和参数；非 /pr 消息 cmd 为空，交给后面的会话状态处理
+    m = _CMD_RE.fullmatch(text)
+    cmd, arg = (m.group(1) or "help", m.group(2)) if m else ("", None)
+    # 会话键与当前会话只取一次，后面各分支直接复用
+    k = _key(event)
+    pending = _PENDING.get(k)
 
     # 检测是否仅仅是 @ 机器人
     if not text.strip():
-        if not _PENDING.get(_key(event)):
+        if not pending:
             await matcher.finish(
                 "🎓 你好！我是 HITSZ 课程助理 Hoa_Anon酱\n"
                 "找课程请记得 @我 并使用以下指令：\n"
@@ -1048,7 +1591,7 @@ async def _(bot: Bot, event: MessageEvent):
             )
 
     # 命令：/pr help
-    if text in {"/pr", "/pr help", "pr", "pr help"}:
+    if cmd == "help" and arg is None:
         await matcher.finish(
             reply(
                 "PR 提交（流程）\n"
@@ -1063,8 +1606,8 @@ async def _(bot: Bot, event: MessageEvent):
         )
 
     # 命令：/pr cancel
-    if text in {"/pr cancel", "pr cancel"}:
-        _PENDING.pop(_key(event), None)
+    if cmd == "cancel" and arg is None:
+        _PENDING.pop(k, None)
         await matcher.finish(reply("已取消本次 PR 提交流程"))
 
     # 命令：/pr start
@@ -1072,7 +1615,7 @@ async def _(bot: Bot, event: MessageEvent):
     # - /pr start <repo_name>
     # - /pr start <课程代码|全名|昵称>
     # 兼容老版：/pr start <repo_name> <course_code> <course_name...> <repo_type>
-    if text.startswith("/pr start ") or text.startswith("pr start "):
+    if cmd == "start" and arg:
         if not _allowed(event):
             await matcher.finish("你没有权限发起 PR（管理员未授权）")
 
@@ -1121,6 +1664,8 @@ async def _(bot: Bot, event: MessageEvent):
                 repo_type = repo_type or rt
             else:
                 # (B) 再把 key 当“课程代码/全名/昵称”：从本地 course_manager 解析到 code/name
+                if not await course_manager.wait_ready():
+                    await matcher.finish("⏳ 课程数据仍在加载中，请稍后再试（或用 repo_name 直接 /pr start）。")
                 course = course_manager.get_course_detail(key)
                 if course:
                     schema = str(course.get("_schema") or "")
@@ -1143,7 +1688,7 @@ async def _(bot: Bot, event: MessageEvent):
 
                         # 记住选中的子课程，后续 /pr add 可省略子课程名
                         sub_name = str(course.get("course_name") or "").strip() or key
-                        _PENDING[_key(event)] = Pending(
+                        _PENDING[k] = Pending(
                             repo_name=repo_name,
                             course_code=course_code,
                             course_name=course_name,
@@ -1183,7 +1728,7 @@ async def _(bot: Bot, event: MessageEvent):
                 "/pr start <repo_name> <course_code> <course_name...> <repo_type>"
             )
 
-        _PENDING[_key(event)] = Pending(
+        _PENDING[k] = Pending(
             repo_name=repo_name,
             course_code=course_code,
             course_name=course_name,
@@ -1208,8 +1753,7 @@ async def _(bot: Bot, event: MessageEvent):
         )
 
     # 命令：/pr show（查看结构）
-    if text in {"/pr show", "pr show", "/pr view", "pr view"}:
-        pending = _PENDING.get(_key(event))
+    if cmd in {"show", "view"} and arg is None:
         if not pending:
             await matcher.finish(reply("请先 /pr start 进入流程"))
 
@@ -1218,44 +1762,53 @@ async def _(bot: Bot, event: MessageEvent):
         if not repo_key:
             await matcher.finish("缺少仓库标识（repo_name/course_code），请重新 /pr start")
 
-        r = await get_course_toml(repo_name=repo_key)
-        if not r.ok or not r.toml:
-            await matcher.finish(f"拉取失败：{r.message}")
+        # normal 仓库最后要附带导航摘要：它和 TOML 互不依赖，先发请求，与拉取/合并转发并行
+        structure_task = None
+        if (pending.repo_type or "").strip() != "multi-project":
+            structure_task = asyncio.create_task(get_course_structure(repo_name=repo_key))
 
-        # multi-project：必须选定子课程；show 只展示该子课程
-        if (pending.repo_type or "").strip() == "multi-project":
-            t = pending.target or {}
-            if not (isinstance(t, dict) and str(t.get("type") or "") == "multi-project-course"):
-                await _prompt_pick_multi_course(matcher=matcher, event=event, repo_name=repo_key)
-            course_name = str((t or {}).get("course_name") or "").strip()
-            if not course_name:
-                await _prompt_pick_multi_course(matcher=matcher, event=event, repo_name=repo_key)
-
-            nodes = _build_forward_nodes_for_multi_course(bot, r.toml, course_name)
-            ok = await _send_forward(bot, event, nodes)
-            if not ok:
-                await matcher.finish("发送合并转发失败（可能风控/版本问题）。你可以改用直接粘贴整段 TOML 提交。")
+        # finish 会抛异常提前结束：拉取/解析/发送任一步失败都要把导航摘要请求取消掉，不留悬空任务
+        try:
+            r = await get_course_toml(repo_name=repo_key)
+            if not r.ok or not r.toml:
+                await matcher.finish(f"拉取失败：{r.message}")
 
-            await matcher.finish(_format_multi_course_structure(toml_text=r.toml, course_name=course_name))
+            # multi-project：必须选定子课程；show 只展示该子课程
+            if (pending.repo_type or "").strip() == "multi-project":
+                t = pending.target or {}
+                if not (isinstance(t, dict) and str(t.get("type") or "") == "multi-project-course"):
+                    await _prompt_pick_multi_course(matcher=matcher, event=event, repo_name=repo_key)
+                course_name = str((t or {}).get("course_name") or "").strip()
+                if not course_name:
+                    await _prompt_pick_multi_course(matcher=matcher, event=event, repo_name=repo_key)
 
-        try:
-            nodes = build_forward_nodes_from_toml(bot, r.toml)
-        except Exception as e:
-            await matcher.finish(f"解析 TOML 失败：{e}")
+                nodes = _build_forward_nodes_for_multi_course(bot, r.toml, course_name)
+                ok = await _send_forward(bot, event, nodes)
+                if not ok:
+                    await matcher.finish("发送合并转发失败（可能风控/版本问题）。你可以改用直接粘贴整段 TOML 提交。")
 
-        ok = await _send_forward(bot, event, nodes)
-        if not ok:
-            await matcher.finish("发送合并转发失败（可能风控/版本问题）。你可以改用直接粘贴整段 TOML 提交。")
+                await matcher.finish(_format_multi_course_structure(toml_text=r.toml, course_name=course_name))
 
-        # Also provide a short summary for navigation
-        s = await get_course_structure(repo_name=repo_key)
-        if s.ok and s.data and isinstance(s.data.get("summary"), dict):
-            await matcher.finish(_format_structure(s.data["summary"]))
-        await matcher.finish("已展示。你可以 /pr add 或 /pr modify 继续。")
+            try:
+                nodes = build_forward_nodes_from_toml(bot, r.toml)
+            except Exception as e:
+                await matcher.finish(f"解析 TOML 失败：{e}")
+
+            ok = await _send_forward(bot, event, nodes)
+            if not ok:
+                await matcher.finish("发送合并转发失败（可能风控/版本问题）。你可以改用直接粘贴整段 TOML 提交。")
+
+            # Also provide a short summary for navigation
+            s = await structure_task if structure_task else await get_course_structure(repo_name=repo_key)
+            if s.ok and s.data and isinstance(s.data.get("summary"), dict):
+                await matcher.finish(_format_structure(s.data["summary"]))
+            await matcher.finish("已展示。你可以 /pr add 或 /pr modify 继续。")
+        finally:
+            if structure_task is not None and not structure_task.done():
+                structure_task.cancel()
 
     # 命令：/pr target <子课程名>（multi-project 选择子课程）
-    if text.startswith("/pr target ") or text.startswith("pr target "):
-        pending = _PENDING.get(_key(event))
+    if cmd == "target" and arg:
         if not pending:
             await matcher.finish(reply("请先 /pr start 进入流程"))
         if (pending.repo_type or "").strip() != "multi-project":
@@ -1275,7 +1828,7 @@ async def _(bot: Bot, event: MessageEvent):
         if not picked_name:
             await _prompt_pick_multi_course(matcher=matcher, event=event, repo_name=repo_key, hint=f"未找到子课程：{raw_pick}")
 
-        _PENDING[_key(event)] = Pending(
+        _PENDING[k] = Pending(
             repo_name=pending.repo_name,
             course_code=pending.course_code,
             course_name=pending.course_name,
@@ -1286,8 +1839,7 @@ async def _(bot: Bot, event: MessageEvent):
         await matcher.finish(f"已切换当前子课程：{picked_name}\n提示：/pr show 查看该子课程；/pr add 追加 sections；/pr addreview 追加教师评价")
 
     # 命令：/pr addcourse <子课程名>（multi-project 新增一门子课程）
-    if text.startswith("/pr addcourse ") or text.startswith("pr addcourse "):
-        pending = _PENDING.get(_key(event))
+    if cmd == "addcourse" and arg:
         if not pending:
             await matcher.finish(reply("请先 /pr start 进入流程"))
         if (pending.repo_type or "").strip() != "multi-project":
@@ -1301,7 +1853,7 @@ async def _(bot: Bot, event: MessageEvent):
         if not course_name:
             await matcher.finish("用法：/pr addcourse <子课程名> [课程代码]")
 
-        _PENDING[_key(event)] = Pending(
+        _PENDING[k] = Pending(
             repo_name=pending.repo_name,
             course_code=pending.course_code,
             course_name=pending.course_name,
@@ -1317,8 +1869,7 @@ async def _(bot: Bot, event: MessageEvent):
     # 命令：/pr addreview
     # - multi-project：/pr addreview <子课程名> <教师名>
     # - normal：/pr addreview <教师名>
-    if text.startswith("/pr addreview ") or text.startswith("pr addreview "):
-        pending = _PENDING.get(_key(event))
+    if cmd == "addreview" and arg:
         if not pending:
             await matcher.finish(reply("请先 /pr start 进入流程"))
 
@@ -1340,7 +1891,7 @@ async def _(bot: Bot, event: MessageEvent):
             if not course_name or not teacher:
                 await matcher.finish("用法：/pr addreview <子课程名> <教师名>（或先 /pr target 后：/pr addreview <教师名>）")
 
-            _PENDING[_key(event)] = Pending(
+            _PENDING[k] = Pending(
                 repo_name=pending.repo_name,
                 course_code=pending.course_code,
                 course_name=pending.course_name,
@@ -1364,7 +1915,7 @@ async def _(bot: Bot, event: MessageEvent):
         if not lecturer:
             await matcher.finish("用法：/pr addreview <教师名>")
 
-        _PENDING[_key(event)] = Pending(
+        _PENDING[k] = Pending(
             repo_name=pending.repo_name,
             course_code=pending.course_code,
             course_name=pending.course_name,
@@ -1378,8 +1929,7 @@ async def _(bot: Bot, event: MessageEvent):
         )
 
     # 命令：/pr add <章节标题>
-    if text.startswith("/pr add ") or text.startswith("pr add "):
-        pending = _PENDING.get(_key(event))
+    if cmd == "add" and arg:
         if not pending:
             await matcher.finish(reply("请先 /pr start 进入流程"))
 
@@ -1392,7 +1942,7 @@ async def _(bot: Bot, event: MessageEvent):
             if not args:
                 t = pending.target or {}
                 if isinstance(t, dict) and str(t.get("type") or "") == "multi-project-course":
-                    _PENDING[_key(event)] = Pending(
+                    _PENDING[k] = Pending(
                         repo_name=pending.repo_name,
                         course_code=pending.course_code,
                         course_name=pending.course_name,
@@ -1436,7 +1986,7 @@ async def _(bot: Bot, event: MessageEvent):
                     "- 或先 /pr target <子课程名>，再 /pr add <章节标题>"
                 )
 
-            _PENDING[_key(event)] = Pending(
+            _PENDING[k] = Pending(
                 repo_name=pending.repo_name,
                 course_code=pending.course_code,
                 course_name=pending.course_name,
@@ -1455,7 +2005,7 @@ async def _(bot: Bot, event: MessageEvent):
 
         section_title = text.split(" ", 2)[2].strip() if len(text.split(" ", 2)) >= 3 else ""
         if section_title:
-            _PENDING[_key(event)] = Pending(
+            _PENDING[k] = Pending(
                 repo_name=pending.repo_name,
                 course_code=pending.course_code,
                 course_name=pending.course_name,
@@ -1468,7 +2018,7 @@ async def _(bot: Bot, event: MessageEvent):
                 "请下一条消息发送要添加的正文（不要带多余解释）。"
             )
 
-        _PENDING[_key(event)] = Pending(
+        _PENDING[k] = Pending(
             repo_name=pending.repo_name,
             course_code=pending.course_code,
             course_name=pending.course_name,
@@ -1484,12 +2034,11 @@ async def _(bot: Bot, event: MessageEvent):
         await matcher.finish("请发送要追加到的章节标题（已有标题或新建标题均可）。")
 
     # 命令：/pr modify（按原段落定位修改）
-    if text in {"/pr modify", "pr modify", "/pr mod", "pr mod"}:
-        pending = _PENDING.get(_key(event))
+    if cmd in {"modify", "mod"} and arg is None:
         if not pending:
             await matcher.finish(reply("请先 /pr start 进入流程"))
 
-        _PENDING[_key(event)] = Pending(
+        _PENDING[k] = Pending(
             repo_name=pending.repo_name,
             course_code=pending.course_code,
             course_name=pending.course_name,
@@ -1502,8 +2051,7 @@ async def _(bot: Bot, event: MessageEvent):
         )
 
     # 命令：/pr edit <章节标题> <序号>（保留：按序号修改）
-    if text.startswith("/pr edit ") or text.startswith("pr edit "):
-        pending = _PENDING.get(_key(event))
+    if cmd == "edit" and arg:
         if not pending:
             await matcher.finish(reply("请先 /pr start 进入流程"))
 
@@ -1522,7 +2070,7 @@ async def _(bot: Bot, event: MessageEvent):
         if idx1 <= 0:
             await matcher.finish("序号从 1 开始")
 
-        _PENDING[_key(event)] = Pending(
+        _PENDING[k] = Pending(
             repo_name=pending.repo_name,
             course_code=pending.course_code,
             course_name=pending.course_name,
@@ -1537,617 +2085,19 @@ async def _(bot: Bot, event: MessageEvent):
         )
 
     # 如果处于 pending，则把这条消息当 TOML 或正文
-    pending = _PENDING.get(_key(event))
+    # /pr addcourse 会替换会话后落到这里，需要重新取一次
+    pending = _PENDING.get(k)
     if not pending:
         return
 
-    default_author_name = _author_name(event)
-
-    # full TOML flow
-    if getattr(pending, "mode", None) == "full_toml":
-        toml_text = text
-        if not toml_text or len(toml_text) < 20:
-            await matcher.finish("TOML 内容太短，请重新粘贴完整 readme.toml")
-
-        await matcher.send(reply("正在进行内容合规审核..."))
-        mod = await moderate_toml(toml_text)
-        if not mod.approved:
-            _PENDING.pop(_key(event), None)
-            await matcher.finish(f"审核未通过：{mod.reason}")
-
-        await matcher.send(reply("审核通过，正在提交并确保 PR..."))
-        repo_name: str | None = (pending.repo_name or "").strip() or (pending.course_code or "").strip() or None
-        course_code = (pending.course_code or "").strip()
-        course_name = (pending.course_name or "").strip()
-        repo_type = (pending.repo_type or "").strip()
-
-        if not course_code or not course_name or not repo_type:
-            await matcher.finish("缺少必要的仓库或课程信息，无法继续。")
-
-        r = await ensure_pr(
-            repo_name=repo_name,
-            course_code=course_code,
-            course_name=course_name,
-            repo_type=repo_type,
-            toml_text=toml_text,
-        )
-        _PENDING.pop(_key(event), None)
-        if not r.ok:
-            await matcher.finish(f"提交失败：{r.message}")
-        if r.pr_url:
-            await matcher.finish(f"已创建/更新 PR：{r.pr_url}")
-        if r.request_id:
-            await matcher.finish(f"仓库不存在，已进入 pending：request_id={r.request_id}")
-        await matcher.finish(f"提交完成：{r.message}")
-
-    # collect section title for add
-    if getattr(pending, "mode", None) == "add_section":
-        section_title = text.strip()
-        if not section_title:
-            await matcher.finish("章节标题不能为空，请重新发送")
-        # multi-project：把“章节标题”转成 append_course_section_item target
-        if (pending.repo_type or "").strip() == "multi-project":
-            t = pending.target or {}
-            if not (isinstance(t, dict) and str(t.get("type") or "") == "multi-project-course"):
-                await matcher.finish("multi-project 请先 /pr target 选中子课程")
-            cname = str(t.get("course_name") or "").strip()
-            if not cname:
-                await matcher.finish("multi-project 请先 /pr target 选中子课程")
-            _PENDING[_key(event)] = Pending(
-                repo_name=pending.repo_name,
-                course_code=pending.course_code,
-                course_name=pending.course_name,
-                repo_type=pending.repo_type,
-                mode="add_content",
-                target={"type": "append_course_section_item", "course_name": cname, "section": section_title},
-            )
-            await matcher.finish(
-                reply(
-                    f"将向子课程《{cname}》章节《{section_title}》追加一条内容。\n"
-                    "请下一条消息发送正文（不要带多余解释）。"
-                )
-            )
-
-        _PENDING[_key(event)] = Pending(
-            repo_name=pending.repo_name,
-            course_code=pending.course_code,
-            course_name=pending.course_name,
-            repo_type=pending.repo_type,
-            mode="add_content",
-            section_title=section_title,
-        )
-        await matcher.finish(reply(f"将向章节《{section_title}》追加一条内容。请下一条消息发送正文。"))
-
-    # modify: receive old paragraph
-    if getattr(pending, "mode", None) == "modify_old":
-        old = text.strip()
-        if len(old) < 10:
-            await matcher.finish("原段落太短，建议复制更长一点的原文再试")
-
-        await matcher.send("正在从仓库 TOML 中定位该段落...")
-        repo_key2 = (pending.repo_name or pending.course_code or "").strip()
-        if not repo_key2:
-            _PENDING.pop(_key(event), None)
-            await matcher.finish("缺少仓库标识（repo_name/course_code），请重新 /pr start")
-
-        r = await get_course_toml(repo_name=repo_key2)
-        if not r.ok or not r.toml:
-            _PENDING.pop(_key(event), None)
-            await matcher.finish(f"拉取 TOML 失败：{r.message}")
-
-        candidates = _find_paragraph_candidates(r.toml, old)
-        # multi-project：只允许修改“当前选中子课程”的条目
-        if (pending.repo_type or "").strip() == "multi-project":
-            t = pending.target or {}
-            cname = ""
-            if isinstance(t, dict) and str(t.get("type") or "") == "multi-project-course":
-                cname = str(t.get("course_name") or "").strip()
-            if not cname:
-                await _prompt_pick_multi_course(matcher=matcher, event=event, repo_name=repo_key2)
-            candidates = [
-                c
-                for c in candidates
-                if str(c.get("type") or "") in {"course_section_item", "course_teacher_review"}
-                and str(c.get("course_name") or "").strip() == cname
-            ]
-        if not candidates:
-            await matcher.finish(
-                "未定位到匹配条目（multi-project 只会在当前选中子课程内查找）。\n"
-                "- 请确认复制的是该子课程的原文\n"
-                "- 或用 /pr target 切换子课程后重试"
-            )
-
-        if len(candidates) == 1:
-            c = candidates[0]
-            _PENDING[_key(event)] = Pending(
-                repo_name=pending.repo_name,
-                course_code=pending.course_code,
-                course_name=pending.course_name,
-                repo_type=pending.repo_type,
-                mode="modify_new",
-                section_title=str(c.get("section") or ""),
-                item_index=int(c.get("index") or -1),
-                old_paragraph=old,
-                target=c,
-                base_toml=r.toml,
-            )
-            if str(c.get("type")) == "section_item":
-                await matcher.finish(
-                    f"已定位到：章节《{c.get('section')}》第 {int(c.get('index') or 0)+1} 条：{c.get('preview')}\n"
-                    "请下一条消息发送修改后的完整正文。"
-                )
-            if str(c.get("type")) == "description":
-                await matcher.finish(
-                    "已定位到：description\n"
-                    f"预览：{c.get('preview')}\n"
-                    "请下一条消息发送修改后的完整正文。"
-                )
-            if str(c.get("type")) == "lecturer_review":
-                await matcher.finish(
-                    f"已定位到：lecturers《{c.get('lecturer')}》评价#{int(c.get('review_index') or 0)+1}\n"
-                    f"预览：{c.get('preview')}\n"
-                    "请下一条消息发送修改后的完整正文。"
-                )
-            if str(c.get("type")) == "course_section_item":
-                await matcher.finish(
-                    f"已定位到：子课程《{c.get('course_name')}》章节《{c.get('section')}》第 {int(c.get('index') or 0)+1} 条\n"
-                    f"预览：{c.get('preview')}\n"
-                    "请下一条消息发送修改后的完整正文。"
-                )
-            if str(c.get("type")) == "course_teacher_review":
-                await matcher.finish(
-                    f"已定位到：子课程《{c.get('course_name')}》教师《{c.get('teacher')}》评价#{int(c.get('review_index') or 0)+1}\n"
-                    f"预览：{c.get('preview')}\n"
-                    "请下一条消息发送修改后的完整正文。"
-                )
-            await matcher.finish(reply("已定位到目标。请下一条消息发送修改后的完整正文。"))
-
-        # multiple: ask choose
-        lines = ["找到多个匹配，请回复序号选择："]
-        for i, c in enumerate(candidates[:8], start=1):
-            ctype = str(c.get("type") or "")
-            if ctype == "section_item":
-                lines.append(f"{i}) [sections] 《{c.get('section')}》#{int(c.get('index') or 0)+1} {c.get('preview')}")
-            elif ctype == "description":
-                lines.append(f"{i}) [description] {c.get('preview')}")
-            elif ctype == "lecturer_review":
-                lines.append(
-                    f"{i}) [lecturers] 《{c.get('lecturer')}》评价#{int(c.get('review_index') or 0)+1} {c.get('preview')}"
-                )
-            elif ctype == "course_section_item":
-                lines.append(
-                    f"{i}) [courses.sections] 《{c.get('course_name')}》/《{c.get('section')}》#{int(c.get('index') or 0)+1} {c.get('preview')}"
-                )
-            elif ctype == "course_teacher_review":
-                lines.append(
-                    f"{i}) [courses.teachers] 《{c.get('course_name')}》/《{c.get('teacher')}》评价#{int(c.get('review_index') or 0)+1} {c.get('preview')}"
-                )
-            else:
-                lines.append(f"{i}) {c.get('preview')}")
-        if len(candidates) > 8:
-            lines.append(f"（仅展示前 8 个，共 {len(candidates)} 个匹配；建议提供更长原文缩小范围）")
-
-        _PENDING[_key(event)] = Pending(
-            repo_name=pending.repo_name,
-            course_code=pending.course_code,
-            course_name=pending.course_name,
-            repo_type=pending.repo_type,
-            mode="modify_choose",
-            candidates=candidates[:8],
-            old_paragraph=old,
-            base_toml=r.toml,
-        )
-        await matcher.finish("\n".join(lines))
-
-    if getattr(pending, "mode", None) == "modify_choose":
-        if not pending.candidates:
-            _PENDING.pop(_key(event), None)
-            await matcher.finish("状态异常：请重新 /pr modify")
-        try:
-            pick = int(text.strip())
-        except Exception:
-            await matcher.finish("请回复数字序号（例如 1）")
-        if pick <= 0 or pick > len(pending.candidates):
-            await matcher.finish("序号超出范围")
-        c = pending.candidates[pick - 1]
-        _PENDING[_key(event)] = Pending(
-            repo_name=pending.repo_name,
-            course_code=pending.course_code,
-            course_name=pending.course_name,
-            repo_type=pending.repo_type,
-            mode="modify_new",
-            section_title=str(c.get("section") or ""),
-            item_index=int(c.get("index") or -1),
-            old_paragraph=pending.old_paragraph,
-            target=c,
-            base_toml=pending.base_toml,
-        )
-        ctype2 = str(c.get("type") or "")
-        if ctype2 == "section_item":
-            await matcher.finish(
-                f"已选择：章节《{c.get('section')}》第 {int(c.get('index') or 0)+1} 条：{c.get('preview')}\n"
-                "请下一条消息发送修改后的完整正文。"
-            )
-        if ctype2 == "description":
-            await matcher.finish(reply("已选择：description\n请下一条消息发送修改后的完整正文。"))
-        if ctype2 == "lecturer_review":
-            await matcher.finish(
-                f"已选择：lecturers《{c.get('lecturer')}》评价#{int(c.get('review_index') or 0)+1}\n"
-                "请下一条消息发送修改后的完整正文。"
-            )
-        if ctype2 == "course_section_item":
-            await matcher.finish(
-                f"已选择：子课程《{c.get('course_name')}》章节《{c.get('section')}》第 {int(c.get('index') or 0)+1} 条\n"
-                "请下一条消息发送修改后的完整正文。"
-            )
-        if ctype2 == "course_teacher_review":
-            await matcher.finish(
-                f"已选择：子课程《{c.get('course_name')}》教师《{c.get('teacher')}》评价#{int(c.get('review_index') or 0)+1}\n"
-                "请下一条消息发送修改后的完整正文。"
-            )
-        await matcher.finish(reply("已选择目标。请下一条消息发送修改后的完整正文。"))
-
-    if getattr(pending, "mode", None) == "modify_new":
-        new = text.strip()
-        if not new:
-            await matcher.finish("修改后的正文不能为空")
-
-        _PENDING[_key(event)] = Pending(
-            repo_name=pending.repo_name,
-            course_code=pending.course_code,
-            course_name=pending.course_name,
-            repo_type=pending.repo_type,
-            mode="attrib_ask",
-            section_title=pending.section_title,
-            item_index=pending.item_index,
-            old_paragraph=pending.old_paragraph,
-            new_paragraph=new,
-            target=pending.target,
-            base_toml=pending.base_toml,
-        )
-        await matcher.finish("是否在该条目 author 中留名？回复 y/n")
-
-    # add/edit flow (by title/index): ask attribution after receiving content
-    if getattr(pending, "mode", None) in {"add_content", "edit_content"}:
-        content = text.strip()
-        if not content:
-            await matcher.finish("内容不能为空，请重新发送")
-        _PENDING[_key(event)] = Pending(
-            repo_name=pending.repo_name,
-            course_code=pending.course_code,
-            course_name=pending.course_name,
-            repo_type=pending.repo_type,
-            mode="attrib_ask",
-            section_title=pending.section_title,
-            item_index=pending.item_index,
-            new_paragraph=content,
-            target=pending.target,
-            base_toml=pending.base_toml,
-        )
-        await matcher.finish("是否在该条目 author 中留名？回复 y/n")
-
-    if getattr(pending, "mode", None) == "attrib_ask":
-        ans = text.strip().lower()
-        if ans in {"y", "yes", "是", "要", "留", "留名"}:
-            _PENDING[_key(event)] = Pending(
-                repo_name=pending.repo_name,
-                course_code=pending.course_code,
-                course_name=pending.course_name,
-                repo_type=pending.repo_type,
-                mode="attrib_name",
-                section_title=pending.section_title,
-                item_index=pending.item_index,
-                old_paragraph=pending.old_paragraph,
-                new_paragraph=pending.new_paragraph,
-                target=pending.target,
-                base_toml=pending.base_toml,
-                want_attribution=True,
-            )
-            await matcher.finish(reply(f"请输入显示名字（直接回车或只 @我 不带文字则用：{default_author_name}）"))
-        elif ans in {"n", "no", "否", "不要", "不留"}:
-            pending = Pending(
-                repo_name=pending.repo_name,
-                course_code=pending.course_code,
-                course_name=pending.course_name,
-                repo_type=pending.repo_type,
-                mode="build_patch",
-                section_title=pending.section_title,
-                item_index=pending.item_index,
-                old_paragraph=pending.old_paragraph,
-                new_paragraph=pending.new_paragraph,
-                target=pending.target,
-                base_toml=pending.base_toml,
-                want_attribution=False,
-            )
-            _PENDING[_key(event)] = pending
-            await matcher.send("好的，不留名。")
-            # fallthrough to build_patch below
-        else:
-            await matcher.finish(reply("请回复 y 或 n"))
-
-    if getattr(pending, "mode", None) == "attrib_name":
-        name = text.strip() or default_author_name
-        _PENDING[_key(event)] = Pending(
-            repo_name=pending.repo_name,
-            course_code=pending.course_code,
-            course_name=pending.course_name,
-            repo_type=pending.repo_type,
-            mode="attrib_link",
-            section_title=pending.section_title,
-            item_index=pending.item_index,
-            old_paragraph=pending.old_paragraph,
-            new_paragraph=pending.new_paragraph,
-            target=pending.target,
-            base_toml=pending.base_toml,
-            want_attribution=True,
-            author_name=name,
-        )
-        await matcher.finish(reply("可选：请输入你的主页链接（GitHub/博客等），留空（或只 @我 不带文字）则不填"))
-
-    if getattr(pending, "mode", None) == "attrib_link":
-        link = text.strip()
-        pending = Pending(
-            repo_name=pending.repo_name,
-            course_code=pending.course_code,
-            course_name=pending.course_name,
-            repo_type=pending.repo_type,
-            mode="build_patch",
-            section_title=pending.section_title,
-            item_index=pending.item_index,
-            old_paragraph=pending.old_paragraph,
-            new_paragraph=pending.new_paragraph,
-            target=pending.target,
-            base_toml=pending.base_toml,
-            want_attribution=True,
-            author_name=pending.author_name,
-            author_link=link,
-        )
-        _PENDING[_key(event)] = pending
-        await matcher.send("收到。")
-        # fallthrough to build_patch below
-
-    if getattr(pending, "mode", None) == "build_patch":
-        author = None
-        if getattr(pending, "want_attribution", False):
-            author = {
-                "name": getattr(pending, "author_name", default_author_name),
-                "link": getattr(pending, "author_link", ""),
-                "date": _year_month(),
-            }
-
-        # append operations are patched locally (prServer submit_ops 不支持这些追加类操作)
-        ttype0 = str(((pending.target or {}) if isinstance(pending.target, dict) else {}).get("type") or "")
-        if ttype0 in {"append_course", "append_course_section_item", "append_course_teacher_review", "append_lecturer_review"}:
-            repo_key = (getattr(pending, "repo_name", "") or getattr(pending, "course_code", "") or "").strip()
-            if not repo_key:
-                _PENDING.pop(_key(event), None)
-                await matcher.finish("缺少仓库标识（repo_name/course_code），请重新 /pr start")
-
-            r0 = await get_course_toml(repo_name=repo_key)
-            if not r0.ok or not r0.toml:
-                _PENDING.pop(_key(event), None)
-                await matcher.finish(f"拉取失败：{r0.message}")
-
-            try:
-                if ttype0 == "append_lecturer_review":
-                    patched_toml = _append_normal_lecturer_review(
-                        r0.toml,
-                        lecturer=str((getattr(pending, "target", {}) or {}).get("lecturer") or "").strip(),
-                        content=getattr(pending, "new_paragraph", "") or "",
-                        author=author,
-                    )
-                else:
-                    patched_toml = _append_toml_by_target(
-                        r0.toml,
-                        target=getattr(pending, "target", {}) or {},
-                        content=getattr(pending, "new_paragraph", "") or "",
-                        author=author,
-                    )
-            except Exception as e:
-                _PENDING.pop(_key(event), None)
-                await matcher.finish(f"生成失败：{e}")
-
-            new_preview = (getattr(pending, "new_paragraph", "") or "").strip()
-            if new_preview and len(new_preview) > 200:
-                new_preview = new_preview[:199] + "…"
-
-            _PENDING[_key(event)] = Pending(
-                repo_name=getattr(pending, "repo_name", ""),
-                course_code=getattr(pending, "course_code", ""),
-                course_name=getattr(pending, "course_name", ""),
-                repo_type=getattr(pending, "repo_type", ""),
-                mode="confirm",
-                new_paragraph=getattr(pending, "new_paragraph", ""),
-                want_attribution=getattr(pending, "want_attribution", False),
-                author_name=getattr(pending, "author_name", ""),
-                author_link=getattr(pending, "author_link", ""),
-                patched_toml=patched_toml,
-                target=getattr(pending, "target", {}) or {},
-            )
-
-            msg = ["即将提交：multi-project 追加".strip()]
-            if new_preview:
-                msg.append(f"\n新增内容（截断）：\n{new_preview}")
-            msg.append("\n回复：确认 / 取消")
-            await matcher.finish(reply("\n".join(msg)))
-
-        if getattr(pending, "old_paragraph", None) and getattr(pending, "target", None):
-            ttype = str((pending.target or {}).get("type") or "")
-            if ttype == "section_item":
-                fields = {"content": getattr(pending, "new_paragraph", "")}
-                if author:
-                    fields["author"] = author
-                ops = [
-                    {
-                        "op": "update_section_item",
-                        "section": getattr(pending, "section_title", ""),
-                        "index": getattr(pending, "item_index", -1),
-                        "fields": fields,
-                    }
-                ]
-            else:
-                # local patch for targets not supported by submit_ops
-                if not getattr(pending, "base_toml", None):
-                    _PENDING.pop(_key(event), None)
-                    await matcher.finish("状态异常：缺少 base TOML，请重新 /pr modify")
-                await matcher.send("正在生成修改后的 TOML...")
-                try:
-                    patched_toml = _patch_toml_by_target(
-                        getattr(pending, "base_toml", ""),
-                        target=getattr(pending, "target", {}),
-                        old_paragraph=getattr(pending, "old_paragraph", ""),
-                        new_paragraph=getattr(pending, "new_paragraph", ""),
-                        author=author,
-                    )
-                except Exception as e:
-                    await matcher.finish(f"生成失败：{e}")
-
-                _PENDING[_key(event)] = Pending(
-                    repo_name=getattr(pending, "repo_name", ""),
-                    course_code=getattr(pending, "course_code", ""),
-                    course_name=getattr(pending, "course_name", ""),
-                    repo_type=getattr(pending, "repo_type", ""),
-                    mode="build_patch",
-                    section_title=getattr(pending, "section_title", ""),
-                    item_index=getattr(pending, "item_index", -1),
-                    old_paragraph=getattr(pending, "old_paragraph", ""),
-                    new_paragraph=getattr(pending, "new_paragraph", ""),
-                    target=getattr(pending, "target", {}),
-                    base_toml=getattr(pending, "base_toml", ""),
-                    want_attribution=True,
-                    author_name=getattr(pending, "author_name", ""),
-                    author_link=getattr(pending, "author_link", ""),
-                )
-
-                old_preview = (getattr(pending, "old_paragraph", "") or "").strip()
-                if old_preview and len(old_preview) > 200:
-                    old_preview = old_preview[:199] + "…"
-                new_preview = (getattr(pending, "new_paragraph", "") or "").strip()
-                if new_preview and len(new_preview) > 200:
-                    new_preview = new_preview[:199] + "…"
-
-                msg = ["即将提交：定位修改".strip()]
-                if old_preview:
-                    msg.append(f"\n原段落（截断）：\n{old_preview}")
-                msg.append(f"\n新段落（截断）：\n{new_preview}")
-                msg.append("\n回复：确认 / 取消")
-                await matcher.finish(reply("\n".join(msg)))
-        elif getattr(pending, "item_index", -1) >= 0:
-            fields2 = {"content": getattr(pending, "new_paragraph", "")}
-            if author:
-                fields2["author"] = author
-            ops = [
-                {
-                    "op": "update_section_item",
-                    "section": getattr(pending, "section_title", ""),
-                    "index": getattr(pending, "item_index", -1),
-                    "fields": fields2,
-                }
-            ]
-        else:
-            item = {"content": getattr(pending, "new_paragraph", "")}
-            if author:
-                item["author"] = author
-            ops = [
-                {
-                    "op": "append_section_item",
-                    "section": getattr(pending, "section_title", ""),
-                    "item": item,
-                }
-            ]
-
-        await matcher.send("正在生成修改后的 TOML...")
-        patched = await submit_ops_dry_run(
-            repo_name=getattr(pending, "repo_name", ""),
-            course_code=getattr(pending, "course_code", ""),
-            course_name=getattr(pending, "course_name", ""),
-            repo_type=getattr(pending, "repo_type", ""),
-            ops=ops,
-        )
-        if not patched.ok or not patched.toml:
-            _PENDING.pop(_key(event), None)
-            await matcher.finish(f"生成失败：{patched.message}")
-
-        info = ""
-        if getattr(pending, "section_title", ""):
-            info = f"章节《{getattr(pending, "section_title", "")}》"
-        if getattr(pending, "item_index", -1) >= 0:
-            info += f" 第 {getattr(pending, "item_index", -1)+1} 条"
-        old_preview = (getattr(pending, "old_paragraph", "") or "").strip()
-        if old_preview and len(old_preview) > 200:
-            old_preview = old_preview[:199] + "…"
-        new_preview = (getattr(pending, "new_paragraph", "") or "").strip()
-        if new_preview and len(new_preview) > 200:
-            new_preview = new_preview[:199] + "…"
-
-        _PENDING[_key(event)] = Pending(
-            repo_name=getattr(pending, "repo_name", ""),
-            course_code=getattr(pending, "course_code", ""),
-            course_name=getattr(pending, "course_name", ""),
-            repo_type=getattr(pending, "repo_type", ""),
-            mode="confirm",
-            section_title=getattr(pending, "section_title", ""),
-            item_index=getattr(pending, "item_index", -1),
-            old_paragraph=getattr(pending, "old_paragraph", ""),
-            new_paragraph=getattr(pending, "new_paragraph", ""),
-            want_attribution=getattr(pending, "want_attribution", False),
-            author_name=getattr(pending, "author_name", ""),
-            author_link=getattr(pending, "author_link", ""),
-            patched_toml=patched.toml,
-            target=pending.target,
-            base_toml=getattr(pending, "base_toml", ""),
-        )
-
-        msg = [f"即将提交：{info}".strip()]
-        if old_preview:
-            msg.append(f"\n原段落（截断）：\n{old_preview}")
-        msg.append(f"\n新段落（截断）：\n{new_preview}")
-        msg.append("\n回复：确认 / 取消")
-        await matcher.finish(reply("\n".join(msg)))
-
-    if getattr(pending, "mode", None) == "confirm":
-        ans2 = text.strip().lower()
-        if ans2 in {"取消", "cancel", "c", "n", "no"}:
-            _PENDING.pop(_key(event), None)
-            await matcher.finish("已取消本次修改")
-        if ans2 not in {"确认", "confirm", "y", "yes", "是"}:
-            await matcher.finish(reply("请回复：确认 或 取消"))
-
-        if not getattr(pending, "patched_toml", None):
-            _PENDING.pop(_key(event), None)
-            await matcher.finish("状态异常：缺少 patched TOML，请重新开始")
-
-        await matcher.send(reply("正在进行内容合规审核..."))
-        mod = await moderate_toml(getattr(pending, "patched_toml", ""))
-        if not mod.approved:
-            _PENDING.pop(_key(event), None)
-            await matcher.finish(f"审核未通过：{mod.reason}")
-
-        await matcher.send(reply("审核通过，正在提交并确保 PR..."))
-        result = await ensure_pr(
-            repo_name=getattr(pending, "repo_name", ""),
-            course_code=getattr(pending, "course_code", ""),
-            course_name=getattr(pending, "course_name", ""),
-            repo_type=getattr(pending, "repo_type", ""),
-            toml_text=getattr(pending, "patched_toml", ""),
-        )
-        _PENDING.pop(_key(event), None)
-        if not result.ok:
-            await matcher.finish(f"提交失败：{result.message}")
-        if result.pr_url:
-            await matcher.finish(f"已创建/更新 PR：{result.pr_url}")
-        if result.request_id:
-            await matcher.finish(f"仓库不存在，已进入 pending：request_id={result.request_id}")
-        await matcher.finish(f"提交完成：{result.message}")
+    handler = _MODE_HANDLERS.get(pending.mode)
+    while handler is not None:
+        nxt = await handler(event, pending, text, k)
+        if nxt is None:
+            break
+        pending = nxt
+        handler = _MODE_HANDLERS.get(pending.mode)
 
     # unknown mode
-    _PENDING.pop(_key(event), None)
+    _PENDING.pop(k, None)
     await matcher.finish("状态异常：已重置会话，请重新 /pr start")
-
-    if result.pr_url:
-        await matcher.finish(f"✅ 已创建 PR：{result.pr_url}")
-
-    if result.request_id:
-        await matcher.finish(f"✅ 已进入 pending：request_id={result.request_id}")
-
-    await matcher.finish(f"✅ 提交完成：{result.message}")